@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Imported once the app registry is ready; serves /polls/<id>/live/ as a stream
+from polls.live import LiveResultsApp  # noqa: E402
+
+application = LiveResultsApp(application)
@@ -0,0 +1,56 @@
+"""
+SQLite backend tuned for concurrent writes.
+
+It behaves like django.db.backends.sqlite3 and accepts these extra OPTIONS:
+
+    journal_mode      e.g. 'WAL', so readers do not block the writer
+    synchronous       e.g. 'NORMAL', which is safe with WAL and fsyncs less
+    busy_timeout      milliseconds to wait for a lock before "database is locked"
+    transaction_mode  'IMMEDIATE' takes the write lock when a transaction starts,
+                      so a read-then-write transaction (such as a vote) cannot
+                      fail halfway when it tries to upgrade its lock
+
+The pragmas are applied to every new connection.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMA_VALUES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+}
+TRANSACTION_MODES = {'DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {}
+        for name, allowed in PRAGMA_VALUES.items():
+            if options.get(name):
+                value = str(options[name]).upper()
+                if value not in allowed:
+                    raise ImproperlyConfigured(f"Unsupported SQLite {name} {options[name]!r}.")
+                self.pragmas[name] = value
+        if options.get('busy_timeout') is not None:
+            self.pragmas['busy_timeout'] = int(options['busy_timeout'])
+        self.transaction_mode = str(options.get('transaction_mode') or 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"Unsupported SQLite transaction_mode {self.transaction_mode!r}.")
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for name in (*PRAGMA_VALUES, 'busy_timeout', 'transaction_mode'):
+            kwargs.pop(name, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -10,12 +10,18 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
-from decouple import config
+import json
+import sys
+
+from decouple import Csv, config
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# True under `manage.py test`
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -42,17 +48,30 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',  
+    'polls.middleware.PrimaryPinningMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'polls.middleware.ProfilingMiddleware',
 ]
 
 
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# POLLS_FAST_SESSIONS keeps sessions in the cache, written through to the
+# database only when they change, and sends flash messages (such as vote
+# confirmations) in a signed cookie, so a vote never touches the session table.
+# Use a cache shared by all processes (CACHE_BACKEND) when it is on.
+POLLS_FAST_SESSIONS = config('POLLS_FAST_SESSIONS', cast=bool, default=False)
+
+if POLLS_FAST_SESSIONS:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+else:
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 
 ROOT_URLCONF = 'mysite.urls'
 
@@ -78,13 +97,132 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLITE_HIGH_CONCURRENCY switches the SQLite database to WAL journaling with a
+# busy timeout, IMMEDIATE write transactions and persistent connections, for
+# deployments that take concurrent votes (see mysite/backends/sqlite3/base.py).
+SQLITE_HIGH_CONCURRENCY = config('SQLITE_HIGH_CONCURRENCY', cast=bool, default=False)
+
+if SQLITE_HIGH_CONCURRENCY:
+    SQLITE_OPTIONS = {
+        'journal_mode': 'WAL',
+        'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+        'busy_timeout': config('SQLITE_BUSY_TIMEOUT', cast=int, default=5000),
+        'transaction_mode': 'IMMEDIATE',
+    }
+    # Tests run against a file too, so they see the same locking as production
+    SQLITE_TEST = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+else:
+    SQLITE_OPTIONS = {}
+    SQLITE_TEST = {}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mysite.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': config('CONN_MAX_AGE', cast=int, default=600 if SQLITE_HIGH_CONCURRENCY else 0),
+        'TEST': SQLITE_TEST,
     }
 }
 
+# Read replicas of the default database, given as SQLite file names.
+# Reads by the poll views are spread over them (see polls/routers.py).
+POLLS_DATABASE_REPLICAS = []
+if TESTING:
+    # The suite routes everything to 'default'; ReplicaRoutingTests routes
+    # reads to this mirror of the test database instead of the real replicas
+    DATABASES['test_replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+else:
+    for number, replica_name in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), start=1):
+        alias = f'replica{number}'
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'NAME': BASE_DIR / replica_name,
+            'TEST': {'MIRROR': 'default'},
+        }
+        POLLS_DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['polls.routers.PrimaryReplicaRouter']
+
+# Seconds a client's reads stay on the primary after it writes (e.g. votes)
+POLLS_REPLICA_STICKY_SECONDS = config('POLLS_REPLICA_STICKY_SECONDS', cast=int, default=10)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='ku-polls'),
+    }
+}
+
+# Seconds a question's cached results are kept (they are also invalidated on every vote)
+POLLS_RESULTS_CACHE_TIMEOUT = config('POLLS_RESULTS_CACHE_TIMEOUT', cast=int, default=3600)
+
+# Number of questions on each page of the poll index
+POLLS_INDEX_PAGE_SIZE = config('POLLS_INDEX_PAGE_SIZE', cast=int, default=20)
+# Largest ?limit accepted by the JSON question list (polls/api.py)
+POLLS_API_MAX_PAGE_SIZE = config('POLLS_API_MAX_PAGE_SIZE', cast=int, default=100)
+
+# Search index for the poll index page (see polls/search.py): 'fts5' (SQLite
+# FTS5), 'tokens' (a word table that works on any database) or 'auto' for FTS5
+# where available; run `manage.py rebuild_search_index` after changing it
+POLLS_SEARCH_BACKEND = config('POLLS_SEARCH_BACKEND', default='auto')
+
+# 'sync' writes each vote in the request; 'queued' hands it to a background
+# worker that writes votes in batches (see polls/vote_queue.py)
+POLLS_VOTE_MODE = config('POLLS_VOTE_MODE', default='sync')
+POLLS_VOTE_QUEUE_BATCH_SIZE = config('POLLS_VOTE_QUEUE_BATCH_SIZE', cast=int, default=500)
+# Longest time in seconds a queued vote waits before it is written
+POLLS_VOTE_QUEUE_MAX_DELAY = config('POLLS_VOTE_QUEUE_MAX_DELAY', cast=float, default=1.0)
+
+# Seconds after a poll closes before its tallies are frozen into a ResultSnapshot,
+# leaving time for votes sent just before the close to be written
+POLLS_FINALIZE_DELAY = config('POLLS_FINALIZE_DELAY', cast=float, default=60)
+
+# Seconds between checks for new votes by the live results stream (polls/live.py);
+# clients get at most one update per interval
+POLLS_LIVE_INTERVAL = config('POLLS_LIVE_INTERVAL', cast=float, default=1.0)
+
+# Seconds the vote rollup job (polls/rollups.py) stays behind the newest vote
+# events, so transactions still writing older events have committed
+POLLS_ROLLUP_LAG = config('POLLS_ROLLUP_LAG', cast=float, default=5)
+
+# Request instrumentation (see polls.middleware.InstrumentationMiddleware)
+# Off by default: the header tells every client how many queries a page ran and how long they took
+POLLS_SERVER_TIMING = config('POLLS_SERVER_TIMING', cast=bool, default=False)
+# Share of requests logged to 'polls.instrumentation'; requests over budget are always logged
+POLLS_INSTRUMENTATION_SAMPLE_RATE = config('POLLS_INSTRUMENTATION_SAMPLE_RATE', cast=float, default=0.01)
+# Query-count and latency (ms) budgets per URL name
+POLLS_REQUEST_BUDGETS = config('POLLS_REQUEST_BUDGETS', cast=json.loads, default=json.dumps({
+    'polls:index': {'queries': 6, 'ms': 200},
+    'polls:detail': {'queries': 6, 'ms': 200},
+    'polls:results': {'queries': 8, 'ms': 200},
+    'polls:vote': {'queries': 16, 'ms': 500},
+}))
+
+# On-demand cProfile capture for staff (see polls.middleware.ProfilingMiddleware)
+POLLS_PROFILE_DIR = config('POLLS_PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+# Oldest .prof files are removed once the directory grows over this many bytes
+POLLS_PROFILE_MAX_BYTES = config('POLLS_PROFILE_MAX_BYTES', cast=int, default=50 * 1024 * 1024)
+POLLS_PROFILE_TOP_N = config('POLLS_PROFILE_TOP_N', cast=int, default=10)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        'null': {'class': 'logging.NullHandler'},
+    },
+    'loggers': {
+        # Kept out of the test output; the tests read the records with assertLogs()
+        'polls.instrumentation': {'handlers': ['null' if TESTING else 'console'], 'level': 'INFO',
+                                  'propagate': False},
+    },
+}
+
 
 AUTHENTICATION_BACKENDS = [
     # username & password authentication
@@ -1,7 +1,132 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from .models import Question, Choice
+from .cache import invalidate_index
+from .models import Choice, ChoiceCounterShard, Question, Vote
 
-admin.site.register(Question)
 
-admin.site.register(Choice)
\ No newline at end of file
+class ChoiceInline(admin.TabularInline):
+    model = Choice
+    fields = ('choice_text', 'total_votes')
+    readonly_fields = ('total_votes',)
+    extra = 1
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='Votes')
+    def total_votes(self, choice):
+        return getattr(choice, 'total_votes', 0)
+
+
+@admin.register(Question)
+class QuestionAdmin(admin.ModelAdmin):
+    """
+    Questions with their choices inline and vote totals summed in the changelist query.
+
+    The bulk actions run one UPDATE (close now) or one DELETE plus one UPDATE
+    (reset votes) for the whole selection instead of saving each question.
+    """
+    inlines = [ChoiceInline]
+    list_display = ('question_text', 'poll_type', 'pub_date', 'end_date', 'total_votes')
+    list_filter = ('poll_type', 'pub_date', 'end_date')
+    search_fields = ('question_text',)
+    date_hierarchy = 'pub_date'
+    ordering = ('-pub_date',)
+    list_per_page = 50
+    actions = ('close_now', 'reset_votes')
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith('changelist'):
+            shards = (ChoiceCounterShard.objects.filter(choice__question=OuterRef('pk')).order_by()
+                      .values('choice__question').annotate(total=Sum('count')).values('total'))
+            queryset = queryset.annotate(
+                total_votes=Coalesce(Sum('choice__vote_count'), 0) + Coalesce(Subquery(shards), 0),
+            )
+        return queryset
+
+    @admin.display(description='Votes', ordering='total_votes')
+    def total_votes(self, question):
+        return question.total_votes
+
+    @admin.action(description='Close voting now')
+    def close_now(self, request, queryset):
+        now = timezone.now()
+        with transaction.atomic():
+            closed = (queryset.filter(Q(end_date__isnull=True) | Q(end_date__gt=now), pub_date__lte=now)
+                      .update(end_date=now))
+            # update() sends no signals
+            transaction.on_commit(invalidate_index)
+        self.message_user(request, f"Closed {closed} poll(s).", messages.SUCCESS)
+
+    @admin.action(description='Reset votes')
+    def reset_votes(self, request, queryset):
+        deleted = Vote.objects.reset(queryset.values_list('pk', flat=True))
+        self.message_user(request, f"Deleted {deleted} vote(s).", messages.SUCCESS)
+
+
+@admin.register(Choice)
+class ChoiceAdmin(admin.ModelAdmin):
+    list_display = ('choice_text', 'question', 'total_votes')
+    list_select_related = ('question',)
+    readonly_fields = ('vote_count',)
+    autocomplete_fields = ('question',)
+    search_fields = ('choice_text', 'question__question_text')
+    list_per_page = 100
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description='Votes', ordering='total_votes')
+    def total_votes(self, choice):
+        return choice.total_votes
+
+
+class VoteAdminForm(forms.ModelForm):
+    class Meta:
+        model = Vote
+        fields = ('user', 'question', 'choice')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        question, choice = cleaned_data.get('question'), cleaned_data.get('choice')
+        if question and question.uses_ballots():
+            raise forms.ValidationError("Votes on approval and ranked-choice polls are cast as ballots.")
+        if question and choice and choice.question_id != question.id:
+            raise forms.ValidationError("The choice does not belong to the question.")
+        return cleaned_data
+
+
+@admin.register(Vote)
+class VoteAdmin(admin.ModelAdmin):
+    """
+    Votes are added through Vote.objects.cast() and deleted through withdraw(),
+    so the Choice.vote_count counters and the caches stay in step. A vote
+    cannot be edited; delete it and add another instead.
+    """
+    form = VoteAdminForm
+    list_display = ('user', 'question', 'choice')
+    list_select_related = ('user', 'question', 'choice')
+    autocomplete_fields = ('user', 'question', 'choice')
+    search_fields = ('user__username', 'question__question_text')
+    list_per_page = 100
+    # Counting every vote for the "N total" link is slow on a large table
+    show_full_result_count = False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        Vote.objects.cast(obj.user, obj.question, obj.choice)
+        obj.pk = Vote.objects.using(Vote.objects.write_db).get(user=obj.user, question=obj.question).pk
+
+    def delete_model(self, request, obj):
+        Vote.objects.withdraw(Vote.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        Vote.objects.withdraw(queryset)
@@ -0,0 +1,279 @@
+"""
+JSON API for the poll list, per-question tallies and vote trends, and for
+authoring polls in bulk.
+
+The list and tally endpoints answer conditional GETs: the ETag and
+Last-Modified headers come from versions kept in the cache (see
+polls/cache.py), so a client whose copy is current gets 304 Not Modified
+without a single query or any vote counting. The trend's ETag is the vote
+rollup's high-water mark (see polls/rollups.py). Responses carry Cache-Control: no-cache so clients always
+revalidate instead of guessing a freshness lifetime from Last-Modified.
+
+The import endpoint takes a CSV or JSON batch of polls (see
+polls/authoring.py) from users allowed to add questions and choices.
+"""
+import io
+from functools import wraps
+
+from django.conf import settings
+from django.db import router
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST, require_safe
+
+from . import authoring
+from .cache import get_results, get_runoff, index_boundary, index_version, results_last_modified, results_version
+from .models import Question
+from .pagination import KeysetPaginator
+from .rollups import INTERVALS, rollup_position, trend as vote_trend
+
+QUESTION_FIELDS = ('id', 'question_text', 'pub_date', 'end_date', 'state', 'results_url')
+CHOICE_FIELDS = ('id', 'choice_text', 'vote_count')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def selected_fields(request, allowed):
+    """
+    Return the fields asked for with ?fields=a,b (all of `allowed` by default).
+
+    Raises:
+        BadRequest: If a field is not in `allowed`.
+    """
+    if not request.GET.get('fields'):
+        return allowed
+    fields = tuple(field.strip() for field in request.GET['fields'].split(',') if field.strip())
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(allowed)}.")
+    return fields
+
+
+def page_size(request):
+    """
+    Return the ?limit page size, between 1 and POLLS_API_MAX_PAGE_SIZE.
+
+    Raises:
+        BadRequest: If the limit is not a positive integer.
+    """
+    try:
+        limit = int(request.GET.get('limit', settings.POLLS_INDEX_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("limit must be an integer.")
+    if limit < 1:
+        raise BadRequest("limit must be at least 1.")
+    return min(limit, settings.POLLS_API_MAX_PAGE_SIZE)
+
+
+def datetime_param(request, name):
+    """
+    Return the ISO 8601 datetime query parameter `name`, or None if it is not given.
+
+    Raises:
+        BadRequest: If the value is not a datetime.
+    """
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise BadRequest(f"{name} must be an ISO 8601 datetime.")
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def bad_request(view):
+    """
+    Turn BadRequest into a 400 JSON response.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+    return wrapper
+
+
+def questions_etag(request):
+    # The list changes when a question is saved or deleted, or opens or closes
+    return f"{index_version()}-{index_boundary()['since'].timestamp()}"
+
+
+def questions_last_modified(request):
+    return index_boundary()['since']
+
+
+def results_etag(request, question_id):
+    # Runs before the 404 check, so it must not seed keys for ids that do not exist;
+    # results() seeds them for real questions
+    version = results_version(question_id, create=False)
+    return None if version is None else str(version)
+
+
+def results_modified(request, question_id):
+    return results_last_modified(question_id, create=False)
+
+
+def trend_etag(request, question_id):
+    # The rollups only change when the rollup job moves its high-water mark
+    return str(rollup_position())
+
+
+@require_safe
+@cache_control(no_cache=True)
+@condition(etag_func=questions_etag, last_modified_func=questions_last_modified)
+@bad_request
+def questions(request):
+    """
+    List published questions, newest first, a page at a time.
+
+    Query parameters:
+        fields: Comma-separated subset of QUESTION_FIELDS.
+        limit: Questions per page.
+        cursor: The 'next_cursor' of the previous page.
+
+    Returns:
+        JsonResponse: {'results': [...], 'next_cursor': str or None}.
+    """
+    fields = selected_fields(request, QUESTION_FIELDS)
+    now = timezone.now()
+    # Read from the primary so the body never lags behind its ETag
+    queryset = (Question.objects.using(router.db_for_write(Question)).published(now).annotate_state(now)
+                .only('id', 'pub_date', *(field for field in fields if field in ('question_text', 'end_date'))))
+    paginator = KeysetPaginator(queryset, ('-pub_date', '-id'), page_size(request))
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except ValueError:
+        raise BadRequest("Invalid cursor.")
+
+    results = []
+    for question in page:
+        item = {}
+        for field in fields:
+            if field == 'results_url':
+                item[field] = request.build_absolute_uri(reverse('polls:api-results', args=(question.id,)))
+            else:
+                item[field] = getattr(question, field)
+        results.append(item)
+    return JsonResponse({'results': results, 'next_cursor': page.next_cursor})
+
+
+@require_safe
+@cache_control(no_cache=True)
+@condition(etag_func=results_etag, last_modified_func=results_modified)
+@bad_request
+def results(request, question_id):
+    """
+    Return the tallies of a published question.
+
+    Query parameters:
+        fields: Comma-separated subset of CHOICE_FIELDS for each choice.
+
+    On an approval poll vote_count is the number of ballots approving the
+    choice, so total_votes counts approvals; on a ranked-choice poll it is
+    the number of first preferences, and 'runoff' holds the rounds.
+
+    Returns:
+        JsonResponse: {'id': int, 'poll_type': str, 'total_votes': int,
+        'choices': [...]}, plus 'runoff' on a ranked-choice poll.
+    """
+    fields = selected_fields(request, CHOICE_FIELDS)
+    question = get_object_or_404(Question.objects.published().only('id', 'end_date', 'poll_type'), pk=question_id)
+    tallies = get_results(question)
+    data = {
+        'id': question.id,
+        'poll_type': question.poll_type,
+        'total_votes': sum(choice['vote_count'] for choice in tallies),
+        'choices': [{field: choice[field] for field in fields} for choice in tallies],
+    }
+    if question.poll_type == Question.RANKED:
+        data['runoff'] = get_runoff(question)
+    response = JsonResponse(data)
+    # @condition leaves these out when the keys did not exist yet
+    response['ETag'] = quote_etag(str(results_version(question.id)))
+    response['Last-Modified'] = http_date(results_last_modified(question.id).timestamp())
+    return response
+
+
+@require_safe
+@cache_control(no_cache=True)
+@condition(etag_func=trend_etag)
+@bad_request
+def trend(request, question_id):
+    """
+    Return the votes each choice of a published question gained and lost over time.
+
+    Read from the per-minute vote rollups, so the newest votes appear once
+    `manage.py rollup_votes` has run. Ballots on approval and ranked-choice
+    polls are not logged as vote events, so those polls have no trend.
+
+    Query parameters:
+        interval: 'minute' (the default), 'hour' or 'day'.
+        since: ISO 8601 datetime of the first interval.
+        until: ISO 8601 datetime to stop before.
+
+    Returns:
+        JsonResponse: {'id': int, 'interval': str, 'intervals': [{'start': str,
+        'choices': [{'id': int, 'added': int, 'removed': int}, ...]}, ...]}.
+    """
+    interval = request.GET.get('interval', 'minute')
+    if interval not in INTERVALS:
+        raise BadRequest(f"interval must be one of: {', '.join(INTERVALS)}.")
+    since, until = datetime_param(request, 'since'), datetime_param(request, 'until')
+    question = get_object_or_404(Question.objects.published().only('id', 'poll_type'), pk=question_id)
+    if question.uses_ballots():
+        raise BadRequest("Vote trends are only kept for single-choice polls.")
+    return JsonResponse({
+        'id': question.id,
+        'interval': interval,
+        'intervals': vote_trend(question.id, interval, since, until),
+    })
+
+
+@require_POST
+@bad_request
+def import_polls(request):
+    """
+    Create the polls of a CSV or JSON batch in one transaction.
+
+    The request body is the batch, with Content-Type text/csv or
+    application/json. Every row is validated before anything is written;
+    if any row is invalid, no poll is created.
+
+    Query parameters:
+        dry_run: '1' to only validate the batch.
+
+    Returns:
+        JsonResponse: 201 with {'created': [{'id': int, 'question_text': str}, ...]},
+        200 with {'valid': int} on a dry run, or 400 with {'errors': [{'row':
+        int, 'errors': {field: [str, ...]}}, ...]}.
+    """
+    if not request.user.has_perms(('polls.add_question', 'polls.add_choice')):
+        return JsonResponse({'error': "You may not add polls."}, status=403)
+    formats = {content_type: fmt for fmt, content_type in authoring.FORMATS.items()}
+    if request.content_type not in formats:
+        return JsonResponse({'error': f"Send the batch as {' or '.join(formats)}."}, status=415)
+    try:
+        body = request.body.decode(request.encoding or 'utf-8')
+        rows = authoring.read_rows(io.StringIO(body, newline=''), formats[request.content_type])
+    except (authoring.BatchError, UnicodeDecodeError) as exc:
+        raise BadRequest(str(exc))
+
+    dry_run = request.GET.get('dry_run') == '1'
+    questions, errors = authoring.import_polls(rows, dry_run=dry_run)
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    if dry_run:
+        return JsonResponse({'valid': len(questions)})
+    return JsonResponse({'created': [{'id': question.id, 'question_text': question.question_text}
+                                     for question in questions]}, status=201)
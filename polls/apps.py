@@ -14,3 +14,6 @@ class PollsConfig(AppConfig):
     
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,247 @@
+"""
+Bulk authoring of polls from CSV or JSON.
+
+A batch describes any number of questions with their choices, publication
+dates and end dates. read_rows() parses it, and import_polls() validates
+every row before it writes anything. A batch with an invalid row is
+rejected whole, with the errors of every row. A valid batch goes in with
+bulk_create, questions then choices, in one transaction. No model signals
+are sent, so the search index and the cached poll index are updated once
+for the whole batch.
+
+CSV batches have a header row. The columns are question_text, pub_date,
+end_date and poll_type, plus one 'choice' column per choice; empty choice
+cells are ignored:
+
+    question_text,pub_date,end_date,choice,choice,choice
+    Best season?,2024-06-01T09:00:00+00:00,2024-06-08T09:00:00+00:00,Spring,Summer,Autumn
+
+JSON batches are a list of objects with the same keys, except that the
+choices are a list under 'choices':
+
+    [{"question_text": "Best season?", "pub_date": "2024-06-01T09:00:00+00:00",
+      "choices": ["Spring", "Summer", "Autumn"]}]
+
+Dates are ISO 8601; dates without a time zone are in the current time zone.
+"""
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalidate_index
+from .models import Choice, Question
+from .search import get_index
+
+FORMATS = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+}
+FIELDS = ('question_text', 'pub_date', 'end_date', 'poll_type', 'choices')
+CHOICE_COLUMN = 'choice'
+CSV_COLUMNS = (*FIELDS[:-1], CHOICE_COLUMN)
+MIN_CHOICES = 2
+BATCH_SIZE = 500
+
+
+class BatchError(ValueError):
+    """
+    The batch as a whole cannot be read, e.g. malformed JSON or an unknown CSV column.
+    """
+
+
+def read_rows(stream, fmt):
+    """
+    Read the rows of a batch.
+
+    Args:
+        stream (file): Text stream with the batch.
+        fmt (str): One of FORMATS.
+
+    Returns:
+        list: (row number, dict) pairs, numbered by CSV line or JSON list position.
+
+    Raises:
+        BatchError: If the batch cannot be read or `fmt` is unknown.
+    """
+    if fmt == 'csv':
+        return _read_csv(stream)
+    if fmt == 'json':
+        return _read_json(stream)
+    raise BatchError(f"Unknown batch format: {fmt!r}.")
+
+
+def _read_csv(stream):
+    reader = csv.reader(stream)
+    header = [column.strip() for column in next(reader, [])]
+    unknown = sorted(set(header) - set(CSV_COLUMNS))
+    if unknown:
+        raise BatchError(f"Unknown columns: {', '.join(unknown)}. Use {', '.join(CSV_COLUMNS)}.")
+    if 'question_text' not in header:
+        raise BatchError("The CSV header has no question_text column.")
+
+    rows = []
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        row = {'choices': []}
+        for column, value in zip(header, values):
+            if column == CHOICE_COLUMN:
+                if value.strip():
+                    row['choices'].append(value)
+            elif value.strip():
+                row[column] = value
+        if len(values) > len(header):
+            # Reported by build_poll() rather than dropped
+            row['_columns'] = len(values)
+        rows.append((reader.line_num, row))
+    return rows
+
+
+def _read_json(stream):
+    try:
+        data = json.load(stream)
+    except json.JSONDecodeError as exc:
+        raise BatchError(f"Invalid JSON: {exc}") from exc
+    if not isinstance(data, list):
+        raise BatchError("A JSON batch must be a list of objects.")
+    rows = []
+    for number, row in enumerate(data, start=1):
+        if not isinstance(row, dict):
+            raise BatchError(f"Entry {number} of the batch is not an object.")
+        rows.append((number, row))
+    return rows
+
+
+def _parse_moment(value):
+    """
+    Returns:
+        datetime or None: `value` as an aware datetime, or None if it is not an ISO 8601 datetime.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = parse_datetime(value.strip())
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def build_poll(row):
+    """
+    Build the unsaved question and choices of one row and validate them.
+
+    Returns:
+        tuple: (question, choices, errors), where errors maps field names to
+        lists of messages and is empty for a valid row.
+    """
+    errors = {}
+    if '_columns' in row:
+        errors.setdefault('__all__', []).append(f"The row has {row['_columns']} cells but the header has fewer.")
+    unknown = sorted(set(row) - set(FIELDS) - {'_columns'})
+    if unknown:
+        errors.setdefault('__all__', []).append(f"Unknown fields: {', '.join(unknown)}.")
+
+    question = Question(question_text=row.get('question_text', ''), poll_type=row.get('poll_type') or Question.SINGLE)
+    for field in ('pub_date', 'end_date'):
+        value = row.get(field)
+        if value in (None, ''):
+            continue
+        moment = _parse_moment(value)
+        if moment is None:
+            errors[field] = ["Enter an ISO 8601 date and time."]
+        else:
+            setattr(question, field, moment)
+    try:
+        question.full_clean(exclude=[field for field in errors if field != '__all__'])
+    except ValidationError as exc:
+        for field, messages in exc.message_dict.items():
+            errors.setdefault(field, []).extend(messages)
+    if question.pub_date and question.end_date and question.end_date <= question.pub_date:
+        errors.setdefault('end_date', []).append("The end date must be after the publication date.")
+
+    choice_texts = row.get('choices', [])
+    if not isinstance(choice_texts, list) or not all(isinstance(text, str) for text in choice_texts):
+        errors['choices'] = ["Choices must be a list of texts."]
+        return question, [], errors
+    choices = [Choice(choice_text=text.strip()) for text in choice_texts]
+    for number, choice in enumerate(choices, start=1):
+        try:
+            choice.full_clean(exclude=['question'])
+        except ValidationError as exc:
+            errors.setdefault('choices', []).extend(
+                f"Choice {number}: {message}" for message in exc.message_dict.get('choice_text', exc.messages))
+    if len(choices) < MIN_CHOICES:
+        errors.setdefault('choices', []).append(f"A poll needs at least {MIN_CHOICES} choices.")
+    if len({choice.choice_text for choice in choices}) != len(choices):
+        errors.setdefault('choices', []).append("Each choice must have a different text.")
+    return question, choices, errors
+
+
+def import_polls(rows, using=None, dry_run=False):
+    """
+    Validate a batch and, if every row is valid, create its polls in one transaction.
+
+    Args:
+        rows (list): (row number, dict) pairs from read_rows().
+        using (str): Database alias; the write database by default.
+        dry_run (bool): Only validate the batch.
+
+    Returns:
+        tuple: (questions, errors). `errors` is a list of {'row': int,
+        'errors': {field: [message, ...]}} for each invalid row. When it is
+        not empty nothing is written and `questions` is empty. Otherwise
+        `questions` holds the created questions, unsaved on a dry run.
+    """
+    polls, errors = [], []
+    for number, row in rows:
+        question, choices, row_errors = build_poll(row)
+        if row_errors:
+            errors.append({'row': number, 'errors': row_errors})
+        polls.append((question, choices))
+    if errors:
+        return [], errors
+    questions = [question for question, _ in polls]
+    if dry_run or not polls:
+        return questions, []
+
+    db = using or router.db_for_write(Question)
+    with transaction.atomic(using=db):
+        _create_questions(db, questions)
+        for question, choices in polls:
+            for choice in choices:
+                choice.question = question
+        Choice.objects.db_manager(db).bulk_create(
+            [choice for _, choices in polls for choice in choices], batch_size=BATCH_SIZE)
+        get_index(db).update([question.pk for question in questions])
+        transaction.on_commit(invalidate_index, using=db)
+    return questions, []
+
+
+def _create_questions(db, questions):
+    """
+    Insert `questions` and set their primary keys.
+
+    Where the database returns the ids of a bulk insert, one bulk_create
+    does it. SQLite returns none before Django 4.0, but writers to SQLite
+    are serialized and its AUTOINCREMENT ids only grow, so the rows just
+    inserted in this transaction are the newest ones. Other databases give
+    no such guarantee, so each question is saved on its own there.
+    """
+    connection = connections[db]
+    manager = Question.objects.db_manager(db)
+    if connection.features.can_return_rows_from_bulk_insert:
+        manager.bulk_create(questions, batch_size=BATCH_SIZE)
+    elif connection.vendor == 'sqlite':
+        manager.bulk_create(questions, batch_size=BATCH_SIZE)
+        ids = manager.order_by('-pk').values_list('pk', flat=True)[:len(questions)]
+        for question, pk in zip(questions, reversed(list(ids))):
+            question.pk = pk
+    else:
+        for question in questions:
+            question.save(using=db)
@@ -0,0 +1,340 @@
+"""
+Load generation and timing for the polls views.
+
+seed() fills the database with bulk inserts and run_benchmark() times each
+view through the test client, recording latency percentiles, query counts
+and peak memory. run_search_benchmark() times searches from the index page
+with each search index, and run_tally_benchmark() decides a ranked-choice
+poll of synthetic ballots. run_vote_concurrency() measures vote throughput on a single
+hot question from many threads, with or without sharded counters. The
+benchmark_polls management command wraps them around a throwaway test
+database and writes the results as JSON.
+"""
+import datetime
+import itertools
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Choice, Question, Vote
+from .search import Fts5Index, TokenIndex, get_index, has_fts5, rebuild
+from .tally import BallotBox, pack, unpack
+
+BATCH_SIZE = 1000
+# 512 made-up words; each seeded question uses three, so a word picks out about 0.6% of them
+WORDS = [''.join(syllables) for syllables in itertools.product(
+    ('ka', 'lo', 'mi', 'ra', 'tu', 'ne', 'so', 'vi'), repeat=3)]
+
+
+def seed(questions, choices, users, vote_ratio=1.0, rng=None):
+    """
+    Bulk-insert `questions` questions with `choices` choices each and `users` users.
+
+    Each user votes on a random `vote_ratio` share of the questions, and the
+    vote_count counters are filled in to match.
+
+    Returns:
+        tuple: The created question ids and user ids.
+    """
+    rng = rng or random.Random(0)
+    now = timezone.now()
+    password = make_password('benchmark')
+    User.objects.bulk_create(
+        [User(username=f'bench-user-{i}', password=password) for i in range(users)],
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(User.objects.filter(username__startswith='bench-user-').values_list('id', flat=True))
+
+    Question.objects.bulk_create(
+        [Question(question_text=f"Benchmark question {i}: {' '.join(rng.sample(WORDS, 3))}?",
+                  pub_date=now - datetime.timedelta(minutes=i))
+         for i in range(questions)],
+        batch_size=BATCH_SIZE,
+    )
+    question_ids = list(Question.objects.filter(question_text__startswith='Benchmark question ')
+                        .values_list('id', flat=True))
+
+    Choice.objects.bulk_create(
+        [Choice(question_id=question_id, choice_text=f"Choice {j} {rng.choice(WORDS)}")
+         for question_id in question_ids for j in range(choices)],
+        batch_size=BATCH_SIZE,
+    )
+    choice_ids = {}
+    for choice_id, question_id in Choice.objects.filter(question_id__in=question_ids).values_list('id', 'question_id'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+
+    votes = []
+    counts = {}
+    for user_id in user_ids:
+        for question_id in question_ids:
+            if rng.random() < vote_ratio and choice_ids.get(question_id):
+                choice_id = rng.choice(choice_ids[question_id])
+                votes.append(Vote(user_id=user_id, question_id=question_id, choice_id=choice_id))
+                counts[choice_id] = counts.get(choice_id, 0) + 1
+    Vote.objects.bulk_create(votes, batch_size=BATCH_SIZE)
+    Choice.objects.bulk_update(
+        [Choice(id=choice_id, vote_count=count) for choice_id, count in counts.items()],
+        ['vote_count'], batch_size=BATCH_SIZE,
+    )
+    return question_ids, user_ids
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _measure(make_request, requests, cold):
+    """
+    Time `requests` calls of `make_request` and count their queries.
+    """
+    latencies = []
+    queries = []
+    for i in range(requests):
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = make_request(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Benchmark request failed with status {response.status_code}.")
+        queries.append(len(captured))
+
+    # Peak memory is measured on one extra request, so tracing does not skew the timings
+    if cold:
+        cache.clear()
+    tracemalloc.start()
+    try:
+        make_request(requests)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(_percentile(latencies, 95), 3),
+        'mean_queries': round(statistics.mean(queries), 2),
+        'max_queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmark(question_ids, user_ids, requests=50, cold=False, rng=None):
+    """
+    Time IndexView, DetailView, ResultsView and vote through the test client.
+
+    Args:
+        question_ids (list): Questions to request, e.g. as returned by seed().
+        user_ids (list): Users to vote as.
+        requests (int): Requests timed per view.
+        cold (bool): Clear the cache before every request.
+
+    Returns:
+        dict: Latency percentiles, query counts and peak memory for each view.
+    """
+    rng = rng or random.Random(0)
+    client = Client()
+    voter = Client()
+    voter.force_login(User.objects.get(pk=user_ids[0]))
+    choices = {}
+    for choice_id, question_id in Choice.objects.filter(question_id__in=question_ids).values_list('id', 'question_id'):
+        choices.setdefault(question_id, []).append(choice_id)
+
+    def index(i):
+        return client.get(reverse('polls:index'))
+
+    def detail(i):
+        return client.get(reverse('polls:detail', args=(rng.choice(question_ids),)))
+
+    def results(i):
+        return client.get(reverse('polls:results', args=(rng.choice(question_ids),)))
+
+    def vote(i):
+        question_id = rng.choice(question_ids)
+        return voter.post(reverse('polls:vote', args=(question_id,)), {'choice': rng.choice(choices[question_id])})
+
+    views = {'index': index, 'detail': detail, 'results': results, 'vote': vote}
+    report = {}
+    for name, make_request in views.items():
+        cache.clear()
+        report[name] = _measure(make_request, requests, cold)
+    return report
+
+
+def run_search_benchmark(requests=50, rng=None):
+    """
+    Time searches from the index page with each search index the database has.
+
+    Each index is rebuilt first (seed() bulk-inserts, so nothing is indexed
+    yet) and then searched for one seeded word, two words, and a three-letter
+    prefix as typed in the search box.
+
+    Args:
+        requests (int): Searches timed per kind of query.
+
+    Returns:
+        dict: For each index, the seconds taken to build it and the timings of each kind of query.
+    """
+    rng = rng or random.Random(0)
+    client = Client()
+    url = reverse('polls:index')
+    queries = {
+        'word': lambda i: rng.choice(WORDS),
+        'two_words': lambda i: ' '.join(rng.sample(WORDS, 2)),
+        'prefix': lambda i: rng.choice(WORDS)[:3],
+    }
+    backends = [Fts5Index.name, TokenIndex.name] if has_fts5(connection.alias) else [TokenIndex.name]
+    report = {}
+    for backend in backends:
+        with override_settings(POLLS_SEARCH_BACKEND=backend):
+            start = time.perf_counter()
+            indexed = rebuild(get_index())
+            report[backend] = {'questions': indexed, 'build_seconds': round(time.perf_counter() - start, 3)}
+            for name, query in queries.items():
+                report[backend][name] = _measure(lambda i: client.get(url, {'q': query(i)}), requests, cold=False)
+    return report
+
+
+def _naive_runoff(ballots, choice_ids):
+    """
+    Instant runoff by re-reading every ballot each round, for comparison with BallotBox.
+
+    Returns:
+        int or None: The winning choice id.
+    """
+    continuing = list(choice_ids)
+    while continuing:
+        votes = dict.fromkeys(continuing, 0)
+        active = 0
+        for ballot in ballots:
+            for choice_id in ballot:
+                if choice_id in votes:
+                    votes[choice_id] += 1
+                    active += 1
+                    break
+        if not active:
+            return None
+        leader = max(continuing, key=lambda choice_id: votes[choice_id])
+        if votes[leader] * 2 > active or len(continuing) == 1:
+            return leader
+        continuing.remove(min(reversed(continuing), key=lambda choice_id: votes[choice_id]))
+    return None
+
+
+def run_tally_benchmark(ballots=1000000, choices=6, rng=None):
+    """
+    Decide a ranked-choice poll of `ballots` synthetic ballots with BallotBox and with a naive runoff.
+
+    Each ballot ranks a random number of the choices, and the earlier choices
+    are more popular so the runoff takes several rounds. The ballots are
+    handed to BallotBox as packed bytes, as they come from the database, so
+    the timing covers everything but the query itself.
+
+    Returns:
+        dict: Seconds taken to group the ballots, to run the rounds, and by
+        the naive runoff, with the number of distinct rankings and rounds.
+    """
+    rng = rng or random.Random(0)
+    choice_ids = list(range(1, choices + 1))
+    weights = [choices - i for i in range(choices)]
+    packed = []
+    for _ in range(ballots):
+        ranking = []
+        for _ in range(rng.randint(1, choices)):
+            remaining = [choice_id for choice_id in choice_ids if choice_id not in ranking]
+            ranking.append(rng.choices(remaining, [weights[choice_id - 1] for choice_id in remaining])[0])
+        packed.append(pack(ranking))
+
+    start = time.perf_counter()
+    box = BallotBox([(choice_id, f"Choice {choice_id}") for choice_id in choice_ids], packed)
+    grouped = time.perf_counter()
+    runoff = box.runoff()
+    decided = time.perf_counter()
+
+    unpacked = [unpack(data) for data in packed]
+    naive_start = time.perf_counter()
+    naive_winner = _naive_runoff(unpacked, choice_ids)
+    naive_seconds = time.perf_counter() - naive_start
+
+    return {
+        'ballots': ballots,
+        'choices': choices,
+        'distinct_rankings': len(box.rankings),
+        'rounds': len(runoff['rounds']),
+        'group_seconds': round(grouped - start, 3),
+        'runoff_seconds': round(decided - grouped, 4),
+        'naive_runoff_seconds': round(naive_seconds, 3),
+        'same_winner': naive_winner == (runoff['winner'] or {}).get('id'),
+    }
+
+
+def run_vote_concurrency(question_id, user_ids, threads=8, votes_per_thread=50, shards=0):
+    """
+    Vote on one question from `threads` threads at once and measure the throughput.
+
+    Each thread has its own database connection and votes as its own users,
+    switching between the question's choices, so every vote updates the
+    question's counters. Sharding only pays off on databases with row-level
+    locks such as PostgreSQL; SQLite serializes all writes anyway.
+
+    Args:
+        question_id (int): The hot question.
+        user_ids (list): Users to vote as, shared out between the threads.
+        threads (int): Number of concurrent voters.
+        votes_per_thread (int): Votes cast by each thread.
+        shards (int): The question's counter_shards during the run (0 for off).
+
+    Returns:
+        dict: Votes cast, errors, elapsed seconds and votes per second.
+    """
+    Question.objects.filter(pk=question_id).update(counter_shards=shards)
+    question = Question.objects.get(pk=question_id)
+    choices = list(Choice.objects.filter(question_id=question_id))
+    users = list(User.objects.filter(pk__in=user_ids))
+    start_line = threading.Barrier(threads + 1)
+    errors = []
+
+    def vote(number):
+        rng = random.Random(number)
+        own_users = users[number::threads] or users
+        try:
+            start_line.wait()
+            for _ in range(votes_per_thread):
+                Vote.objects.cast(rng.choice(own_users), question, rng.choice(choices))
+        except DatabaseError as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=vote, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    start_line.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+
+    votes = threads * votes_per_thread
+    return {
+        'shards': shards,
+        'threads': threads,
+        'votes': votes,
+        'errors': len(errors),
+        'seconds': round(seconds, 3),
+        'votes_per_second': round((votes - len(errors) * votes_per_thread) / seconds, 1) if seconds else None,
+    }
@@ -0,0 +1,212 @@
+"""
+Streaming bulk loader for Django JSON fixtures.
+
+loaddata reads a whole fixture into memory and saves its objects one at a
+time, sending signals for each. FixtureLoader decodes the fixture one object
+at a time instead, and writes each chunk of objects in one transaction: the
+chunk's foreign keys are checked with one query per field and batch, then
+each model's rows go in with bulk_create. Objects whose primary key already
+exists are updated, as loaddata would do, so the same files give the same
+database.
+
+Unlike loaddata, an object must come after the objects it refers to, which
+is the order dumpdata writes them in, and every object needs a primary key.
+"""
+import itertools
+import json
+from collections import Counter
+
+from django.core.management.color import no_style
+from django.core.serializers import base
+from django.core.serializers.python import Deserializer as PythonDeserializer
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .cache import bump_results_version, invalidate_index
+from .models import Choice, Question, Vote
+from .search import get_index
+
+READ_SIZE = 64 * 1024
+# Stays under SQLite's 999 query parameter limit
+QUERY_BATCH_SIZE = 500
+
+
+class FixtureError(ValueError):
+    pass
+
+
+def iter_objects(stream, read_size=READ_SIZE):
+    """
+    Yield the objects of a JSON list one at a time, reading `stream` in blocks.
+
+    Raises:
+        FixtureError: If the stream is not a JSON list of objects.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    expect = '['
+
+    def read_more():
+        nonlocal buffer
+        block = stream.read(read_size)
+        buffer += block
+        return bool(block)
+
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if read_more():
+                continue
+            if expect == 'end':
+                return
+            raise FixtureError("Unexpected end of fixture.")
+
+        if expect == 'end':
+            raise FixtureError("Unexpected data after the end of the fixture.")
+        elif expect == '[':
+            if buffer[0] != '[':
+                raise FixtureError("A fixture must be a JSON list.")
+            buffer, expect = buffer[1:], 'first'
+        elif expect in ('first', 'separator') and buffer[0] == ']':
+            buffer, expect = buffer[1:], 'end'
+        elif expect == 'separator':
+            if buffer[0] != ',':
+                raise FixtureError(f"Expected ',' or ']' in fixture, got {buffer[:20]!r}.")
+            buffer, expect = buffer[1:], 'object'
+        else:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as exc:
+                # The object may continue in the next block
+                if read_more():
+                    continue
+                raise FixtureError(f"Invalid JSON in fixture: {exc}") from exc
+            if not isinstance(obj, dict):
+                raise FixtureError("Fixture entries must be JSON objects.")
+            yield obj
+            buffer, expect = buffer[end:], 'separator'
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class FixtureLoader:
+    """
+    Load fixtures into the database in chunks of `chunk_size` objects.
+
+    Attributes:
+        counts (Counter): Objects loaded, by model label.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, chunk_size=1000):
+        self.using = using
+        self.chunk_size = chunk_size
+        self.counts = Counter()
+        self.models = set()
+        self.question_ids = set()
+
+    def load(self, stream):
+        """
+        Load every object of one fixture stream.
+
+        Raises:
+            FixtureError: If the fixture is malformed or refers to missing rows.
+        """
+        for chunk in _batches(iter_objects(stream), self.chunk_size):
+            try:
+                objects = list(PythonDeserializer(chunk, using=self.using))
+            except base.DeserializationError as exc:
+                raise FixtureError(str(exc)) from exc
+            with transaction.atomic(using=self.using):
+                for model, group in itertools.groupby(objects, key=lambda obj: type(obj.object)):
+                    self._save(model, list(group))
+
+    def finish(self):
+        """
+        Reset the sequences of the loaded tables and drop the caches they affect.
+
+        Bulk inserts send no signals, so the caches are invalidated and the
+        loaded questions indexed for search here, once.
+        """
+        connection = connections[self.using]
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.models))
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+        if Question in self.models:
+            invalidate_index()
+        for question_id in self.question_ids:
+            bump_results_version(question_id)
+        get_index(self.using).update(sorted(self.question_ids))
+
+    def _save(self, model, objects):
+        instances = [obj.object for obj in objects]
+        if any(instance.pk is None for instance in instances):
+            raise FixtureError(f"Every {model._meta.label} in the fixture needs a primary key.")
+        self._check_foreign_keys(model, instances)
+
+        manager = model._base_manager.db_manager(self.using)
+        existing = self._existing_pks(model, [instance.pk for instance in instances])
+        manager.bulk_create([instance for instance in instances if instance.pk not in existing],
+                            batch_size=QUERY_BATCH_SIZE)
+        updated = [instance for instance in instances if instance.pk in existing]
+        if updated:
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+            manager.bulk_update(updated, fields, batch_size=QUERY_BATCH_SIZE)
+        self._save_many_to_many(model, objects, existing)
+
+        self.models.add(model)
+        self.counts[model._meta.label] += len(instances)
+        if model is Question:
+            self.question_ids.update(instance.pk for instance in instances)
+        elif model in (Choice, Vote):
+            self.question_ids.update(instance.question_id for instance in instances)
+
+    def _existing_pks(self, model, pks):
+        manager = model._base_manager.db_manager(self.using)
+        existing = set()
+        for batch in _batches(pks, QUERY_BATCH_SIZE):
+            existing.update(manager.filter(pk__in=batch).values_list('pk', flat=True))
+        return existing
+
+    def _check_foreign_keys(self, model, instances):
+        """
+        Raises:
+            FixtureError: If an instance refers to a row that does not exist.
+        """
+        for field in model._meta.concrete_fields:
+            if not field.is_relation:
+                continue
+            values = {getattr(instance, field.attname) for instance in instances} - {None}
+            target = field.related_model._base_manager.db_manager(self.using)
+            found = set()
+            for batch in _batches(values, QUERY_BATCH_SIZE):
+                found.update(target.filter(**{f'{field.target_field.name}__in': batch})
+                             .values_list(field.target_field.name, flat=True))
+            missing = values - found
+            if missing:
+                raise FixtureError(
+                    f"{model._meta.label}.{field.name} refers to missing "
+                    f"{field.related_model._meta.label} rows: {sorted(missing)[:10]}"
+                )
+
+    def _save_many_to_many(self, model, objects, existing):
+        """
+        Replace the many-to-many relations given in the fixture, as loaddata does.
+        """
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            source = f'{field.m2m_field_name()}_id'
+            target = f'{field.m2m_reverse_field_name()}_id'
+            given = [obj for obj in objects if field.name in obj.m2m_data]
+            replaced = [obj.object.pk for obj in given if obj.object.pk in existing]
+            manager = through._base_manager.db_manager(self.using)
+            for batch in _batches(replaced, QUERY_BATCH_SIZE):
+                manager.filter(**{f'{source}__in': batch}).delete()
+            manager.bulk_create(
+                [through(**{source: obj.object.pk, target: value}) for obj in given for value in obj.m2m_data[field.name]],
+                batch_size=QUERY_BATCH_SIZE,
+            )
@@ -0,0 +1,288 @@
+"""
+Caching helpers for the polls app.
+
+Results are cached under a key that contains a per-question version number.
+Voting bumps the version after the transaction commits, so readers move to a
+fresh key instead of racing to delete the old one.
+
+The rendered poll index is cached the same way under a global version that
+changes whenever a question is saved or deleted, and it expires on its own
+when the next question opens or closes.
+"""
+import datetime
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils import timezone
+
+RESULTS_VERSION_KEY = 'polls:results:version:{question_id}'
+RESULTS_MODIFIED_KEY = 'polls:results:modified:{question_id}'
+RESULTS_KEY = 'polls:results:{question_id}:v{version}'
+FINAL_RESULTS_KEY = 'polls:results:{question_id}:final'
+RUNOFF_KEY = 'polls:runoff:{question_id}:v{version}'
+RESULTS_HITS_KEY = 'polls:results:hits'
+RESULTS_MISSES_KEY = 'polls:results:misses'
+USER_VOTES_VERSION_KEY = 'polls:votes:version:{user_id}'
+USER_VOTES_KEY = 'polls:votes:{user_id}:v{version}'
+INDEX_VERSION_KEY = 'polls:index:version'
+INDEX_BOUNDARY_KEY = 'polls:index:next-state-change'
+
+
+def _increment(key):
+    """
+    Atomically increment the counter stored at `key`, creating it if needed.
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+def _version(key, create=True):
+    """
+    Return the version number stored at `key`.
+
+    A missing version is seeded from the clock rather than from 1, so a
+    version lost to eviction or a restart never repeats an earlier one.
+    With create=False a missing version is returned as None instead.
+    """
+    version = cache.get(key)
+    if version is None and create:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return _version(key)
+
+
+def results_version(question_id, create=True):
+    """
+    Return the current results version of a question.
+
+    Args:
+        create (bool): Seed a missing version; False returns None instead,
+            for callers that do not yet know the question exists.
+    """
+    return _version(RESULTS_VERSION_KEY.format(question_id=question_id), create)
+
+
+def bump_results_version(question_id):
+    """
+    Move a question's results to a new version, invalidating the cached tallies.
+    """
+    cache.set(RESULTS_MODIFIED_KEY.format(question_id=question_id), time.time(), timeout=None)
+    return _bump_version(RESULTS_VERSION_KEY.format(question_id=question_id))
+
+
+def results_last_modified(question_id, create=True):
+    """
+    Return when a question's results last changed.
+
+    The time is recorded by bump_results_version(); if it was lost, the
+    current time is recorded instead, so clients revalidate once too often
+    rather than keep stale tallies. With create=False a missing time is
+    returned as None instead.
+    """
+    key = RESULTS_MODIFIED_KEY.format(question_id=question_id)
+    modified = cache.get(key)
+    if modified is None:
+        if not create:
+            return None
+        cache.add(key, time.time(), timeout=None)
+        modified = cache.get(key)
+    return datetime.datetime.fromtimestamp(modified, tz=datetime.timezone.utc)
+
+
+def get_results(question):
+    """
+    Return the tallies of a question, from the cache when possible.
+
+    The tallies of a closed question come from its frozen ResultSnapshot.
+
+    Returns:
+        list: One dict per choice with 'id', 'choice_text' and 'vote_count'.
+    """
+    if question.is_final():
+        return final_results(question)
+
+    key = RESULTS_KEY.format(question_id=question.id, version=results_version(question.id))
+    results = cache.get(key)
+    if results is not None:
+        _increment(RESULTS_HITS_KEY)
+        return results
+
+    _increment(RESULTS_MISSES_KEY)
+    # Fill from the primary: a lagging replica would pin stale totals under the new version
+    choices = question.choice_set.db_manager(router.db_for_write(question.choice_set.model))
+    results = [{'id': choice_id, 'choice_text': text, 'vote_count': votes} for choice_id, text, votes
+               in choices.with_totals().order_by('pk').values_list('id', 'choice_text', 'total_votes')]
+    cache.set(key, results, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return results
+
+
+def final_results(question):
+    """
+    Return the frozen tallies of a closed question.
+
+    The snapshot is made on the first read after the close (or by the
+    finalize_results command) and then cached without expiry.
+    """
+    from .models import ResultSnapshot
+
+    key = FINAL_RESULTS_KEY.format(question_id=question.id)
+    results = cache.get(key)
+    if results is None:
+        results = ResultSnapshot.objects.finalize(question).counts
+        cache.set(key, results, timeout=None)
+    return results
+
+
+def get_runoff(question):
+    """
+    Return the instant-runoff rounds of a ranked-choice question, from the cache when possible.
+
+    They are cached under the question's results version, so they are
+    counted again only after the next ballot (or choice change).
+
+    Returns:
+        dict: As returned by polls.tally.BallotBox.runoff().
+    """
+    from .models import Ballot
+    from .tally import BallotBox
+
+    key = RUNOFF_KEY.format(question_id=question.id, version=results_version(question.id))
+    runoff = cache.get(key)
+    if runoff is None:
+        choices = [(choice['id'], choice['choice_text']) for choice in get_results(question)]
+        runoff = BallotBox.load(question.id, using=router.db_for_write(Ballot), choices=choices).runoff()
+        cache.set(key, runoff, None if question.is_final() else settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return runoff
+
+
+def forget_final_results(question_id):
+    """
+    Drop the cached frozen tallies of a question, e.g. after its snapshot changed.
+    """
+    cache.delete(FINAL_RESULTS_KEY.format(question_id=question_id))
+
+
+def user_votes_version(user_id):
+    """
+    Return the current version of the set of questions a user has voted on.
+    """
+    return _version(USER_VOTES_VERSION_KEY.format(user_id=user_id))
+
+
+def bump_user_votes_version(user_id):
+    """
+    Invalidate the cached set of questions a user has voted on.
+    """
+    return _bump_version(USER_VOTES_VERSION_KEY.format(user_id=user_id))
+
+
+def voted_question_ids(user_id):
+    """
+    Return the ids of the questions a user has voted on or cast a ballot on,
+    loaded with one query.
+
+    Returns:
+        frozenset: Question ids.
+    """
+    from .models import Ballot, Vote
+
+    key = USER_VOTES_KEY.format(user_id=user_id, version=user_votes_version(user_id))
+    question_ids = cache.get(key)
+    if question_ids is None:
+        db = router.db_for_write(Vote)
+        votes = Vote.objects.using(db).filter(user_id=user_id).values_list('question_id', flat=True)
+        ballots = Ballot.objects.using(db).filter(user_id=user_id).values_list('question_id', flat=True)
+        question_ids = frozenset(votes.union(ballots))
+        cache.set(key, question_ids, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return question_ids
+
+
+def results_cache_stats():
+    """
+    Return the results cache hit and miss counters and the resulting hit ratio.
+    """
+    hits = cache.get(RESULTS_HITS_KEY, 0)
+    misses = cache.get(RESULTS_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else None,
+    }
+
+
+def reset_results_cache_stats():
+    """
+    Reset the results cache hit and miss counters.
+    """
+    cache.delete_many([RESULTS_HITS_KEY, RESULTS_MISSES_KEY])
+
+
+def index_version():
+    """
+    Return the current version of the cached poll index.
+    """
+    return _version(INDEX_VERSION_KEY)
+
+
+def invalidate_index():
+    """
+    Drop the cached poll index, e.g. after a question was saved or deleted.
+    """
+    _bump_version(INDEX_VERSION_KEY)
+    cache.delete(INDEX_BOUNDARY_KEY)
+
+
+def index_boundary(now=None):
+    """
+    Return the next moment a question opens or closes, and since when that holds.
+
+    The result is cached until that moment passes, so a cache hit needs no
+    query at all.
+
+    Returns:
+        dict: 'at', the next pub_date or end_date (None if there is none), and
+        'since', when it was computed, i.e. no earlier than the index's last change.
+    """
+    from .models import Question
+
+    now = now or timezone.now()
+    boundary = cache.get(INDEX_BOUNDARY_KEY)
+    if boundary is None:
+        boundary = {'at': Question.objects.next_state_change(now), 'since': now}
+        cache.set(INDEX_BOUNDARY_KEY, boundary, _seconds_until(boundary['at'], now))
+    return boundary
+
+
+def index_cache_timeout(now=None):
+    """
+    Return how many seconds the rendered index may be cached.
+
+    The cached index must expire as soon as a question opens or closes, so the
+    timeout runs until the next pub_date or end_date (None if there is none).
+    """
+    now = now or timezone.now()
+    return _seconds_until(index_boundary(now)['at'], now)
+
+
+def _seconds_until(moment, now):
+    """
+    Return a cache timeout ending just after `moment`, or None to never expire.
+    """
+    if moment is None:
+        return None
+    return max(1, math.floor((moment - now).total_seconds()) + 1)
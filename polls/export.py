@@ -0,0 +1,95 @@
+"""
+Streaming exports of poll tallies and individual votes.
+
+The rows come from QuerySet.iterator(), which fetches them from the database
+in chunks (with a server-side cursor where the backend has one), and each row
+is formatted as soon as it arrives. Memory use therefore stays flat however
+many votes are exported, whether the lines go to a StreamingHttpResponse or
+to a file.
+
+The votes export covers single-choice polls only; the ballots of approval
+and ranked-choice polls are not exported, though their tallies are.
+"""
+import csv
+import json
+
+from .models import Choice, Question, Vote
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+
+VOTE_COLUMNS = ('question_id', 'choice_id', 'user_id', 'username')
+TALLY_COLUMNS = ('question_id', 'question_text', 'choice_id', 'choice_text', 'vote_count')
+
+
+def vote_rows(question_ids=None):
+    """
+    Yield one (question_id, choice_id, user_id, username) tuple per vote.
+    """
+    votes = Vote.objects.order_by('pk')
+    if question_ids:
+        votes = votes.filter(question_id__in=question_ids)
+    return votes.values_list('question_id', 'choice_id', 'user_id', 'user__username').iterator(CHUNK_SIZE)
+
+
+def tally_rows(question_ids=None):
+    """
+    Yield one (question_id, question_text, choice_id, choice_text, vote_count) tuple per choice.
+    """
+    choices = Choice.objects.with_totals().order_by('question_id', 'pk')
+    if question_ids:
+        choices = choices.filter(question_id__in=question_ids)
+    return choices.values_list('question_id', 'question__question_text', 'id', 'choice_text',
+                               'total_votes').iterator(CHUNK_SIZE)
+
+
+class _Echo:
+    """
+    File-like object whose write() returns the line instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row))) + '\n'
+
+
+def export_lines(kind, fmt, question_ids=None):
+    """
+    Return an iterator over the lines of an export.
+
+    Args:
+        kind (str): 'votes' or 'tallies'.
+        fmt (str): One of FORMATS.
+        question_ids (list): Only export these questions (all if empty).
+
+    Raises:
+        ValueError: If `kind` or `fmt` is unknown, or votes are asked for an
+            approval or ranked-choice question.
+    """
+    if kind == 'votes':
+        if question_ids and Question.objects.filter(pk__in=question_ids).exclude(poll_type=Question.SINGLE).exists():
+            raise ValueError("Only single-choice polls have votes to export; export their tallies instead.")
+        columns, rows = VOTE_COLUMNS, vote_rows(question_ids)
+    elif kind == 'tallies':
+        columns, rows = TALLY_COLUMNS, tally_rows(question_ids)
+    else:
+        raise ValueError(f"Unknown export: {kind!r}.")
+    if fmt == 'csv':
+        return csv_lines(columns, rows)
+    if fmt == 'ndjson':
+        return ndjson_lines(columns, rows)
+    raise ValueError(f"Unknown export format: {fmt!r}.")
@@ -0,0 +1,187 @@
+"""
+Live poll results over Server-Sent Events.
+
+LiveResultsApp wraps the Django ASGI application and serves the URL of
+views.live ('polls:live') itself, as an event stream of the question's tallies.
+Every watched question has one Broadcaster task, shared by all of its
+subscribers. Once per POLLS_LIVE_INTERVAL it reads the question's results
+version from the cache, and only when that has changed does it load the
+tallies (through the results cache) and pass them on. A subscriber only
+keeps the newest tallies, so a client gets at most one message per interval
+however many votes arrive.
+
+Under WSGI the same URL reaches views.live, which answers 204 No Content so
+EventSource clients stop reconnecting and keep the static results page.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .cache import get_results, results_version
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+LIVE_VIEW = 'polls:live'
+HEARTBEAT_SECONDS = 15
+
+
+def results_event(version, results):
+    """
+    Returns:
+        bytes: An SSE 'results' message with the tallies of `results`.
+    """
+    data = json.dumps(results)
+    return f'id: {version}\nevent: results\ndata: {data}\n\n'.encode()
+
+
+class Subscriber:
+    """
+    The newest message for one client; older unsent messages are dropped.
+    """
+
+    def __init__(self):
+        self.message = None
+        self.ready = asyncio.Event()
+
+    def publish(self, message):
+        self.message = message
+        self.ready.set()
+
+    async def next(self):
+        await self.ready.wait()
+        self.ready.clear()
+        return self.message
+
+
+class Broadcaster:
+    """
+    Watch one question's results version and fan changes out to its subscribers.
+
+    The task stops once the last subscriber has left and calls `on_idle`.
+    """
+
+    def __init__(self, question_id, on_idle):
+        self.question_id = question_id
+        self.subscribers = set()
+        self.version = None
+        self.message = None
+        self.task = None
+        self.on_idle = on_idle
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        if self.message is not None:
+            subscriber.publish(self.message)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def run(self):
+        try:
+            while self.subscribers:
+                try:
+                    await self.poll()
+                except Exception:
+                    logger.exception("Could not load live results of question %s.", self.question_id)
+                await asyncio.sleep(settings.POLLS_LIVE_INTERVAL)
+        finally:
+            self.on_idle(self)
+
+    async def poll(self):
+        version = await sync_to_async(results_version)(self.question_id)
+        if version == self.version:
+            return
+        results = await sync_to_async(get_results)(Question(pk=self.question_id))
+        self.version = version
+        self.message = results_event(version, results)
+        for subscriber in self.subscribers:
+            subscriber.publish(self.message)
+
+
+class LiveResultsApp:
+    """
+    ASGI application that streams live results and passes everything else to `app`.
+
+    Attributes:
+        broadcasters (dict): The running Broadcaster of each watched question id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.broadcasters = {}
+
+    async def __call__(self, scope, receive, send):
+        question_id = self.live_question_id(scope) if scope['type'] == 'http' else None
+        if question_id is None or scope['method'] != 'GET':
+            return await self.app(scope, receive, send)
+        await self.stream(question_id, receive, send)
+
+    @staticmethod
+    def live_question_id(scope):
+        """
+        Returns:
+            int or None: The question id if the request is for the live view, else None.
+        """
+        # Strip the mount point the way Django's ASGIRequest does
+        path, root_path = scope['path'], scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return None
+        return match.kwargs['question_id'] if match.view_name == LIVE_VIEW else None
+
+    async def stream(self, question_id, receive, send):
+        published = Question.objects.published().filter(pk=question_id)
+        if not await sync_to_async(published.exists)():
+            await send({'type': 'http.response.start', 'status': 404,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': b'Not Found'})
+            return
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        broadcaster = self.broadcasters.get(question_id)
+        if broadcaster is None:
+            broadcaster = self.broadcasters[question_id] = Broadcaster(question_id, self.remove)
+        subscriber = broadcaster.subscribe()
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            while True:
+                message = asyncio.ensure_future(subscriber.next())
+                done, _ = await asyncio.wait({message, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    message.cancel()
+                    break
+                if message in done:
+                    body = message.result()
+                else:
+                    message.cancel()
+                    body = b': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            broadcaster.unsubscribe(subscriber)
+            disconnected.cancel()
+
+    def remove(self, broadcaster):
+        if self.broadcasters.get(broadcaster.question_id) is broadcaster:
+            del self.broadcasters[broadcaster.question_id]
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -0,0 +1,100 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from polls.benchmark import run_benchmark, run_search_benchmark, run_tally_benchmark, run_vote_concurrency, seed
+
+
+class Command(BaseCommand):
+    """
+    Seed a throwaway test database and benchmark the polls views against it.
+
+    The results are written as JSON so runs can be compared between releases:
+
+        python manage.py benchmark_polls --questions 10000 --output bench.json
+
+    With --search it also times searches from the index page with each search
+    index, e.g. on a corpus of 100,000 questions:
+
+        python manage.py benchmark_polls --questions 100000 --users 1 --search
+
+    With --ballots it also decides a ranked-choice poll of that many synthetic
+    ballots with the tally engine and with a naive runoff:
+
+        python manage.py benchmark_polls --ballots 1000000
+
+    With --vote-threads it also measures concurrent votes on one hot question,
+    once with plain counters and once with --shards counter shards. The
+    threads need a database they can share, so this does not work with the
+    default in-memory SQLite test database.
+    """
+    help = "Benchmark the polls views on generated data and report latency, queries and memory as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1000, help="Number of questions to create.")
+        parser.add_argument('--choices', type=int, default=4, help="Number of choices per question.")
+        parser.add_argument('--users', type=int, default=100, help="Number of users to create.")
+        parser.add_argument('--vote-ratio', type=float, default=0.5,
+                            help="Share of the questions each user votes on.")
+        parser.add_argument('--requests', type=int, default=50, help="Requests timed per view.")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every request.")
+        parser.add_argument('--search', action='store_true', help="Also time searches with each search index.")
+        parser.add_argument('--ballots', type=int, default=0,
+                            help="Also time an instant runoff over this many synthetic ballots.")
+        parser.add_argument('--ballot-choices', type=int, default=6, help="Choices on the synthetic ballots.")
+        parser.add_argument('--vote-threads', type=int, default=0,
+                            help="Also time concurrent votes on one question from this many threads.")
+        parser.add_argument('--votes-per-thread', type=int, default=50, help="Votes cast by each voting thread.")
+        parser.add_argument('--shards', type=int, default=8, help="Counter shards for the sharded vote run.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['vote_threads'] and connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            raise CommandError("--vote-threads needs a shared test database: set SQLITE_HIGH_CONCURRENCY=True "
+                               "or use a database server.")
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            question_ids, user_ids = seed(options['questions'], options['choices'], options['users'],
+                                          vote_ratio=options['vote_ratio'])
+            views = run_benchmark(question_ids, user_ids, requests=options['requests'], cold=options['cold'])
+            search = run_search_benchmark(requests=options['requests']) if options['search'] else None
+            tally = (run_tally_benchmark(options['ballots'], options['ballot_choices'])
+                     if options['ballots'] else None)
+            concurrency = [
+                run_vote_concurrency(question_ids[0], user_ids, threads=options['vote_threads'],
+                                     votes_per_thread=options['votes_per_thread'], shards=shards)
+                for shards in (0, options['shards'])
+            ] if options['vote_threads'] else None
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'parameters': {name: options[name] for name in
+                           ('questions', 'choices', 'users', 'vote_ratio', 'requests', 'cold', 'search',
+                            'ballots', 'ballot_choices', 'vote_threads', 'votes_per_thread', 'shards')},
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'views': views,
+        }
+        if search:
+            report['search'] = search
+        if tally:
+            report['tally'] = tally
+        if concurrency:
+            report['vote_concurrency'] = concurrency
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote benchmark report to {options['output']}."))
+        else:
+            self.stdout.write(output)
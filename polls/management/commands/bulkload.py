@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from polls.bulkload import FixtureError, FixtureLoader
+
+
+class Command(BaseCommand):
+    """
+    Load JSON fixtures with chunked bulk inserts instead of loaddata.
+
+    The files are read incrementally, so exports larger than memory load too:
+
+        python manage.py bulkload data/users.json data/polls-no-vote.json
+    """
+    help = "Stream Django JSON fixtures into the database with chunked bulk inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='+', help="Paths of JSON fixture files, loaded in order.")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Objects written per transaction.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to load into.")
+
+    def handle(self, *args, **options):
+        loader = FixtureLoader(using=options['database'], chunk_size=options['chunk_size'])
+        start = time.perf_counter()
+        try:
+            for path in options['fixtures']:
+                loaded = sum(loader.counts.values())
+                file_start = time.perf_counter()
+                with open(path, encoding='utf-8') as stream:
+                    loader.load(stream)
+                self.report(path, sum(loader.counts.values()) - loaded, time.perf_counter() - file_start)
+        except (FixtureError, OSError) as exc:
+            raise CommandError(f"Could not load {path}: {exc}")
+        finally:
+            loader.finish()
+
+        for label, count in sorted(loader.counts.items()):
+            self.stdout.write(f"  {label}: {count}")
+        self.report('all fixtures', sum(loader.counts.values()), time.perf_counter() - start, self.style.SUCCESS)
+
+    def report(self, name, rows, seconds, style=str):
+        rate = rows / seconds if seconds else 0
+        self.stdout.write(style(f"Loaded {rows} objects from {name} in {seconds:.2f}s ({rate:.0f} rows/s)."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.export import FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    """
+    Write poll votes or tallies as CSV or NDJSON, streaming them from the database.
+
+        python manage.py export_polls votes --format ndjson --question 3 --output votes.ndjson
+
+    Ballots of approval and ranked-choice polls are not exported as votes.
+    """
+    help = "Export every vote or every choice's tally as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['votes', 'tallies'], help="What to export.")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help="Output format.")
+        parser.add_argument('--question', type=int, action='append', dest='questions', default=[],
+                            help="Only export this question; may be given several times.")
+        parser.add_argument('--output', help="Write to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            lines = export_lines(options['kind'], options['format'], options['questions'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Question, ResultSnapshot
+
+
+class Command(BaseCommand):
+    """
+    Freeze the tallies of every closed question that has no snapshot yet.
+
+    Results are also frozen on their first read after the close; running this
+    from a scheduled job keeps that first read cheap.
+    """
+    help = "Store the final tallies of closed questions in ResultSnapshot."
+
+    def handle(self, *args, **options):
+        questions = Question.objects.final().filter(snapshot__isnull=True).only('id')
+        finalized = 0
+        for question in questions.iterator():
+            ResultSnapshot.objects.finalize(question)
+            finalized += 1
+        self.stdout.write(self.style.SUCCESS(f"Finalized {finalized} question(s)."))
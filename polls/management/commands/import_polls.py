@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from polls.authoring import FORMATS, BatchError, import_polls, read_rows
+
+
+class Command(BaseCommand):
+    """
+    Create many polls at once from a CSV or JSON batch (see polls/authoring.py).
+
+    Every row is checked first; if any row is invalid, each error is listed
+    and nothing is created:
+
+        python manage.py import_polls data/june-polls.csv
+        python manage.py import_polls data/june-polls.json --dry-run
+    """
+    help = "Create the polls described in a CSV or JSON file in one transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the CSV or JSON batch.")
+        parser.add_argument('--format', choices=sorted(FORMATS),
+                            help="Format of the batch (by default from the file extension).")
+        parser.add_argument('--dry-run', action='store_true', help="Only validate the batch.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to create the polls in.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        try:
+            with open(path, encoding='utf-8', newline='') as stream:
+                rows = read_rows(stream, fmt)
+        except (BatchError, OSError, UnicodeDecodeError) as exc:
+            raise CommandError(f"Could not read {path}: {exc}")
+
+        questions, errors = import_polls(rows, using=options['database'], dry_run=options['dry_run'])
+        if errors:
+            for error in errors:
+                for field, messages in error['errors'].items():
+                    for message in messages:
+                        self.stderr.write(f"Row {error['row']}: {field}: {message}")
+            raise CommandError(f"{len(errors)} row(s) have errors; no polls were created.")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"All {len(questions)} poll(s) are valid."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Created {len(questions)} poll(s)."))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from polls.search import get_index, rebuild
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the poll search index from the questions and choices.
+
+    Needed after switching POLLS_SEARCH_BACKEND, since only the active index
+    is kept up to date. The index is replaced in one transaction, so searches
+    keep using the old one until the new one is complete.
+    """
+    help = "Rebuild the full-text search index of poll questions and choices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Questions indexed per batch.")
+
+    def handle(self, *args, **options):
+        index = get_index()
+        start = time.perf_counter()
+        with transaction.atomic(using=index.using):
+            indexed = rebuild(index, batch_size=options['batch_size'])
+        seconds = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} question(s) with the {index.name} index in {seconds:.1f}s."
+        ))
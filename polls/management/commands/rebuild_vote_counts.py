@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from polls.cache import bump_results_version
+from polls.models import Choice, ChoiceCounterShard, Question
+from polls.routers import use_primary
+from polls.tally import BallotBox
+
+
+class Command(BaseCommand):
+    """
+    Recompute Choice.vote_count from the Vote table, or from the ballots of
+    approval and ranked-choice polls.
+
+    A rebuilt choice's counter shards are folded into vote_count and deleted,
+    and its question's cached results are invalidated once the rebuild commits.
+    With --check the totals are only compared and the command fails if any of
+    them has drifted, which makes it usable as a monitoring job.
+    """
+    help = "Rebuild (or with --check, verify) the denormalized Choice.vote_count counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Report counters that do not match the votes table without changing them.",
+        )
+
+    def handle(self, *args, **options):
+        with use_primary(), transaction.atomic():
+            drifted = []
+            ballot_counts = {}
+            for question in Question.objects.exclude(poll_type=Question.SINGLE).only('id', 'poll_type').iterator():
+                for tally in BallotBox.load(question.id).counts(question.poll_type):
+                    ballot_counts[tally['id']] = tally['vote_count']
+            choices = Choice.objects.with_totals().annotate(num_votes=Count('vote'))
+            for choice in choices.iterator():
+                choice.num_votes = ballot_counts.get(choice.pk, choice.num_votes)
+                if choice.total_votes != choice.num_votes:
+                    self.stdout.write(
+                        f"Choice {choice.pk} ({choice.choice_text}): "
+                        f"vote_count={choice.total_votes}, actual={choice.num_votes}"
+                    )
+                    choice.vote_count = choice.num_votes
+                    drifted.append(choice)
+
+            if options['check']:
+                if drifted:
+                    raise CommandError(f"{len(drifted)} choice counter(s) out of sync.")
+                self.stdout.write(self.style.SUCCESS("All choice counters are in sync."))
+                return
+
+            Choice.objects.bulk_update(drifted, ['vote_count'], batch_size=500)
+            for start in range(0, len(drifted), 500):
+                ChoiceCounterShard.objects.filter(choice__in=drifted[start:start + 500]).delete()
+            question_ids = {choice.question_id for choice in drifted}
+
+            def invalidate():
+                for question_id in question_ids:
+                    bump_results_version(question_id)
+
+            transaction.on_commit(invalidate)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(drifted)} choice counter(s)."))
@@ -0,0 +1,35 @@
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.cache import reset_results_cache_stats, results_cache_stats
+
+
+class Command(BaseCommand):
+    """
+    Print the hit and miss counters of the poll results cache.
+
+    The counters live in the cache, so the command can only read the server's
+    counters when the cache is shared between processes. With a per-process
+    backend such as the default LocMemCache it fails instead of printing the
+    empty counters of its own process.
+    """
+    help = "Show (and optionally reset) the poll results cache hit ratio."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        backend = caches[DEFAULT_CACHE_ALIAS]
+        if isinstance(backend, (LocMemCache, DummyCache)):
+            raise CommandError(
+                f"The cache backend ({type(backend).__name__}) is private to each process, so the server's "
+                "counters cannot be read from here. Set CACHE_BACKEND to a shared cache such as Memcached, "
+                "Redis or the database cache."
+            )
+        stats = results_cache_stats()
+        ratio = 'n/a' if stats['hit_ratio'] is None else f"{stats['hit_ratio']:.1%}"
+        self.stdout.write(f"hits={stats['hits']} misses={stats['misses']} hit_ratio={ratio}")
+        if options['reset']:
+            reset_results_cache_stats()
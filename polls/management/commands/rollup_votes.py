@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.rollups import roll_up, rollup_position
+
+
+class Command(BaseCommand):
+    """
+    Fold new vote events into the per-minute vote rollups.
+
+    Only events after the stored high-water mark are read, so the command can
+    run as often as the trend should be refreshed, e.g. every minute from cron,
+    or keep running with --every.
+    """
+    help = "Fold new VoteEvent rows into the per-minute VoteRollup counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Most events folded per transaction.")
+        parser.add_argument('--lag', type=float, help="Seconds to stay behind the newest events "
+                                                      "(POLLS_ROLLUP_LAG by default).")
+        parser.add_argument('--every', type=float, help="Keep running, rolling up every this many seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            folded = roll_up(batch_size=options['batch_size'], lag=options['lag'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Rolled up {folded} vote event(s); high-water mark is {rollup_position()}."
+            ))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
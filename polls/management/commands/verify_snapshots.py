@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from polls.cache import forget_final_results
+from polls.models import ResultSnapshot
+from polls.routers import use_primary
+
+
+class Command(BaseCommand):
+    """
+    Recount the votes of every frozen question and compare them with its snapshot.
+
+    The command fails if any snapshot has drifted, so it can run as a
+    monitoring job; with --fix the drifted snapshots are rewritten instead.
+    """
+    help = "Verify (or with --fix, repair) the ResultSnapshot tallies of closed questions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help="Rewrite drifted snapshots from the votes table.",
+        )
+
+    def handle(self, *args, **options):
+        with use_primary(), transaction.atomic():
+            drifted = []
+            for snapshot in ResultSnapshot.objects.order_by('question_id').iterator():
+                counts = ResultSnapshot.objects.tally(snapshot.question_id)
+                if counts != snapshot.counts:
+                    self.stdout.write(
+                        f"Question {snapshot.question_id}: snapshot={self.summary(snapshot.counts)}, "
+                        f"actual={self.summary(counts)}"
+                    )
+                    snapshot.counts = counts
+                    drifted.append(snapshot)
+
+            if not options['fix']:
+                if drifted:
+                    raise CommandError(f"{len(drifted)} snapshot(s) out of sync.")
+                self.stdout.write(self.style.SUCCESS("All snapshots are in sync."))
+                return
+
+            ResultSnapshot.objects.bulk_update(drifted, ['counts'], batch_size=500)
+            for snapshot in drifted:
+                transaction.on_commit(lambda question_id=snapshot.question_id: forget_final_results(question_id))
+        self.stdout.write(self.style.SUCCESS(f"Fixed {len(drifted)} snapshot(s)."))
+
+    @staticmethod
+    def summary(counts):
+        return ', '.join(f"{choice['choice_text']}={choice['vote_count']}" for choice in counts)
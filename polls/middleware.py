@@ -0,0 +1,245 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from .routers import use_primary
+
+logger = logging.getLogger('polls.instrumentation')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class PrimaryPinningMiddleware:
+    """
+    Keep a client's reads on the primary database right after it writes.
+
+    Unsafe requests (e.g. a vote) always use the primary and set a short-lived
+    cookie; while that cookie is present the client's reads also go to the
+    primary, so it sees its own vote despite replication lag.
+    """
+    cookie_name = 'polls_use_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.POLLS_DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        writes = request.method not in SAFE_METHODS
+        with use_primary(writes or self.cookie_name in request.COOKIES):
+            response = self.get_response(request)
+        if writes:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=settings.POLLS_REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class InstrumentationMiddleware:
+    """
+    Time each request's queries, template rendering and session writes.
+
+    The numbers are sent back in a Server-Timing header and written to the
+    'polls.instrumentation' logger as one JSON line for a sampled share of
+    requests (POLLS_INSTRUMENTATION_SAMPLE_RATE). Requests over their
+    POLLS_REQUEST_BUDGETS entry are always logged, as a warning.
+
+    It should be the first middleware, so the session save made by
+    SessionMiddleware and the rendering of TemplateResponses are measured too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        request._polls_metrics = metrics
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(metrics.record_query))
+            response = self.get_response(request)
+        metrics.total_ms = (time.perf_counter() - start) * 1000
+
+        session = getattr(request, 'session', None)
+        if session is not None and session.modified:
+            metrics.session_writes += 1
+
+        if settings.POLLS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing()
+        self.log(request, response, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs after every other middleware's hook, right before rendering
+        metrics = request._polls_metrics
+        start = time.perf_counter()
+
+        def rendered(response):
+            metrics.template_ms += (time.perf_counter() - start) * 1000
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log(self, request, response, metrics):
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+        over_budget = metrics.over_budget(settings.POLLS_REQUEST_BUDGETS.get(url_name, {}))
+        if not over_budget and random.random() >= settings.POLLS_INSTRUMENTATION_SAMPLE_RATE:
+            return
+        record = {
+            'url_name': url_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            **metrics.as_dict(),
+            'over_budget': over_budget,
+        }
+        level = logging.WARNING if over_budget else logging.INFO
+        logger.log(level, json.dumps(record))
+
+
+class RequestMetrics:
+    """
+    Counters collected for one request by InstrumentationMiddleware.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.session_writes = 0
+        self.total_ms = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_ms += (time.perf_counter() - start) * 1000
+
+    def over_budget(self, budget):
+        """
+        Returns:
+            list: The budgets ('queries', 'ms') this request went over.
+        """
+        exceeded = []
+        if 'queries' in budget and self.queries > budget['queries']:
+            exceeded.append('queries')
+        if 'ms' in budget and self.total_ms > budget['ms']:
+            exceeded.append('ms')
+        return exceeded
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_ms, 3),
+            'template_ms': round(self.template_ms, 3),
+            'session_writes': self.session_writes,
+            'total_ms': round(self.total_ms, 3),
+        }
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_ms:.3f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_ms:.3f}',
+            f'session;desc="{self.session_writes} writes"',
+            f'total;dur={self.total_ms:.3f}',
+        ])
+
+
+class ProfilingMiddleware:
+    """
+    Run a staff user's request under cProfile when they ask for it.
+
+    Profiling is switched on by the X-Polls-Profile header or the
+    ?profile=1 query parameter. The view (and its template rendering) runs
+    under cProfile, the stats are written to POLLS_PROFILE_DIR, and the top
+    POLLS_PROFILE_TOP_N functions by cumulative time are returned in the
+    X-Profile-Top header. The oldest .prof files are removed once the
+    directory grows over POLLS_PROFILE_MAX_BYTES.
+
+    It should be the last middleware, so every other process_view hook (CSRF
+    in particular) runs before the profiled view.
+    """
+    header = 'HTTP_X_POLLS_PROFILE'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.triggered(request):
+            return None
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+        finally:
+            profiler.disable()
+
+        path = self.save(profiler, request)
+        response['X-Profile-File'] = path.name
+        response['X-Profile-Top'] = '; '.join(self.top_functions(profiler, settings.POLLS_PROFILE_TOP_N))
+        return response
+
+    def triggered(self, request):
+        if request.GET.get('profile') != '1' and request.META.get(self.header) != '1':
+            return False
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    @staticmethod
+    def top_functions(profiler, limit):
+        """
+        Returns:
+            list: 'file:line(function)=cumulative ms' for the `limit` functions
+            with the highest cumulative time.
+        """
+        stats = pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+        top = []
+        for filename, line, name in stats.fcn_list[:limit]:
+            cumulative = stats.stats[(filename, line, name)][3]
+            top.append(f'{os.path.basename(filename)}:{line}({name})={cumulative * 1000:.1f}')
+        return top
+
+    @staticmethod
+    def save(profiler, request):
+        """
+        Write the profile to POLLS_PROFILE_DIR and trim the directory to its size cap.
+
+        Returns:
+            Path: The written .prof file.
+        """
+        directory = Path(settings.POLLS_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        match = request.resolver_match
+        name = (match.view_name if match else 'request').replace(':', '-')
+        path = directory / f'{time.time_ns()}-{name}.prof'
+        profiler.dump_stats(path)
+
+        files = sorted(directory.glob('*.prof'), key=lambda file: file.stat().st_mtime)
+        total = sum(file.stat().st_size for file in files)
+        for file in files[:-1]:
+            if total <= settings.POLLS_PROFILE_MAX_BYTES:
+                break
+            total -= file.stat().st_size
+            file.unlink()
+        return path
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.21 on 2026-10-18 16:34
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_vote_count(apps, schema_editor):
+    """Fill vote_count from the existing Choice.votes rows."""
+    Choice = apps.get_model('polls', 'Choice')
+    db_alias = schema_editor.connection.alias
+    choices = Choice.objects.using(db_alias).annotate(num_votes=Count('votes'))
+    for choice in choices.iterator():
+        choice.vote_count = choice.num_votes
+        choice.save(update_fields=['vote_count'], using=db_alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_alter_choice_votes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_vote_count, migrations.RunPython.noop),
+    ]
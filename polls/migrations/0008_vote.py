@@ -0,0 +1,78 @@
+# Generated by Django 3.2.21 on 2026-10-18 16:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def copy_votes_forward(apps, schema_editor):
+    """
+    Move Choice.votes rows into Vote, keeping one vote per (user, question).
+
+    Older code could leave a user with votes on two choices of the same
+    question; the vote on the choice with the highest id is kept. The
+    vote_count counters are recomputed from the copied rows.
+    """
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    through = Choice.votes.through
+    db_alias = schema_editor.connection.alias
+
+    rows = (through.objects.using(db_alias).values_list('user_id', 'choice__question_id', 'choice_id')
+            .order_by('user_id', 'choice__question_id', '-choice_id'))
+    votes = {}
+    for user_id, question_id, choice_id in rows.iterator():
+        votes.setdefault((user_id, question_id), choice_id)
+    Vote.objects.using(db_alias).bulk_create(
+        [Vote(user_id=user_id, question_id=question_id, choice_id=choice_id)
+         for (user_id, question_id), choice_id in votes.items()],
+        batch_size=1000,
+    )
+
+    for choice in Choice.objects.using(db_alias).annotate(num_votes=Count('vote')).iterator():
+        if choice.vote_count != choice.num_votes:
+            choice.vote_count = choice.num_votes
+            choice.save(update_fields=['vote_count'], using=db_alias)
+
+
+def copy_votes_backward(apps, schema_editor):
+    """Restore Choice.votes from the Vote rows."""
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    through = Choice.votes.through
+    db_alias = schema_editor.connection.alias
+    through.objects.using(db_alias).bulk_create(
+        [through(user_id=user_id, choice_id=choice_id)
+         for user_id, choice_id in Vote.objects.using(db_alias).values_list('user_id', 'choice_id').iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0007_choice_vote_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='unique_vote_per_question'),
+        ),
+        migrations.RunPython(copy_votes_forward, copy_votes_backward),
+        migrations.RemoveField(
+            model_name='choice',
+            name='votes',
+        ),
+    ]
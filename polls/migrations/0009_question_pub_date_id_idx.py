@@ -0,0 +1,17 @@
+# Generated by Django 3.2.21 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_vote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-pub_date', '-id'], name='question_pub_date_id_idx'),
+        ),
+    ]
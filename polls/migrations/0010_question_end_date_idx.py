@@ -0,0 +1,17 @@
+# Generated by Django 3.2.21 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_question_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['end_date'], name='question_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.21 on 2026-10-18 16:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_resultsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='counter_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text="Spread each choice's vote count over this many rows (0 for off), so concurrent votes on a busy poll lock different rows."),
+        ),
+        migrations.CreateModel(
+            name='ChoiceCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='polls.choice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='choicecountershard',
+            constraint=models.UniqueConstraint(fields=('choice', 'shard'), name='unique_counter_shard'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.21 on 2026-10-18 17:06
+
+from django.db import OperationalError, migrations, models, transaction
+import django.db.models.deletion
+import polls.models
+
+
+def create_fts_index(apps, schema_editor):
+    """
+    Create and fill the FTS5 search index on SQLite builds that have FTS5.
+
+    Elsewhere polls.search falls back to the SearchTerm table; fill it with
+    `manage.py rebuild_search_index`.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE polls_question_fts USING fts5("
+                "question_text, choice_text, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+    except OperationalError:
+        return
+    # rank orders matches by bm25 with question text weighted double
+    schema_editor.execute(
+        "INSERT INTO polls_question_fts (polls_question_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')"
+    )
+    schema_editor.execute(
+        "INSERT INTO polls_question_fts (rowid, question_text, choice_text) "
+        "SELECT q.id, q.question_text, COALESCE((SELECT group_concat(c.choice_text, ' ') "
+        "FROM polls_choice c WHERE c.question_id = q.id), '') FROM polls_question q"
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS polls_question_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_vote_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionSearchDocument',
+            fields=[
+                ('question', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='polls.question')),
+                ('question_text', models.TextField()),
+                ('choice_text', models.TextField()),
+                ('document', polls.models.SearchDocumentField(db_column='polls_question_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'polls_question_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('weight', models.PositiveIntegerField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='polls.question')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchterm',
+            constraint=models.UniqueConstraint(fields=('term', 'question'), name='unique_search_term'),
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
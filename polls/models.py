@@ -1,9 +1,80 @@
 import datetime
 
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import (
+    Case, CharField, Count, ExpressionWrapper, F, IntegerField, Min, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+from .cache import bump_results_version, bump_user_votes_version, forget_final_results
+
+
+
+class QuestionQuerySet(models.QuerySet):
+    """
+    QuerySet for Question that works out poll state in SQL from pub_date and end_date.
+
+    Each method takes an optional `now` so that several filters in one request
+    can share the same instant.
+    """
+
+    def published(self, now=None):
+        """
+        Questions whose pub_date has passed.
+        """
+        return self.filter(pub_date__lte=now or timezone.now())
+
+    def upcoming(self, now=None):
+        """
+        Questions that are not published yet.
+        """
+        return self.filter(pub_date__gt=now or timezone.now())
+
+    def open(self, now=None):
+        """
+        Questions that can currently be voted on (see Question.can_vote).
+        """
+        now = now or timezone.now()
+        return self.filter(Q(end_date__isnull=True) | Q(end_date__gte=now), pub_date__lte=now)
+
+    def closed(self, now=None):
+        """
+        Questions whose end_date has passed.
+        """
+        return self.filter(end_date__lt=now or timezone.now())
+
+    def final(self, now=None):
+        """
+        Questions whose tallies can no longer change (see Question.is_final).
+        """
+        return self.closed((now or timezone.now()) - Question.finalize_delay())
+
+    def annotate_state(self, now=None):
+        """
+        Annotate each question with `state`: 'upcoming', 'open' or 'closed'.
+        """
+        now = now or timezone.now()
+        return self.annotate(state=Case(
+            When(pub_date__gt=now, then=Value(Question.UPCOMING)),
+            When(end_date__lt=now, then=Value(Question.CLOSED)),
+            default=Value(Question.OPEN),
+            output_field=CharField(),
+        ))
+
+    def next_state_change(self, now=None):
+        """
+        Return the next moment after `now` when a question opens or closes, or None.
+        """
+        now = now or timezone.now()
+        boundaries = self.aggregate(
+            next_pub_date=Min('pub_date', filter=Q(pub_date__gt=now)),
+            next_end_date=Min('end_date', filter=Q(end_date__gte=now)),
+        )
+        return min((moment for moment in boundaries.values() if moment is not None), default=None)
 
 
 class Question(models.Model):
@@ -14,14 +85,67 @@ class Question(models.Model):
         question_text (str): The text of the question.
         pub_date (datetime): The date and time when the question was published.
         end_date (datetime, optional): The end date and time for voting (optional).
+        counter_shards (int): Number of ChoiceCounterShard rows per choice; 0 counts in Choice.vote_count.
+        poll_type (str): SINGLE (one choice per voter, stored as a Vote), APPROVAL
+            (any number of choices) or RANKED (choices in order of preference,
+            decided by instant runoff); the last two are stored as Ballots.
     """
+    SINGLE = 'single'
+    APPROVAL = 'approval'
+    RANKED = 'ranked'
+    POLL_TYPES = [
+        (SINGLE, 'Single choice'),
+        (APPROVAL, 'Approval (any number of choices)'),
+        (RANKED, 'Ranked choice (instant runoff)'),
+    ]
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published', auto_now_add=False)
     end_date = models.DateTimeField('end date for voting', null=True, blank=True)
+    counter_shards = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Spread each choice's vote count over this many rows (0 for off), "
+                  "so concurrent votes on a busy poll lock different rows.",
+    )
+    poll_type = models.CharField(max_length=8, choices=POLL_TYPES, default=SINGLE)
+
+    UPCOMING = 'upcoming'
+    OPEN = 'open'
+    CLOSED = 'closed'
 
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the keyset pagination of the index page and published()
+            models.Index(fields=['-pub_date', '-id'], name='question_pub_date_id_idx'),
+            # Serves open() and closed()
+            models.Index(fields=['end_date'], name='question_end_date_idx'),
+        ]
 
     def __str__(self):
         return self.question_text
+
+    def clean(self):
+        """
+        Raises:
+            ValidationError: If the poll type of a question that has votes is changed.
+        """
+        if self.pk is None:
+            return
+        saved_type = Question.objects.filter(pk=self.pk).values_list('poll_type', flat=True).first()
+        if saved_type not in (None, self.poll_type) and (
+                Vote.objects.filter(question_id=self.pk).exists() or Ballot.objects.filter(question_id=self.pk).exists()):
+            raise ValidationError({'poll_type': "The poll type cannot be changed once people have voted."})
+
+    def uses_ballots(self):
+        """
+        Check if votes on this question are Ballots rather than Votes.
+
+        Returns:
+            bool: True for approval and ranked-choice polls.
+        """
+        return self.poll_type != self.SINGLE
     
     def was_published_recently(self):
         """
@@ -55,8 +179,38 @@ class Question(models.Model):
             return self.pub_date <= now <= self.end_date
         else:
             return self.pub_date <= now
+
+    def is_final(self, now=None):
+        """
+        Check if voting closed long enough ago that the tallies can no longer change.
+
+        Votes sent just before the close may still be written for
+        POLLS_FINALIZE_DELAY seconds afterwards (e.g. by the vote queue).
+
+        Returns:
+            bool: True if the results can be frozen, False otherwise.
+        """
+        if self.end_date is None:
+            return False
+        return self.end_date < (now or timezone.now()) - self.finalize_delay()
+
+    @staticmethod
+    def finalize_delay():
+        return datetime.timedelta(seconds=settings.POLLS_FINALIZE_DELAY)
     
 
+class ChoiceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each choice with `total_votes`: its vote_count plus its counter shards.
+        """
+        shards = (ChoiceCounterShard.objects.filter(choice=OuterRef('pk')).order_by()
+                  .values('choice').annotate(total=Sum('count')).values('total'))
+        return self.annotate(total_votes=ExpressionWrapper(
+            F('vote_count') + Coalesce(Subquery(shards), 0), output_field=IntegerField(),
+        ))
+
+
 class Choice(models.Model):
     """
     Model representing a choice for a question in the polls app.
@@ -64,11 +218,692 @@ class Choice(models.Model):
     Attributes:
         question (Question): The question associated with this choice.
         choice_text (str): The text of the choice.
-        votes (ManyToManyField): The users who have voted for this choice.
+        vote_count (int): Denormalized number of votes, kept in step with `Vote`
+            (on ballot polls: approvals, or first preferences on a ranked
+            poll). On a sharded question the counter shards hold the rest of
+            the total (see ChoiceQuerySet.with_totals).
     """
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
-    votes = models.ManyToManyField(User, related_name='voted_choices', blank=True)
+    vote_count = models.PositiveIntegerField(default=0)
+
+    objects = ChoiceQuerySet.as_manager()
     
     def __str__(self):
         return self.choice_text
+
+
+class ChoiceCounterShardManager(models.Manager):
+    def add(self, choice_id, shard, delta):
+        """
+        Add `delta` to one counter shard of a choice, creating the row if needed.
+        """
+        db = self._db or router.db_for_write(self.model)
+        connection = connections[db]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            counter = self.using(db).filter(choice_id=choice_id, shard=shard)
+            if not counter.update(count=F('count') + delta):
+                try:
+                    with transaction.atomic(using=db):
+                        self.using(db).create(choice_id=choice_id, shard=shard, count=delta)
+                except IntegrityError:
+                    counter.update(count=F('count') + delta)
+            return
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        choice_col, shard_col, count_col = (
+            qn(self.model._meta.get_field(name).column) for name in ('choice', 'shard', 'count')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({choice_col}, {shard_col}, {count_col}) VALUES (%s, %s, %s) '
+                f'ON CONFLICT ({choice_col}, {shard_col}) DO UPDATE SET {count_col} = {table}.{count_col} + %s',
+                [choice_id, shard, delta, delta],
+            )
+
+    def fold(self, question_id):
+        """
+        Move the counts of a question's shards into Choice.vote_count and delete the shards.
+
+        Returns:
+            int: The number of shard rows folded.
+        """
+        db = self._db or router.db_for_write(self.model)
+        shards = self.using(db).filter(choice__question_id=question_id)
+        if not shards.exists():
+            return 0
+        with transaction.atomic(using=db):
+            for row in shards.order_by().values('choice_id').annotate(total=Sum('count')):
+                if row['total']:
+                    Choice.objects.using(db).filter(pk=row['choice_id']).update(
+                        vote_count=F('vote_count') + row['total'])
+            folded, _ = shards.delete()
+        return folded
+
+
+class ChoiceCounterShard(models.Model):
+    """
+    One of the partial vote counters of a choice on a sharded question.
+
+    A choice's total is its vote_count plus the counts of all its shards. A
+    shard's count can be negative, e.g. when votes counted in vote_count
+    before sharding was switched on move to another choice.
+
+    Attributes:
+        choice (Choice): The choice counted.
+        shard (int): The shard number, below the question's counter_shards.
+        count (int): This shard's part of the choice's total.
+    """
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = ChoiceCounterShardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'], name='unique_counter_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.choice} #{self.shard}: {self.count}"
+
+
+def _count_vote(db, question, user_id, choice_id, delta):
+    """
+    Add `delta` to a choice's count.
+
+    On a sharded question the count goes to the shard picked by the user id,
+    so concurrent voters mostly lock different rows, and a user's vote
+    always moves within the same shard.
+    """
+    if question.counter_shards:
+        ChoiceCounterShard.objects.db_manager(db).add(choice_id, user_id % question.counter_shards, delta)
+    else:
+        _add_to_vote_count(db, choice_id, delta)
+
+
+def _add_to_vote_count(db, choice_id, delta):
+    """
+    Add `delta` to Choice.vote_count.
+
+    A decrement that vote_count cannot cover goes to shard 0 instead: the
+    rest of the count is still in shards from when the question was
+    sharded, e.g. if votes were cast while sharding was being turned off.
+    """
+    choices = Choice.objects.using(db).filter(pk=choice_id)
+    if delta >= 0:
+        choices.update(vote_count=F('vote_count') + delta)
+    elif not choices.filter(vote_count__gte=-delta).update(vote_count=F('vote_count') + delta):
+        ChoiceCounterShard.objects.db_manager(db).add(choice_id, 0, delta)
+
+
+def _invalidate(db, question_ids, user_ids):
+    """
+    Drop the snapshots and, once committed, the cached results and voted sets
+    that removed or late votes change.
+    """
+    ResultSnapshot.objects.using(db).filter(question_id__in=question_ids).delete()
+
+    def invalidate():
+        for question_id in question_ids:
+            bump_results_version(question_id)
+            forget_final_results(question_id)
+        for user_id in user_ids:
+            bump_user_votes_version(user_id)
+
+    transaction.on_commit(invalidate, using=db)
+
+
+class VoteManager(models.Manager):
+    """
+    Manager for Vote that records votes with a single upsert statement.
+    """
+
+    #: How many times cast() re-reads the previous vote after losing a race.
+    max_attempts = 5
+
+    @property
+    def write_db(self):
+        """
+        The database votes are written to; cast() also reads from it, never from a replica.
+        """
+        return self._db or router.db_for_write(self.model)
+
+    def cast(self, user, question, choice):
+        """
+        Record `user`'s vote for `choice`, replacing any earlier vote on `question`.
+
+        The previous choice is read with one lookup on the (user, question) index,
+        then the vote is written with one upsert that only applies if that row is
+        still unchanged. Choice.vote_count is adjusted and a VoteEvent appended in
+        the same transaction, and the cached results (and, for a first vote, the
+        user's cached set of voted questions) move to a new version once it commits.
+
+        Returns:
+            int or None: The id of the previously selected choice, or None for a first vote.
+        """
+        db = self.write_db
+        with transaction.atomic(using=db):
+            for _ in range(self.max_attempts):
+                previous_id = (self.using(db).filter(user=user, question=question)
+                               .values_list('choice_id', flat=True).first())
+                if previous_id == choice.id:
+                    return previous_id
+                if self._upsert(user.id, question.id, choice.id, previous_id):
+                    break
+            else:
+                raise IntegrityError(f"Could not record vote of user {user.id} on question {question.id}.")
+
+            _count_vote(db, question, user.id, choice.id, 1)
+            if previous_id is not None:
+                _count_vote(db, question, user.id, previous_id, -1)
+            VoteEvent.objects.using(db).create(
+                kind=VoteEvent.CAST if previous_id is None else VoteEvent.SWITCH,
+                user_id=user.id, question_id=question.id, choice_id=choice.id, previous_choice_id=previous_id,
+            )
+            if question.is_final():
+                # Only staff can vote this late (in the admin); the frozen tallies are out of date
+                _invalidate(db, [question.id], ())
+            transaction.on_commit(lambda: bump_results_version(question.id), using=db)
+            if previous_id is None:
+                transaction.on_commit(lambda: bump_user_votes_version(user.id), using=db)
+        return previous_id
+
+    def _upsert(self, user_id, question_id, choice_id, previous_id):
+        """
+        Insert the vote, or move it from `previous_id` to `choice_id`, in one statement.
+
+        Returns:
+            bool: False if a concurrent request changed the row first.
+        """
+        connection = connections[self.write_db]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return self._upsert_fallback(user_id, question_id, choice_id, previous_id)
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        user_col, question_col, choice_col = (
+            qn(self.model._meta.get_field(name).column) for name in ('user', 'question', 'choice')
+        )
+        params = [user_id, question_id, choice_id]
+        if previous_id is None:
+            on_conflict = 'DO NOTHING'
+        else:
+            on_conflict = (f'DO UPDATE SET {choice_col} = EXCLUDED.{choice_col} '
+                           f'WHERE {table}.{choice_col} = %s')
+            params.append(previous_id)
+        sql = (f'INSERT INTO {table} ({user_col}, {question_col}, {choice_col}) VALUES (%s, %s, %s) '
+               f'ON CONFLICT ({user_col}, {question_col}) {on_conflict}')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount == 1
+
+    def _upsert_fallback(self, user_id, question_id, choice_id, previous_id):
+        """
+        Portable version of _upsert() for backends without ON CONFLICT.
+        """
+        if previous_id is not None:
+            return self.using(self.write_db).filter(user_id=user_id, question_id=question_id,
+                                                    choice_id=previous_id).update(choice_id=choice_id) == 1
+        try:
+            with transaction.atomic(using=self.write_db):
+                self.using(self.write_db).create(user_id=user_id, question_id=question_id, choice_id=choice_id)
+        except IntegrityError:
+            return False
+        return True
+
+    def withdraw(self, votes):
+        """
+        Delete `votes`, take them off their choices' counts and log their withdrawal.
+
+        Returns:
+            int: The number of votes deleted.
+        """
+        db = self.write_db
+        with transaction.atomic(using=db):
+            votes = votes.using(db)
+            per_choice = list(votes.order_by().values('choice_id', 'question_id', 'question__counter_shards')
+                              .annotate(num_votes=Count('pk')))
+            user_ids = self._log_withdrawals(db, votes)
+            deleted, _ = votes.delete()
+            for row in per_choice:
+                if row['question__counter_shards']:
+                    # vote_count may hold less than the withdrawn votes; shards can go negative
+                    ChoiceCounterShard.objects.db_manager(db).add(row['choice_id'], 0, -row['num_votes'])
+                else:
+                    _add_to_vote_count(db, row['choice_id'], -row['num_votes'])
+            _invalidate(db, {row['question_id'] for row in per_choice}, user_ids)
+        return deleted
+
+    def reset(self, question_ids):
+        """
+        Delete every vote and ballot on the given questions and zero their
+        counters, with a single UPDATE and one DELETE per table.
+
+        Returns:
+            int: The number of votes and ballots deleted.
+        """
+        db = self.write_db
+        question_ids = list(question_ids)
+        with transaction.atomic(using=db):
+            votes = self.using(db).filter(question_id__in=question_ids)
+            user_ids = self._log_withdrawals(db, votes)
+            deleted, _ = votes.delete()
+            ballots = Ballot.objects.using(db).filter(question_id__in=question_ids)
+            user_ids.update(ballots.values_list('user_id', flat=True))
+            deleted += ballots.delete()[0]
+            Choice.objects.using(db).filter(question_id__in=question_ids).update(vote_count=0)
+            ChoiceCounterShard.objects.using(db).filter(choice__question_id__in=question_ids).delete()
+            _invalidate(db, question_ids, user_ids)
+        return deleted
+
+    @staticmethod
+    def _log_withdrawals(db, votes):
+        """
+        Append a WITHDRAW event for each of `votes`.
+
+        Returns:
+            set: The ids of the users whose votes they are.
+        """
+        VoteEvent.objects.db_manager(db).log_withdrawals(votes)
+        return set(votes.order_by().values_list('user_id', flat=True).distinct().iterator())
+
+
+class Vote(models.Model):
+    """
+    Model representing one user's vote on a question.
+
+    Attributes:
+        user (User): The user who voted.
+        question (Question): The question voted on; a user has at most one vote per question.
+        choice (Choice): The selected choice.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+
+    objects = VoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'], name='unique_vote_per_question'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.choice}"
+
+
+class BallotManager(models.Manager):
+    """
+    Manager for Ballot that keeps the choice counters in step with the ballots.
+    """
+
+    #: How many times cast() re-reads the previous ballot after losing a race.
+    max_attempts = 5
+
+    def cast(self, user, question, choice_ids):
+        """
+        Record `user`'s ballot on an approval or ranked-choice question, replacing any earlier one.
+
+        The choice counters move in the same transaction: every approved
+        choice counts on an approval poll, only the first preference on a
+        ranked one. The cached results move to a new version once it commits.
+
+        Args:
+            choice_ids (list): Ids of the question's choices; most preferred
+                first on a ranked poll.
+
+        Returns:
+            list or None: The choice ids of the previous ballot, or None for a first ballot.
+
+        Raises:
+            ValueError: If `choice_ids` is empty or repeats a choice.
+        """
+        from .tally import pack, unpack
+
+        choice_ids = list(choice_ids)
+        if not choice_ids or len(set(choice_ids)) != len(choice_ids):
+            raise ValueError("A ballot needs at least one choice and may not repeat a choice.")
+        if question.poll_type == Question.APPROVAL:
+            choice_ids.sort()
+        packed = pack(choice_ids)
+
+        db = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=db):
+            for _ in range(self.max_attempts):
+                previous = self.using(db).filter(user=user, question=question).values_list('pk', 'choices').first()
+                if previous is None:
+                    try:
+                        with transaction.atomic(using=db):
+                            self.using(db).create(user=user, question=question, choices=packed)
+                    except IntegrityError:
+                        continue
+                    previous_ids = None
+                    break
+                previous_ids = unpack(previous[1])
+                if previous_ids == choice_ids:
+                    return previous_ids
+                if self.using(db).filter(pk=previous[0], choices=previous[1]).update(choices=packed):
+                    break
+            else:
+                raise IntegrityError(f"Could not record ballot of user {user.id} on question {question.id}.")
+
+            counted = self.counted(question, choice_ids)
+            counted_before = self.counted(question, previous_ids or [])
+            for choice_id in counted - counted_before:
+                _count_vote(db, question, user.id, choice_id, 1)
+            for choice_id in counted_before - counted:
+                _count_vote(db, question, user.id, choice_id, -1)
+            if question.is_final():
+                _invalidate(db, [question.id], ())
+            transaction.on_commit(lambda: bump_results_version(question.id), using=db)
+            if previous_ids is None:
+                transaction.on_commit(lambda: bump_user_votes_version(user.id), using=db)
+        return previous_ids
+
+    @staticmethod
+    def counted(question, choice_ids):
+        """
+        Returns:
+            set: The choices of a ballot that count in Choice.vote_count.
+        """
+        if question.poll_type == Question.RANKED:
+            return set(choice_ids[:1])
+        return set(choice_ids)
+
+
+class Ballot(models.Model):
+    """
+    One user's ballot on an approval or ranked-choice question.
+
+    Attributes:
+        user (User): The voter; a user has at most one ballot per question.
+        question (Question): The question voted on.
+        choices (bytes): The chosen choice ids packed as 64-bit integers (see
+            polls.tally.pack); in order of preference on a ranked poll.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choices = models.BinaryField()
+
+    objects = BallotManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'], name='unique_ballot_per_question'),
+        ]
+
+    def __str__(self):
+        return f"Ballot of {self.user} on {self.question}"
+
+    @property
+    def choice_ids(self):
+        from .tally import unpack
+        return unpack(self.choices)
+
+
+class ResultSnapshotManager(models.Manager):
+    """
+    Manager that freezes the tallies of closed questions.
+    """
+
+    def tally(self, question_id, using=None):
+        """
+        Count a question's votes from the Vote table, or its ballots on an
+        approval or ranked-choice poll.
+
+        Returns:
+            list: One dict per choice with 'id', 'choice_text' and 'vote_count',
+            in the same form as get_results().
+        """
+        using = using or router.db_for_write(Choice)
+        poll_type = Question.objects.using(using).filter(pk=question_id).values_list('poll_type', flat=True).first()
+        if poll_type not in (None, Question.SINGLE):
+            from .tally import BallotBox
+            return BallotBox.load(question_id, using).counts(poll_type)
+        choices = (Choice.objects.using(using).filter(question_id=question_id)
+                   .order_by('pk').annotate(num_votes=Count('vote')).values_list('id', 'choice_text', 'num_votes'))
+        return [{'id': choice_id, 'choice_text': text, 'vote_count': votes} for choice_id, text, votes in choices]
+
+    def finalize(self, question):
+        """
+        Return the snapshot of a closed question, creating it from its votes if needed.
+        """
+        db = self._db or router.db_for_write(self.model)
+        snapshot = self.using(db).filter(question_id=question.pk).first()
+        if snapshot is None:
+            snapshot, _ = self.using(db).get_or_create(
+                question_id=question.pk, defaults={'counts': self.tally(question.pk, db)},
+            )
+        return snapshot
+
+
+class ResultSnapshot(models.Model):
+    """
+    The final tallies of a closed question, so its votes are never counted again.
+
+    Attributes:
+        question (Question): The closed question.
+        counts (list): One dict per choice with 'id', 'choice_text' and 'vote_count'.
+        created_at (datetime): When the results were frozen.
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    counts = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ResultSnapshotManager()
+
+    def __str__(self):
+        return f"Results of {self.question_id}"
+
+
+class VoteEventManager(models.Manager):
+    def log_withdrawals(self, votes):
+        """
+        Append a WITHDRAW event for each of `votes` with one INSERT ... SELECT,
+        so no vote is loaded into Python however many are withdrawn.
+
+        Returns:
+            int: The number of events appended.
+        """
+        db = self._db or router.db_for_write(self.model)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        columns = ', '.join(qn(opts.get_field(name).column)
+                            for name in ('kind', 'created_at', 'user', 'question', 'choice'))
+        select, params = (votes.using(db).order_by().values_list('user_id', 'question_id', 'choice_id')
+                          .query.get_compiler(db).as_sql())
+        created_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(opts.db_table)} ({columns}) SELECT %s, %s, withdrawn.* FROM ({select}) withdrawn',
+                [self.model.WITHDRAW, created_at, *params],
+            )
+            return cursor.rowcount
+
+
+class VoteEvent(models.Model):
+    """
+    One entry of the append-only log of votes, written in the same transaction as the vote.
+
+    Rows are only ever inserted. VoteRollup folds them into per-minute counts,
+    which is what the vote trend is read from.
+
+    Attributes:
+        kind (str): CAST for a first vote, SWITCH for a vote moved from
+            `previous_choice`, WITHDRAW for a vote deleted from `choice`.
+        user (User): The voter; None once the user is deleted.
+        question (Question): The question voted on.
+        choice (Choice): The choice voted for (or withdrawn from).
+        previous_choice (Choice, optional): The choice a SWITCH moved the vote away from.
+        created_at (datetime): When the vote was recorded.
+    """
+    CAST = 'cast'
+    SWITCH = 'switch'
+    WITHDRAW = 'withdraw'
+    KIND_CHOICES = [(CAST, 'Cast'), (SWITCH, 'Switched'), (WITHDRAW, 'Withdrawn')]
+
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    previous_choice = models.ForeignKey(Choice, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = VoteEventManager()
+
+    def __str__(self):
+        return f"{self.kind} {self.choice_id} by {self.user_id} at {self.created_at:%Y-%m-%d %H:%M:%S}"
+
+
+class VoteRollupManager(models.Manager):
+    def add(self, rows):
+        """
+        Add per-minute counts to the rollups, creating the buckets that do not exist yet.
+
+        Args:
+            rows (iterable): (question_id, choice_id, minute, added, removed) tuples,
+                at most one per (choice_id, minute).
+        """
+        db = self._db or router.db_for_write(self.model)
+        connection = connections[db]
+        rows = list(rows)
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            for question_id, choice_id, minute, added, removed in rows:
+                bucket = self.using(db).filter(choice_id=choice_id, minute=minute)
+                if not bucket.update(added=F('added') + added, removed=F('removed') + removed):
+                    self.using(db).create(question_id=question_id, choice_id=choice_id, minute=minute,
+                                          added=added, removed=removed)
+            return
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        question_col, choice_col, minute_col, added_col, removed_col = (
+            qn(self.model._meta.get_field(name).column)
+            for name in ('question', 'choice', 'minute', 'added', 'removed')
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} ({question_col}, {choice_col}, {minute_col}, {added_col}, {removed_col}) '
+                f'VALUES (%s, %s, %s, %s, %s) ON CONFLICT ({choice_col}, {minute_col}) DO UPDATE SET '
+                f'{added_col} = {table}.{added_col} + excluded.{added_col}, '
+                f'{removed_col} = {table}.{removed_col} + excluded.{removed_col}',
+                [(question_id, choice_id, connection.ops.adapt_datetimefield_value(minute), added, removed)
+                 for question_id, choice_id, minute, added, removed in rows],
+            )
+
+
+class VoteRollup(models.Model):
+    """
+    The votes a choice gained and lost in one minute, folded from VoteEvent by polls.rollups.
+
+    Attributes:
+        question (Question): The choice's question, so a trend is read with one index range.
+        choice (Choice): The choice counted.
+        minute (datetime): Start of the minute (UTC).
+        added (int): Votes cast for or switched to the choice.
+        removed (int): Votes switched away from or withdrawn from the choice.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    minute = models.DateTimeField()
+    added = models.PositiveIntegerField(default=0)
+    removed = models.PositiveIntegerField(default=0)
+
+    objects = VoteRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'minute'], name='unique_rollup_minute'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'minute'], name='rollup_question_minute_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.choice} at {self.minute:%Y-%m-%d %H:%M}: +{self.added} -{self.removed}"
+
+
+class RollupCheckpoint(models.Model):
+    """
+    High-water mark of a rollup job: every event up to `position` has been folded in.
+
+    Attributes:
+        name (str): The rollup's name.
+        position (int): Id of the last VoteEvent included.
+        updated_at (datetime): When the rollup last advanced.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class SearchTerm(models.Model):
+    """
+    One word of a question's search document, in the inverted index used without FTS5.
+
+    Attributes:
+        question (Question): The question whose text or choices contain the word.
+        term (str): The word, case-folded.
+        weight (int): How often it occurs, words of the question text counting double.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=100)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'question'], name='unique_search_term'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} in {self.question_id}"
+
+
+class SearchDocumentField(models.TextField):
+    """
+    The hidden column of an FTS5 table that has the table's name; MATCH runs against it.
+    """
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class QuestionSearchDocument(models.Model):
+    """
+    A row of the SQLite FTS5 index polls_question_fts, created by migration 0014.
+
+    The table is not managed by Django and only exists on SQLite builds with
+    FTS5; polls.search writes to it with raw SQL and joins it to Question to
+    search.
+
+    Attributes:
+        question (Question): The indexed question (the FTS5 rowid).
+        question_text (str): The question's text.
+        choice_text (str): The texts of its choices.
+        document (str): The hidden column to MATCH a query against.
+        rank (float): bm25 rank of the match, question text weighted double; lower is better.
+    """
+    question = models.OneToOneField(Question, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True,
+                                    db_column='rowid', related_name='search_document')
+    question_text = models.TextField()
+    choice_text = models.TextField()
+    document = SearchDocumentField(db_column='polls_question_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'polls_question_fts'
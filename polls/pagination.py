@@ -0,0 +1,150 @@
+"""
+Keyset (cursor) pagination for the polls app.
+
+Offset pagination makes the database skip every row before the requested
+page, so deep pages get slower. A keyset page instead continues strictly
+after the last row of the previous page, which an index on the ordering
+columns answers in constant time however deep the user pages.
+"""
+import base64
+import datetime
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class KeysetPage:
+    """
+    One page of results from KeysetPaginator.
+
+    The page is only fetched from the database when its objects or its next
+    cursor are first used, so a view can hand it to a cached template
+    fragment without paying for a query on a cache hit.
+
+    Attributes:
+        cursor (str or None): The cursor this page was requested with.
+    """
+
+    def __init__(self, paginator, queryset, cursor):
+        self.paginator = paginator
+        self.queryset = queryset
+        self.cursor = cursor
+
+    @cached_property
+    def _rows(self):
+        objects = list(self.queryset[:self.paginator.per_page + 1])
+        if len(objects) > self.paginator.per_page:
+            objects = objects[:self.paginator.per_page]
+            return objects, self.paginator.encode_cursor(objects[-1])
+        return objects, None
+
+    @property
+    def object_list(self):
+        """The objects on this page."""
+        return self._rows[0]
+
+    @property
+    def next_cursor(self):
+        """The cursor of the following page, or None on the last page."""
+        return self._rows[1]
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on a unique ordering using opaque cursors.
+
+    Attributes:
+        queryset (QuerySet): The queryset to paginate, ordered by `ordering`.
+        ordering (tuple): Field names, '-' prefixed for descending; the last one must be unique.
+        per_page (int): The number of objects on each page.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.ordering = tuple(ordering)
+        self.queryset = queryset.order_by(*self.ordering)
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """
+        Return the page that starts right after `cursor` (the first page if None).
+
+        The cursor is checked straight away; the rows are fetched lazily.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+        return KeysetPage(self, queryset, cursor or None)
+
+    def _after(self, values):
+        """
+        Build the filter for rows that sort strictly after `values`.
+        """
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): value for f, value in zip(self.ordering[:i], values)}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+        return reduce(or_, conditions)
+
+    def encode_cursor(self, obj):
+        """
+        Return the cursor pointing just after `obj`.
+        """
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Return the ordering values stored in `cursor`.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError) as exc:
+            raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+
+        opts = self.queryset.model._meta
+        decoded = []
+        for field, value in zip(self.ordering, values):
+            # encode_cursor() only writes scalars
+            if isinstance(value, (list, dict)):
+                raise ValueError(f"Invalid cursor: {cursor!r}")
+            try:
+                value = opts.get_field(field.lstrip('-')).to_python(value)
+            except FieldDoesNotExist:
+                pass
+            except (ValidationError, TypeError) as exc:
+                raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+            decoded.append(value)
+        return decoded
@@ -0,0 +1,59 @@
+"""
+Database routing between the primary database and read replicas.
+
+Reads of the polls models go to one of the aliases in
+POLLS_DATABASE_REPLICAS, writes always go to 'default'. Code that must see
+its own writes (the vote path, or a user who has just voted) pins its reads
+to the primary with use_primary().
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_primary_pinned = contextvars.ContextVar('polls_primary_pinned', default=False)
+
+
+@contextmanager
+def use_primary(pinned=True):
+    """
+    Send every read of the polls models in this context to the primary database.
+    """
+    token = _primary_pinned.set(pinned)
+    try:
+        yield
+    finally:
+        _primary_pinned.reset(token)
+
+
+def primary_pinned():
+    return _primary_pinned.get()
+
+
+class PrimaryReplicaRouter:
+    """
+    Route polls reads to the replicas and polls writes to the primary.
+    """
+    route_app_labels = {'polls'}
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.POLLS_DATABASE_REPLICAS
+        if model._meta.app_label not in self.route_app_labels:
+            return None
+        if not replicas or primary_pinned():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in self.route_app_labels:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.POLLS_DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
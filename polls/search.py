@@ -0,0 +1,219 @@
+"""
+Full-text search over poll questions and the text of their choices.
+
+Every question has one search document: its text and the texts of its
+choices. Two inverted indexes can hold the documents:
+
+    Fts5Index    the SQLite FTS5 table polls_question_fts (see migration
+                 0014), ranked by bm25
+    TokenIndex   the SearchTerm table, one row per word and question,
+                 tokenized in Python; it works on every database
+
+POLLS_SEARCH_BACKEND picks one; 'auto' uses FTS5 when the table exists.
+Only the chosen index is kept up to date, in the same transaction as the
+question or choice change (see polls/signals.py), so run
+rebuild_search_index after switching.
+
+search() joins the index to a Question queryset and annotates each match
+with `rank` (lower is better). Every word of the query must match, and the
+last word also matches as a prefix so results follow the user's typing.
+Page the result with KeysetPaginator on SEARCH_ORDERING.
+"""
+import re
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+
+from .models import Choice, Question, QuestionSearchDocument, SearchTerm
+
+SEARCH_ORDERING = ('rank', '-id')
+WORD = re.compile(r'\w+')
+MAX_WORDS = 8
+BATCH_SIZE = 500
+QUESTION_WEIGHT = 2
+CHOICE_WEIGHT = 1
+
+_fts5_tables = {}
+
+
+def search_words(text):
+    """
+    Split `text` into the case-folded words a search is made of (at most MAX_WORDS).
+    """
+    return [word.casefold() for word in WORD.findall(text)][:MAX_WORDS]
+
+
+def documents(question_ids, using):
+    """
+    Yield (question_id, question_text, choice_text) for the questions that still exist.
+    """
+    for start in range(0, len(question_ids), BATCH_SIZE):
+        batch = question_ids[start:start + BATCH_SIZE]
+        choices = {}
+        for question_id, text in (Choice.objects.using(using).filter(question_id__in=batch)
+                                  .order_by('pk').values_list('question_id', 'choice_text')):
+            choices.setdefault(question_id, []).append(text)
+        for question_id, text in Question.objects.using(using).filter(pk__in=batch).values_list('id', 'question_text'):
+            yield question_id, text, ' '.join(choices.get(question_id, ()))
+
+
+class TokenIndex:
+    """
+    Inverted index in the SearchTerm table.
+
+    A query finds the questions that have a row for every word with one
+    grouped scan of the term index, and ranks them by the summed weight of
+    their matching rows.
+    """
+    name = 'tokens'
+
+    def __init__(self, using):
+        self.using = using
+
+    def update(self, question_ids):
+        """
+        Index the current text of the given questions; deleted questions are dropped.
+        """
+        question_ids = list(question_ids)
+        terms = SearchTerm.objects.using(self.using)
+        for start in range(0, len(question_ids), BATCH_SIZE):
+            terms.filter(question_id__in=question_ids[start:start + BATCH_SIZE]).delete()
+        rows = []
+        for question_id, question_text, choice_text in documents(question_ids, self.using):
+            weights = Counter()
+            for text, weight in ((question_text, QUESTION_WEIGHT), (choice_text, CHOICE_WEIGHT)):
+                for word in WORD.findall(text):
+                    weights[word.casefold()[:100]] += weight
+            rows.extend(SearchTerm(question_id=question_id, term=term, weight=weight)
+                        for term, weight in weights.items())
+        terms.bulk_create(rows, batch_size=BATCH_SIZE)
+
+    def remove(self, question_ids):
+        SearchTerm.objects.using(self.using).filter(question_id__in=list(question_ids)).delete()
+
+    def clear(self):
+        SearchTerm.objects.using(self.using).all().delete()
+
+    def search(self, queryset, words):
+        *whole, prefix = words
+        # A range rather than LIKE, so the term index is used on every database
+        conditions = [Q(term=word) for word in whole]
+        conditions.append(Q(term__gte=prefix, term__lt=prefix + '\U0010ffff'))
+        terms = SearchTerm.objects.using(queryset.db).filter(reduce(or_, conditions)).order_by()
+        # Questions with a term for every word, found from the term index alone
+        matched = {f'word_{i}': Count('pk', filter=condition) for i, condition in enumerate(conditions)}
+        question_ids = (terms.values('question_id').annotate(**matched)
+                        .filter(**{f'{name}__gt': 0 for name in matched}).values('question_id'))
+        weights = (terms.filter(question_id=OuterRef('pk')).values('question_id')
+                   .annotate(weight=Sum('weight')).values('weight'))
+        return queryset.filter(pk__in=question_ids).annotate(rank=-Subquery(weights))
+
+
+class Fts5Index:
+    """
+    SQLite FTS5 index in polls_question_fts, keyed by question id (its rowid).
+    """
+    name = 'fts5'
+    table = QuestionSearchDocument._meta.db_table
+
+    def __init__(self, using):
+        self.using = using
+
+    def update(self, question_ids):
+        question_ids = list(question_ids)
+        connection = connections[self.using]
+        with connection.cursor() as cursor:
+            for start in range(0, len(question_ids), BATCH_SIZE):
+                batch = question_ids[start:start + BATCH_SIZE]
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({", ".join(["%s"] * len(batch))})', batch)
+                cursor.executemany(
+                    f'INSERT INTO {self.table} (rowid, question_text, choice_text) VALUES (%s, %s, %s)',
+                    list(documents(batch, self.using)),
+                )
+
+    def remove(self, question_ids):
+        question_ids = list(question_ids)
+        with connections[self.using].cursor() as cursor:
+            for start in range(0, len(question_ids), BATCH_SIZE):
+                batch = question_ids[start:start + BATCH_SIZE]
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({", ".join(["%s"] * len(batch))})', batch)
+
+    def clear(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def search(self, queryset, words):
+        # Every word is quoted, and \w+ words cannot close the quotes
+        *whole, prefix = words
+        query = ' '.join([*(f'"{word}"' for word in whole), f'"{prefix}"*'])
+        return (queryset.filter(search_document__document__match=query)
+                .annotate(rank=F('search_document__rank')))
+
+
+def has_fts5(using):
+    """
+    Return whether the database `using` has the FTS5 search table.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _fts5_tables:
+        _fts5_tables[key] = Fts5Index.table in connection.introspection.table_names()
+    return _fts5_tables[key]
+
+
+def get_index(using=None):
+    """
+    Return the search index POLLS_SEARCH_BACKEND selects for database `using`.
+
+    Raises:
+        ImproperlyConfigured: If the setting is unknown, or 'fts5' without the FTS5 table.
+    """
+    using = using or router.db_for_write(Question)
+    backend = settings.POLLS_SEARCH_BACKEND
+    if backend == 'auto':
+        backend = Fts5Index.name if has_fts5(using) else TokenIndex.name
+    if backend == TokenIndex.name:
+        return TokenIndex(using)
+    if backend == Fts5Index.name:
+        if not has_fts5(using):
+            raise ImproperlyConfigured("POLLS_SEARCH_BACKEND is 'fts5' but the database has no FTS5 search table.")
+        return Fts5Index(using)
+    raise ImproperlyConfigured(f"Unknown POLLS_SEARCH_BACKEND {backend!r}; use 'auto', 'fts5' or 'tokens'.")
+
+
+def rebuild(index, batch_size=5000):
+    """
+    Empty `index` and index every question again.
+
+    Returns:
+        int: The number of questions indexed.
+    """
+    index.clear()
+    ids = Question.objects.using(index.using).order_by('pk').values_list('pk', flat=True)
+    indexed = 0
+    batch = []
+    for question_id in ids.iterator(batch_size):
+        batch.append(question_id)
+        if len(batch) == batch_size:
+            index.update(batch)
+            indexed, batch = indexed + len(batch), []
+    index.update(batch)
+    return indexed + len(batch)
+
+
+def search(queryset, words):
+    """
+    Return the questions of `queryset` that match every one of `words`, annotated with `rank`.
+
+    Args:
+        queryset (QuerySet): Questions to search, e.g. the published ones.
+        words (list): Non-empty list of words from search_words().
+    """
+    return get_index(queryset.db).search(queryset, words)
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_results_version, forget_final_results, invalidate_index
+from .models import Choice, ChoiceCounterShard, Question, ResultSnapshot
+from .search import get_index
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def invalidate_choice_results(sender, instance, raw=False, **kwargs):
+    """
+    Invalidate the cached results of a question when one of its choices changes.
+    """
+    if not raw:
+        question_id = instance.question_id
+        transaction.on_commit(lambda: bump_results_version(question_id))
+
+
+@receiver([post_save, post_delete], sender=Question)
+def invalidate_question_index(sender, instance, **kwargs):
+    """
+    Invalidate the cached poll index when a question is added, edited or deleted.
+    """
+    transaction.on_commit(invalidate_index)
+
+
+def thaw_results(question_id, using):
+    """
+    Drop the frozen results of a question whose choices or dates were edited.
+
+    If the question is still closed, its snapshot is made again on the next read.
+    """
+    ResultSnapshot.objects.using(using).filter(question_id=question_id).delete()
+    transaction.on_commit(lambda: forget_final_results(question_id), using=using)
+
+
+@receiver(post_save, sender=Question)
+def thaw_question_results(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if not (created or raw):
+        thaw_results(instance.pk, using)
+
+
+@receiver(post_save, sender=Question)
+def fold_counter_shards(sender, instance, raw=False, using=None, **kwargs):
+    """
+    Fold the counter shards of a question whose sharding was turned off into vote_count.
+    """
+    if not (raw or instance.counter_shards):
+        ChoiceCounterShard.objects.db_manager(using).fold(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def thaw_choice_results(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        thaw_results(instance.question_id, using)
+
+
+@receiver(post_save, sender=Question)
+@receiver([post_save, post_delete], sender=Choice)
+def index_question(sender, instance, using=None, **kwargs):
+    """
+    Update the search document of a question whose text or choices changed.
+    """
+    question_id = instance.pk if sender is Question else instance.question_id
+    get_index(using).update([question_id])
+
+
+@receiver(post_delete, sender=Question)
+def unindex_question(sender, instance, using=None, **kwargs):
+    get_index(using).remove([instance.pk])
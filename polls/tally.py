@@ -0,0 +1,210 @@
+"""
+Tallies of approval and ranked-choice ballots.
+
+A Ballot stores its choice ids packed as unsigned 64-bit integers (pack()
+and unpack()). BallotBox reads a question's ballots in chunks and counts
+identical ballots as they arrive, so a million ballots over a handful of
+choices become a few hundred distinct rankings. Each ranking is kept as an
+array of choice positions, with the number of ballots that cast it in an
+unsigned integer array.
+
+runoff() runs the instant-runoff rounds over those groups. It keeps a
+running count per choice. When a choice is eliminated, only the groups
+whose current preference it was move to their next continuing choice, so a
+whole runoff costs about one pass over the distinct rankings however many
+rounds it takes.
+
+numpy is not a dependency of this project, so the arrays come from the
+standard library's array module. Grouping identical ballots removes the
+repeated per-ballot passes that vectorizing would otherwise speed up.
+"""
+import sys
+from array import array
+from collections import Counter
+
+from django.db import router
+
+from .models import Ballot, Choice, Question
+
+TYPECODE = 'Q'
+CHUNK_SIZE = 10000
+
+
+def pack(choice_ids):
+    """
+    Returns:
+        bytes: `choice_ids` as little-endian unsigned 64-bit integers.
+    """
+    packed = array(TYPECODE, choice_ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(data):
+    """
+    Returns:
+        list: The choice ids packed into `data` by pack().
+    """
+    choice_ids = array(TYPECODE)
+    choice_ids.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        choice_ids.byteswap()
+    return choice_ids.tolist()
+
+
+def _zeros(typecode, length):
+    return array(typecode, bytes(array(typecode).itemsize * length))
+
+
+class BallotBox:
+    """
+    The ballots of one question, grouped into distinct rankings.
+
+    Choice ids a ballot names but the question no longer has are skipped.
+
+    Attributes:
+        choices (list): (id, choice_text) of the question's choices, by id.
+        rankings (list): One array of positions in `choices` per distinct
+            ballot, most preferred first.
+        weights (array): The number of ballots with each ranking.
+    """
+
+    def __init__(self, choices, packed_ballots):
+        self.choices = list(choices)
+        position = {choice_id: i for i, (choice_id, _) in enumerate(self.choices)}
+        groups = Counter()
+        for data, count in Counter(bytes(data) for data in packed_ballots).items():
+            ranking = []
+            for choice_id in unpack(data):
+                i = position.get(choice_id)
+                if i is not None and i not in ranking:
+                    ranking.append(i)
+            if ranking:
+                groups[tuple(ranking)] += count
+        self.rankings = [array('H', ranking) for ranking in groups]
+        self.weights = array('Q', groups.values())
+
+    @classmethod
+    def load(cls, question_id, using=None, choices=None):
+        """
+        Read the ballots of a question from the database, CHUNK_SIZE rows at a time.
+
+        Args:
+            choices (list): (id, choice_text) of the question's choices by id,
+                if the caller already has them.
+        """
+        using = using or router.db_for_write(Ballot)
+        if choices is None:
+            choices = (Choice.objects.using(using).filter(question_id=question_id).order_by('pk')
+                       .values_list('id', 'choice_text'))
+        ballots = Ballot.objects.using(using).filter(question_id=question_id).values_list('choices', flat=True)
+        return cls(choices, ballots.iterator(CHUNK_SIZE))
+
+    def __len__(self):
+        return sum(self.weights)
+
+    def approvals(self):
+        """
+        Returns:
+            array: How many ballots include each choice.
+        """
+        counts = _zeros('Q', len(self.choices))
+        for ranking, weight in zip(self.rankings, self.weights):
+            for i in ranking:
+                counts[i] += weight
+        return counts
+
+    def first_preferences(self):
+        """
+        Returns:
+            array: How many ballots rank each choice first.
+        """
+        counts = _zeros('Q', len(self.choices))
+        for ranking, weight in zip(self.rankings, self.weights):
+            counts[ranking[0]] += weight
+        return counts
+
+    def counts(self, poll_type):
+        """
+        Return the tallies of an approval poll, or the first preferences of a ranked one.
+
+        Returns:
+            list: One dict per choice with 'id', 'choice_text' and 'vote_count',
+            in the same form as get_results().
+        """
+        counts = self.approvals() if poll_type == Question.APPROVAL else self.first_preferences()
+        return [{'id': choice_id, 'choice_text': text, 'vote_count': counts[i]}
+                for i, (choice_id, text) in enumerate(self.choices)]
+
+    def runoff(self):
+        """
+        Decide the question by instant runoff.
+
+        Each round counts every ballot for its most preferred continuing
+        choice. A choice with more than half of the ballots that still count
+        wins. Otherwise the choice with the fewest votes is eliminated; on a
+        tie, the one with fewer votes in the latest earlier round where they
+        differ, and failing that the choice added last. Ballots with no
+        continuing choice left are exhausted.
+
+        Returns:
+            dict: 'ballots' (int), 'rounds' (list of dicts with 'round',
+            'counts', 'exhausted' and 'eliminated') and 'winner' (a dict with
+            'id' and 'choice_text', or None if no ballot counts).
+        """
+        total = len(self)
+        count = len(self.choices)
+        continuing = bytearray(b'\x01') * count
+        place = _zeros('H', len(self.rankings))
+        votes = _zeros('Q', count)
+        holders = [[] for _ in range(count)]
+        for group, ranking in enumerate(self.rankings):
+            holders[ranking[0]].append(group)
+            votes[ranking[0]] += self.weights[group]
+
+        exhausted = 0
+        history = []
+        rounds = []
+        winner = None
+        while total - exhausted > 0:
+            history.append(array('Q', votes))
+            remaining = [i for i in range(count) if continuing[i]]
+            leader = max(remaining, key=lambda i: (votes[i], -i))
+            eliminated = None
+            if votes[leader] * 2 > total - exhausted or len(remaining) == 1:
+                winner = leader
+            else:
+                eliminated = min(remaining, key=lambda i: (*(past[i] for past in reversed(history)), -i))
+            rounds.append({
+                'round': len(rounds) + 1,
+                'counts': [{'id': self.choices[i][0], 'choice_text': self.choices[i][1], 'votes': votes[i]}
+                           for i in remaining],
+                'exhausted': exhausted,
+                'eliminated': self._choice(eliminated),
+            })
+            if winner is not None:
+                break
+
+            continuing[eliminated] = 0
+            for group in holders[eliminated]:
+                ranking = self.rankings[group]
+                next_place = place[group] + 1
+                while next_place < len(ranking) and not continuing[ranking[next_place]]:
+                    next_place += 1
+                if next_place < len(ranking):
+                    place[group] = next_place
+                    holders[ranking[next_place]].append(group)
+                    votes[ranking[next_place]] += self.weights[group]
+                else:
+                    exhausted += self.weights[group]
+            holders[eliminated] = []
+            votes[eliminated] = 0
+
+        return {'ballots': total, 'rounds': rounds, 'winner': self._choice(winner)}
+
+    def _choice(self, i):
+        if i is None:
+            return None
+        choice_id, text = self.choices[i]
+        return {'id': choice_id, 'choice_text': text}
@@ -1,9 +1,39 @@
+import asyncio
+import base64
 import datetime
+import json
+import os
+import random
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.conf import settings
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
+from django.http import HttpResponse
 from django.urls import reverse
-from .models import Question
+from .benchmark import run_benchmark, run_tally_benchmark, run_vote_concurrency, seed
+from .cache import (bump_results_version, get_results, get_runoff, index_cache_timeout, results_cache_stats,
+                    results_version)
+from .live import LiveResultsApp
+from .middleware import PrimaryPinningMiddleware
+from .models import Ballot, Choice, ChoiceCounterShard, Question, ResultSnapshot, Vote, VoteEvent, VoteRollup
+from .rollups import roll_up, rollup_position
+from .routers import PrimaryReplicaRouter, primary_pinned, use_primary
+from .search import get_index
+from .tally import BallotBox, pack
+from .vote_queue import VoteQueue
 
 
 def create_question(question_text, days):
@@ -17,6 +47,9 @@ def create_question(question_text, days):
 
 
 class QuestionIndexViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_no_questions(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -121,4 +154,1729 @@ class QuestionIndexViewTests(TestCase):
         """
         current_date = timezone.now()
         question = Question(pub_date=timezone.now(), end_date=current_date)
-        self.assertFalse(question.can_vote())
\ No newline at end of file
+        self.assertFalse(question.can_vote())
+
+
+def create_choices(question, *choice_texts):
+    """
+    Create one choice for `question` per entry in `choice_texts`.
+    """
+    return [question.choice_set.create(choice_text=text) for text in choice_texts]
+
+
+class VoteCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='pass1234')
+        self.client.force_login(self.user)
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.red, self.blue = create_choices(self.question, 'Red', 'Blue')
+
+    def vote(self, choice):
+        url = reverse('polls:vote', args=(self.question.id,))
+        return self.client.post(url, {'choice': choice.id})
+
+    def test_vote_increments_vote_count(self):
+        """
+        Voting increments the selected choice's vote_count.
+        """
+        self.vote(self.red)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.vote_count, 1)
+
+    def test_changing_vote_moves_the_count(self):
+        """
+        Changing a vote decrements the old choice and increments the new one.
+        """
+        self.vote(self.red)
+        self.vote(self.blue)
+        self.red.refresh_from_db()
+        self.blue.refresh_from_db()
+        self.assertEqual((self.red.vote_count, self.blue.vote_count), (0, 1))
+
+    def test_results_show_vote_count(self):
+        """
+        The results page renders the tallies from vote_count.
+        """
+        self.vote(self.blue)
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Blue : 1')
+        self.assertContains(response, 'Red : 0')
+
+    def test_rebuild_vote_counts(self):
+        """
+        rebuild_vote_counts repairs drifted counters and --check detects drift.
+        """
+        self.vote(self.red)
+        Choice.objects.filter(pk=self.red.pk).update(vote_count=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_vote_counts', check=True, stdout=StringIO())
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.vote_count, 1)
+
+    def test_rebuild_vote_counts_invalidates_cached_results(self):
+        """
+        The results cached before a rebuild are not served after it commits.
+        """
+        self.vote(self.red)
+        Choice.objects.filter(pk=self.red.pk).update(vote_count=5)
+        self.assertContains(self.client.get(reverse('polls:results', args=(self.question.id,))), 'Red : 5')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_vote_counts', stdout=StringIO())
+        self.assertContains(self.client.get(reverse('polls:results', args=(self.question.id,))), 'Red : 1')
+
+
+class ShardedCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.red, self.blue = create_choices(self.question, 'Red', 'Blue')
+        self.users = [User.objects.create_user(username=f'voter{i}', password='pass1234') for i in range(3)]
+
+    def shard(self):
+        Question.objects.filter(pk=self.question.pk).update(counter_shards=4)
+        self.question.refresh_from_db()
+
+    def totals(self):
+        return dict(Choice.objects.with_totals().values_list('choice_text', 'total_votes'))
+
+    def test_sharded_votes_go_to_the_voters_shard(self):
+        """
+        On a sharded question a vote and a switch update the voter's shard, not vote_count.
+        """
+        self.shard()
+        user = self.users[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(user, self.question, self.red)
+            Vote.objects.cast(user, self.question, self.blue)
+        self.assertEqual(set(ChoiceCounterShard.objects.values_list('choice_id', 'shard', 'count')),
+                         {(self.red.id, user.id % 4, 0), (self.blue.id, user.id % 4, 1)})
+        self.assertEqual(set(Choice.objects.values_list('vote_count', flat=True)), {0})
+        self.assertEqual(self.totals(), {'Red': 0, 'Blue': 1})
+        self.assertEqual([choice['vote_count'] for choice in get_results(self.question)], [0, 1])
+
+    def test_sharding_a_poll_with_votes_keeps_the_totals(self):
+        """
+        Votes counted in vote_count before sharding was switched on can still move.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in self.users:
+                Vote.objects.cast(user, self.question, self.red)
+        self.shard()
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.users[0], self.question, self.blue)
+            Vote.objects.withdraw(Vote.objects.filter(user=self.users[1]))
+        self.assertEqual(self.totals(), {'Red': 1, 'Blue': 1})
+
+    def test_unsharding_a_poll_with_votes_keeps_the_totals(self):
+        """
+        Turning sharding off folds the shards into vote_count, so votes can still move.
+        """
+        self.shard()
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in self.users:
+                Vote.objects.cast(user, self.question, self.red)
+        self.question.counter_shards = 0
+        self.question.save()
+        self.assertFalse(ChoiceCounterShard.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.users[0], self.question, self.blue)
+            Vote.objects.withdraw(Vote.objects.filter(user=self.users[1]))
+        self.assertEqual(self.totals(), {'Red': 1, 'Blue': 1})
+
+    def test_decrement_left_in_shards(self):
+        """
+        Votes still counted in a shard after sharding is off are taken off shard 0.
+        """
+        self.shard()
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.users[0], self.question, self.red)
+            Vote.objects.cast(self.users[1], self.question, self.red)
+        Question.objects.filter(pk=self.question.pk).update(counter_shards=0)
+        self.question.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.users[0], self.question, self.blue)
+            Vote.objects.withdraw(Vote.objects.filter(user=self.users[1]))
+        self.assertEqual(self.totals(), {'Red': 0, 'Blue': 1})
+
+    def test_rebuild_folds_the_shards(self):
+        """
+        rebuild_vote_counts compares the totals and folds drifted shards into vote_count.
+        """
+        self.shard()
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.users[0], self.question, self.red)
+        call_command('rebuild_vote_counts', check=True, stdout=StringIO())
+        ChoiceCounterShard.objects.filter(choice=self.red).update(count=3)
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.assertFalse(ChoiceCounterShard.objects.filter(choice=self.red).exists())
+        self.assertEqual(self.totals(), {'Red': 1, 'Blue': 0})
+
+
+class VoteModelTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='pass1234')
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.red, self.blue = create_choices(self.question, 'Red', 'Blue')
+
+    def test_cast_returns_previous_choice(self):
+        """
+        cast() returns None for a first vote and the old choice id when switching.
+        """
+        self.assertIsNone(Vote.objects.cast(self.user, self.question, self.red))
+        self.assertEqual(Vote.objects.cast(self.user, self.question, self.blue), self.red.id)
+        vote = Vote.objects.get(user=self.user, question=self.question)
+        self.assertEqual(vote.choice, self.blue)
+
+    def test_cast_same_choice_is_a_no_op(self):
+        """
+        Voting again for the same choice leaves the vote and the counter unchanged.
+        """
+        Vote.objects.cast(self.user, self.question, self.red)
+        Vote.objects.cast(self.user, self.question, self.red)
+        self.red.refresh_from_db()
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(self.red.vote_count, 1)
+
+    def test_switch_is_one_upsert(self):
+        """
+        Switching a vote reads the old choice once and writes the vote with one statement.
+        """
+        Vote.objects.cast(self.user, self.question, self.red)
+        # previous-choice lookup, upsert, two counter updates, event (plus the savepoint pair)
+        with self.assertNumQueries(7):
+            Vote.objects.cast(self.user, self.question, self.blue)
+
+    def test_one_vote_per_user_and_question(self):
+        """
+        The database rejects a second Vote row for the same user and question.
+        """
+        Vote.objects.create(user=self.user, question=self.question, choice=self.red)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, question=self.question, choice=self.blue)
+
+    def test_detail_preselects_previous_choice(self):
+        """
+        The detail page reads the previous choice with a single query.
+        """
+        Vote.objects.cast(self.user, self.question, self.blue)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.context['previous_choice'], self.blue)
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='pass1234')
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.red, self.blue = create_choices(self.question, 'Red', 'Blue')
+
+    def test_results_are_served_from_the_cache(self):
+        """
+        A second read of the results is a cache hit and does not query the choices.
+        """
+        get_results(self.question)
+        with self.assertNumQueries(0):
+            results = get_results(self.question)
+        self.assertEqual([r['choice_text'] for r in results], ['Red', 'Blue'])
+        self.assertEqual(results_cache_stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_stats_command_needs_a_shared_cache(self):
+        """
+        results_cache_stats refuses a per-process cache and reads a shared one.
+        """
+        with self.assertRaisesMessage(CommandError, 'private to each process'):
+            call_command('results_cache_stats', stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+            get_results(self.question)
+            get_results(self.question)
+            stdout = StringIO()
+            call_command('results_cache_stats', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'hits=1 misses=1 hit_ratio=50.0%')
+
+    def test_vote_bumps_the_version(self):
+        """
+        A committed vote moves the question to a new results version.
+        """
+        get_results(self.question)
+        version = results_version(self.question.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.question, self.red)
+        self.assertNotEqual(results_version(self.question.id), version)
+        self.assertEqual(get_results(self.question)[0]['vote_count'], 1)
+
+    def test_results_page_shows_own_vote(self):
+        """
+        After voting, the results page shows the new totals even if they were cached.
+        """
+        results_url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(results_url)
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.blue.id})
+        response = self.client.get(results_url)
+        self.assertContains(response, 'Blue : 1')
+
+
+@override_settings(POLLS_INDEX_PAGE_SIZE=2)
+class IndexPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.questions = [create_question(question_text=f"Question {i}.", days=-i) for i in range(1, 6)]
+
+    def test_pages_follow_the_cursor(self):
+        """
+        Following next_cursor walks every published question exactly once, newest first.
+        """
+        seen = []
+        url = reverse('polls:index')
+        while url:
+            response = self.client.get(url)
+            page = response.context['page_obj']
+            seen.extend(response.context['latest_question_list'])
+            url = reverse('polls:index') + f"?cursor={page.next_cursor}" if page.has_next else None
+        self.assertEqual(seen, self.questions)
+
+    def test_same_pub_date_is_ordered_by_id(self):
+        """
+        Questions sharing a pub_date are not skipped or repeated across pages.
+        """
+        Question.objects.update(pub_date=timezone.now() - datetime.timedelta(days=1))
+        first = self.client.get(reverse('polls:index'))
+        cursor = first.context['page_obj'].next_cursor
+        second = self.client.get(reverse('polls:index'), {'cursor': cursor})
+        pages = [first.context['latest_question_list'], second.context['latest_question_list']]
+        ids = [q.id for page in pages for q in page]
+        self.assertEqual(ids, sorted((q.id for q in self.questions), reverse=True)[:4])
+
+    def test_deep_page_costs_one_query(self):
+        """
+        Loading a later page runs a single query for the questions.
+        """
+        response = self.client.get(reverse('polls:index'))
+        cursor = response.context['page_obj'].next_cursor
+        with self.assertNumQueries(1):
+            self.client.get(reverse('polls:index'), {'cursor': cursor})
+
+    def test_invalid_cursor(self):
+        """
+        A malformed cursor returns a 404.
+        """
+        response = self.client.get(reverse('polls:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+        for values in ([[1], 2], [{'a': 1}, 2], [1.5, 2], ['2024-01-01T00:00:00', [2]]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            with self.subTest(values=values):
+                self.assertEqual(self.client.get(reverse('polls:index'), {'cursor': cursor}).status_code, 404)
+                response = self.client.get(reverse('polls:api-questions'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+class QuestionQuerySetTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        day = datetime.timedelta(days=1)
+        self.upcoming = Question.objects.create(question_text='Upcoming', pub_date=now + day)
+        self.open = Question.objects.create(question_text='Open', pub_date=now - day, end_date=now + day)
+        self.open_ended = Question.objects.create(question_text='Open ended', pub_date=now - day)
+        self.closed = Question.objects.create(question_text='Closed', pub_date=now - 2 * day, end_date=now - day)
+
+    def test_state_filters(self):
+        """
+        published(), open(), closed() and upcoming() select the matching questions.
+        """
+        self.assertCountEqual(Question.objects.published(), [self.open, self.open_ended, self.closed])
+        self.assertCountEqual(Question.objects.open(), [self.open, self.open_ended])
+        self.assertCountEqual(Question.objects.closed(), [self.closed])
+        self.assertCountEqual(Question.objects.upcoming(), [self.upcoming])
+
+    def test_annotate_state_matches_can_vote(self):
+        """
+        The state computed in SQL agrees with the Python methods.
+        """
+        for question in Question.objects.annotate_state():
+            self.assertEqual(question.state == Question.OPEN, question.can_vote())
+            self.assertEqual(question.state == Question.UPCOMING, not question.is_published())
+
+    def test_index_uses_annotated_state(self):
+        """
+        The index page shows the results link only for open polls.
+        """
+        cache.clear()
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, reverse('polls:results', args=(self.open.id,)))
+        self.assertNotContains(response, reverse('polls:results', args=(self.closed.id,)))
+
+
+class SearchTests(TestCase):
+    """
+    Search from the index page, with the default index (FTS5 where SQLite has it).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.colour = create_question(question_text='Favourite colour?', days=-2)
+        create_choices(self.colour, 'Red', 'Blue')
+        self.coffee = create_question(question_text='Best coffee?', days=-1)
+        create_choices(self.coffee, 'Espresso', 'Latte')
+
+    def search(self, query, **params):
+        return self.client.get(reverse('polls:index'), {'q': query, **params})
+
+    def found(self, query):
+        return list(self.search(query).context['latest_question_list'])
+
+    def test_matches_question_and_choice_text(self):
+        """
+        Every word must match the question or one of its choices; the last word may be a prefix.
+        """
+        self.assertEqual(self.found('espresso'), [self.coffee])
+        self.assertEqual(self.found('Favourite RED'), [self.colour])
+        self.assertEqual(self.found('fav'), [self.colour])
+        self.assertEqual(self.found('coffee red'), [])
+        self.assertContains(self.search('tea'), 'No polls match')
+
+    def test_question_text_ranks_first(self):
+        """
+        A match in the question text ranks above a match in a choice.
+        """
+        tea = create_question(question_text='Tea or coffee?', days=-3)
+        create_choices(tea, 'Tea', 'Coffee')
+        self.assertEqual(self.found('coffee'), [tea, self.coffee])
+
+    def test_index_follows_edits(self):
+        """
+        Saving or deleting a question or choice updates the index straight away.
+        """
+        self.coffee.question_text = 'Best tea?'
+        self.coffee.save()
+        self.assertEqual(self.found('tea'), [self.coffee])
+        self.assertEqual(self.found('coffee'), [])
+        Choice.objects.get(choice_text='Red').delete()
+        Choice.objects.create(question=self.colour, choice_text='Green')
+        self.assertEqual(self.found('green'), [self.colour])
+        self.assertEqual(self.found('red'), [])
+        self.colour.delete()
+        self.assertEqual(self.found('green'), [])
+
+    def test_unpublished_questions_are_not_found(self):
+        create_question(question_text='Future coffee?', days=5)
+        self.assertEqual(self.found('coffee'), [self.coffee])
+
+    @override_settings(POLLS_INDEX_PAGE_SIZE=2)
+    def test_keyset_paging(self):
+        """
+        Following the cursors visits every match once, in rank order.
+        """
+        for i in range(3):
+            create_choices(create_question(question_text=f'Coffee poll {i}?', days=-i - 3), 'Espresso')
+        seen = []
+        cursor = ''
+        while True:
+            response = self.search('espresso', cursor=cursor)
+            seen.extend(response.context['latest_question_list'])
+            cursor = response.context['page_obj'].next_cursor
+            if cursor is None:
+                break
+            self.assertContains(response, 'q=espresso&amp;cursor=')
+        with self.settings(POLLS_INDEX_PAGE_SIZE=10):
+            self.assertEqual(seen, self.found('espresso'))
+        self.assertEqual(len(set(seen)), 4)
+
+    def test_rebuild_search_index(self):
+        get_index().clear()
+        self.assertEqual(self.found('coffee'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.found('coffee'), [self.coffee])
+
+
+@override_settings(POLLS_SEARCH_BACKEND='tokens')
+class TokenSearchTests(SearchTests):
+    """
+    The same searches with the word-table index used on databases without FTS5.
+    """
+
+
+class IndexCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_index_skips_the_database(self):
+        """
+        A repeated index request is served from the cached fragment without queries.
+        """
+        create_question(question_text='Past question.', days=-1)
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, 'Past question.')
+
+    def test_saving_a_question_invalidates_the_index(self):
+        """
+        Saving or deleting a question is visible on the next index request.
+        """
+        question = create_question(question_text='Past question.', days=-1)
+        self.client.get(reverse('polls:index'))
+        question.question_text = 'Edited question.'
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        self.assertContains(self.client.get(reverse('polls:index')), 'Edited question.')
+        with self.captureOnCommitCallbacks(execute=True):
+            question.delete()
+        self.assertContains(self.client.get(reverse('polls:index')), 'No polls are available.')
+
+    def test_voted_polls_marked(self):
+        """
+        The index marks the polls the user voted in, loading them with one query
+        that is cached until the user votes on another poll.
+        """
+        voted = create_question(question_text='Voted question.', days=-2)
+        other = create_question(question_text='Other question.', days=-1)
+        user = User.objects.create_user(username='voter', password='pass1234')
+        Vote.objects.cast(user, voted, create_choices(voted, 'Yes')[0])
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, 'You have voted in this poll.', count=1)
+        self.assertNotContains(response, '<!--voted:')
+        # Session and user; the list and the voted set come from the cache
+        with self.assertNumQueries(2):
+            self.client.get(reverse('polls:index'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(user, other, create_choices(other, 'No')[0])
+        self.assertContains(self.client.get(reverse('polls:index')), 'You have voted in this poll.', count=2)
+
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('polls:index')), 'You have voted in this poll.')
+
+    def test_users_share_the_cached_list(self):
+        """
+        The cached list has no user in its key: another user's request reuses
+        it and only loads that user's voted polls.
+        """
+        question = create_question(question_text='Past question.', days=-1)
+        voter = User.objects.create_user(username='voter', password='pass1234')
+        Vote.objects.cast(voter, question, create_choices(question, 'Yes')[0])
+        self.client.get(reverse('polls:index'))
+
+        self.client.force_login(voter)
+        # Session, user and the voted set; no questions
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, 'You have voted in this poll.', count=1)
+
+        self.client.force_login(User.objects.create_user(username='other', password='pass1234'))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, 'Past question.')
+        self.assertNotContains(response, 'You have voted in this poll.')
+
+    def test_timeout_ends_at_next_state_change(self):
+        """
+        The index cache timeout runs until just after the next pub_date or end_date.
+        """
+        now = timezone.now()
+        Question.objects.create(question_text='Closing', pub_date=now - datetime.timedelta(days=1),
+                                end_date=now + datetime.timedelta(seconds=90))
+        Question.objects.create(question_text='Opening', pub_date=now + datetime.timedelta(seconds=300))
+        self.assertEqual(index_cache_timeout(now), 91)
+
+    def test_no_timeout_without_upcoming_changes(self):
+        """
+        With no future pub_date or end_date the cached index never expires on its own.
+        """
+        create_question(question_text='Past question.', days=-1)
+        self.assertIsNone(index_cache_timeout())
+
+
+class VoteQueueCoalesceTests(TestCase):
+    def test_coalesce_keeps_last_vote(self):
+        """
+        Only the last vote of each (user, question) in a batch survives.
+        """
+        votes = [(1, 1, 10), (2, 1, 11), (1, 1, 12), (1, 2, 20)]
+        self.assertEqual(VoteQueue.coalesce(votes), [(2, 1, 11), (1, 1, 12), (1, 2, 20)])
+
+
+@override_settings(POLLS_VOTE_MODE='queued')
+class VoteQueueTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        # The in-memory test database cannot be written from two threads at
+        # once, so the batch is only written when stop() flushes the queue.
+        self.queue = VoteQueue(batch_size=100, max_delay=60)
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.red, self.blue = create_choices(self.question, 'Red', 'Blue')
+        self.users = [User.objects.create_user(username=f'voter{i}', password='pass1234') for i in range(5)]
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def test_worker_applies_queued_votes(self):
+        """
+        Votes queued from the view are written by the in-process worker.
+        """
+        for user in self.users:
+            self.client.force_login(user)
+            with mock.patch('polls.views.get_vote_queue', return_value=self.queue):
+                response = self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                            {'choice': self.red.id})
+            self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        self.queue.stop()
+        self.red.refresh_from_db()
+        self.assertEqual(Vote.objects.filter(choice=self.red).count(), 5)
+        self.assertEqual(self.red.vote_count, 5)
+
+    def test_batch_keeps_last_vote_per_user(self):
+        """
+        A user who switches while the vote is queued ends with one vote, for the last choice.
+        """
+        user = self.users[0]
+        self.queue.put(user.id, self.question.id, self.red.id)
+        self.queue.put(user.id, self.question.id, self.blue.id)
+        self.queue.stop()
+        self.assertEqual(Vote.objects.get(user=user).choice, self.blue)
+        self.red.refresh_from_db()
+        self.blue.refresh_from_db()
+        self.assertEqual((self.red.vote_count, self.blue.vote_count), (0, 1))
+
+    def test_deleted_choice_does_not_drop_the_batch(self):
+        """
+        A vote for a choice deleted while it was queued is dropped; the rest of the batch is written.
+        """
+        doomed = self.question.choice_set.create(choice_text='Green')
+        self.queue.put(self.users[0].id, self.question.id, self.red.id)
+        self.queue.put(self.users[1].id, self.question.id, doomed.id)
+        self.queue.put(self.users[2].id, self.question.id, self.blue.id)
+        doomed.delete()
+        with self.assertLogs('polls.vote_queue', 'WARNING'):
+            self.queue.stop()
+        self.assertEqual(set(Vote.objects.values_list('user_id', 'choice_id')),
+                         {(self.users[0].id, self.red.id), (self.users[2].id, self.blue.id)})
+
+    def test_sharded_question_votes_go_to_shards(self):
+        Question.objects.filter(pk=self.question.pk).update(counter_shards=4)
+        for user in self.users:
+            self.queue.put(user.id, self.question.id, self.red.id)
+        self.queue.stop()
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.vote_count, 0)
+        self.assertEqual(sum(ChoiceCounterShard.objects.filter(choice=self.red).values_list('count', flat=True)), 5)
+
+
+@override_settings(POLLS_DATABASE_REPLICAS=['replica1', 'replica2'])
+class PrimaryReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_a_replica(self):
+        """
+        Reads of polls models are sent to one of the replicas.
+        """
+        self.assertIn(self.router.db_for_read(Question), ['replica1', 'replica2'])
+
+    def test_writes_and_pinned_reads_go_to_the_primary(self):
+        """
+        Writes, and reads inside use_primary(), use the default database.
+        """
+        self.assertEqual(self.router.db_for_write(Vote), 'default')
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Question), 'default')
+
+    def test_other_apps_are_not_routed(self):
+        """
+        Sessions and users stay on the default database.
+        """
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_middleware_pins_after_a_write(self):
+        """
+        A POST is pinned to the primary and leaves a cookie that pins later reads.
+        """
+        factory = RequestFactory()
+        seen = []
+
+        def view(request):
+            seen.append(primary_pinned())
+            return HttpResponse()
+
+        middleware = PrimaryPinningMiddleware(view)
+        response = middleware(factory.post('/polls/1/vote/'))
+        cookie = response.cookies[PrimaryPinningMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], settings.POLLS_REPLICA_STICKY_SECONDS)
+        middleware(factory.get('/polls/1/results/'))
+        factory.cookies[PrimaryPinningMiddleware.cookie_name] = '1'
+        middleware(factory.get('/polls/1/results/'))
+        self.assertEqual(seen, [True, False, True])
+
+
+@override_settings(POLLS_DATABASE_REPLICAS=['test_replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Reads go to 'test_replica', a mirror of the test database (see
+    settings.TESTING), so rows are committed where the replica can see them.
+    """
+    databases = {'default', 'test_replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='pass1234')
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.red, = create_choices(self.question, 'Red')
+
+    def test_voter_reads_own_vote(self):
+        """
+        After voting, the results page is read from the primary and shows the vote.
+        """
+        self.client.force_login(self.user)
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.red.id})
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Red : 1')
+        self.assertEqual(response.context['question']._state.db, 'default')
+
+    def test_anonymous_reads_use_a_replica(self):
+        """
+        Read-only poll views load their objects from a replica.
+        """
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertIn(response.context['question']._state.db, settings.POLLS_DATABASE_REPLICAS)
+
+
+@skipUnless(settings.SQLITE_HIGH_CONCURRENCY, "Set SQLITE_HIGH_CONCURRENCY=True to run the SQLite stress test.")
+class SQLiteConcurrencyTests(TransactionTestCase):
+    threads = 8
+    votes_per_thread = 25
+
+    def setUp(self):
+        self.question = create_question(question_text='Favourite colour?', days=-1)
+        self.choices = create_choices(self.question, 'Red', 'Green', 'Blue')
+        self.users = [User.objects.create_user(username=f'voter{i}', password='pass1234')
+                      for i in range(self.threads)]
+
+    def test_pragmas_are_applied(self):
+        """
+        New connections use WAL journaling and IMMEDIATE transactions.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_concurrent_votes_are_not_lost(self):
+        """
+        Votes cast from many threads at once all land and the counters stay exact.
+        """
+        errors = []
+        last_choice = {}
+
+        def vote(user):
+            try:
+                for _ in range(self.votes_per_thread):
+                    choice = random.choice(self.choices)
+                    Vote.objects.cast(user, self.question, choice)
+                    last_choice[user.id] = choice.id
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=vote, args=(user,)) for user in self.users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(dict(Vote.objects.values_list('user_id', 'choice_id')), last_choice)
+        for choice in self.choices:
+            choice.refresh_from_db()
+            self.assertEqual(choice.vote_count, Vote.objects.filter(choice=choice).count())
+
+    def test_concurrent_sharded_votes_are_not_lost(self):
+        """
+        Sharded counters stay exact under concurrent votes.
+        """
+        report = run_vote_concurrency(self.question.id, [user.id for user in self.users],
+                                      threads=self.threads, votes_per_thread=self.votes_per_thread, shards=4)
+        self.assertEqual(report['errors'], 0)
+        totals = dict(Choice.objects.with_totals().values_list('id', 'total_votes'))
+        for choice in self.choices:
+            self.assertEqual(totals[choice.id], Vote.objects.filter(choice=choice).count())
+
+
+class QueryCountTests(TestCase):
+    """
+    Query counts of the poll views must not grow with the number of choices.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='pass1234')
+
+    def make_question(self, num_choices):
+        question = create_question(question_text=f'{num_choices} choices?', days=-1)
+        choices = create_choices(question, *(f'Choice {i}' for i in range(num_choices)))
+        return question, choices
+
+    def test_detail_queries(self):
+        """
+        The detail page loads the question and its choices with two queries.
+        """
+        for num_choices in (2, 20):
+            question, _ = self.make_question(num_choices)
+            with self.assertNumQueries(2):
+                self.client.get(reverse('polls:detail', args=(question.id,)))
+
+    def test_results_queries(self):
+        """
+        The results page needs two queries on a cache miss and one on a hit.
+        """
+        for num_choices in (2, 20):
+            question, _ = self.make_question(num_choices)
+            url = reverse('polls:results', args=(question.id,))
+            with self.assertNumQueries(2):
+                self.client.get(url)
+            with self.assertNumQueries(1):
+                self.client.get(url)
+
+    def test_vote_queries(self):
+        """
+        Switching a vote costs the same number of queries whatever the number of choices.
+        """
+        self.client.force_login(self.user)
+        for num_choices in (2, 20):
+            question, choices = self.make_question(num_choices)
+            url = reverse('polls:vote', args=(question.id,))
+            self.client.post(url, {'choice': choices[0].id})
+            # session, user, question, choices; cast(): savepoint, previous
+            # choice, upsert, two counters, event, release; session write (3)
+            with self.assertNumQueries(14):
+                self.client.post(url, {'choice': choices[-1].id})
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                       MESSAGE_STORAGE='django.contrib.messages.storage.cookie.CookieStorage')
+    def test_vote_queries_fast_sessions(self):
+        """
+        With POLLS_FAST_SESSIONS a vote reads the session from the cache and
+        keeps its messages in a cookie, so it needs 4 queries fewer than the 14 above.
+        """
+        self.client.force_login(self.user)
+        question, choices = self.make_question(2)
+        url = reverse('polls:vote', args=(question.id,))
+        self.client.post(url, {'choice': choices[0].id})
+        # user, question, choices; cast(): savepoint, previous choice, upsert,
+        # two counters, event, release
+        with self.assertNumQueries(10):
+            response = self.client.post(url, {'choice': choices[-1].id})
+        self.assertIn('messages', response.cookies)
+        self.assertContains(self.client.get(response.url), 'has been saved.')
+
+
+@override_settings(POLLS_SERVER_TIMING=True, POLLS_INSTRUMENTATION_SAMPLE_RATE=0.0)
+class InstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Instrumented?', days=-1)
+        self.choices = create_choices(self.question, 'Yes', 'No')
+
+    def test_server_timing_header(self):
+        """
+        Responses report their query count, template time and session writes.
+        """
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('"2 queries"', timing)
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('session;desc="0 writes"', timing)
+
+    def test_vote_session_write(self):
+        """
+        The success message stored by a vote counts as a session write.
+        """
+        self.client.force_login(User.objects.create_user(username='voter', password='pass1234'))
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choices[0].id})
+        self.assertIn('session;desc="1 writes"', response['Server-Timing'])
+
+    @override_settings(POLLS_REQUEST_BUDGETS={'polls:detail': {'queries': 1}})
+    def test_over_budget_logged(self):
+        """
+        Requests over their query budget are logged as a warning, sampled or not.
+        """
+        with self.assertLogs('polls.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['url_name'], 'polls:detail')
+        self.assertEqual(record['queries'], 2)
+        self.assertEqual(record['over_budget'], ['queries'])
+
+    def test_sampling(self):
+        """
+        Requests within budget are only logged when sampled.
+        """
+        url = reverse('polls:detail', args=(self.question.id,))
+        with mock.patch('polls.middleware.logger') as logger:
+            self.client.get(url)
+        logger.log.assert_not_called()
+        with override_settings(POLLS_INSTRUMENTATION_SAMPLE_RATE=1.0), self.assertLogs('polls.instrumentation', 'INFO'):
+            self.client.get(url)
+
+    @override_settings(POLLS_SERVER_TIMING=False)
+    def test_header_disabled(self):
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertNotIn('Server-Timing', response)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        self.settings_override = override_settings(POLLS_PROFILE_DIR=self.profile_dir.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.question = create_question(question_text='Profiled?', days=-1)
+        self.url = reverse('polls:detail', args=(self.question.id,))
+
+    def test_staff_profile(self):
+        """
+        Staff requests with ?profile=1 are profiled and report the slowest functions.
+        """
+        self.client.force_login(User.objects.create_user(username='staff', password='pass1234', is_staff=True))
+        response = self.client.get(self.url, {'profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('(dispatch)', response['X-Profile-Top'])
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir.name, response['X-Profile-File'])))
+
+        response = self.client.get(self.url, HTTP_X_POLLS_PROFILE='1')
+        self.assertIn('X-Profile-Top', response)
+
+    def test_not_triggered(self):
+        """
+        Non-staff users and requests without the trigger are not profiled.
+        """
+        self.client.force_login(User.objects.create_user(username='voter', password='pass1234'))
+        self.assertNotIn('X-Profile-Top', self.client.get(self.url, {'profile': '1'}))
+        self.client.force_login(User.objects.create_user(username='staff', password='pass1234', is_staff=True))
+        self.assertNotIn('X-Profile-Top', self.client.get(self.url))
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+
+    def test_size_cap(self):
+        """
+        Old profiles are removed once the directory is over its size cap.
+        """
+        self.client.force_login(User.objects.create_user(username='staff', password='pass1234', is_staff=True))
+        with override_settings(POLLS_PROFILE_MAX_BYTES=1):
+            for _ in range(3):
+                response = self.client.get(self.url, {'profile': '1'})
+        self.assertEqual(os.listdir(self.profile_dir.name), [response['X-Profile-File']])
+
+
+class StreamClient:
+    """
+    Fake ASGI client for one request, recording what the application sends.
+    """
+
+    def __init__(self, app, path, root_path=''):
+        self.messages = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        scope = {'type': 'http', 'method': 'GET', 'path': root_path + path, 'root_path': root_path}
+        self.task = asyncio.ensure_future(app(scope, self.receive, self.messages.put))
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def next(self):
+        return await asyncio.wait_for(self.messages.get(), timeout=5)
+
+    async def close(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, timeout=5)
+
+
+@override_settings(POLLS_LIVE_INTERVAL=0.01)
+class LiveResultsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Live?', days=-1)
+        self.choices = create_choices(self.question, 'Yes', 'No')
+        self.passed_on = []
+        self.app = LiveResultsApp(self.django_app)
+
+    async def django_app(self, scope, receive, send):
+        self.passed_on.append(scope['path'])
+
+    def add_votes(self, choice, votes):
+        for _ in range(votes):
+            Choice.objects.filter(pk=choice.pk).update(vote_count=F('vote_count') + 1)
+            bump_results_version(self.question.id)
+
+    @staticmethod
+    def tallies(message):
+        data = message['body'].decode().split('data: ', 1)[1]
+        return {choice['id']: choice['vote_count'] for choice in json.loads(data)}
+
+    def test_stream(self):
+        """
+        Subscribers share one broadcaster and get coalesced tally updates.
+        """
+        async def scenario():
+            path = f'/polls/{self.question.id}/live/'
+            clients = [StreamClient(self.app, path), StreamClient(self.app, path)]
+            for client in clients:
+                start = await client.next()
+                self.assertEqual(start['status'], 200)
+                self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+                self.assertEqual(self.tallies(await client.next())[self.choices[0].id], 0)
+            self.assertEqual(len(self.app.broadcasters), 1)
+
+            await sync_to_async(self.add_votes)(self.choices[0], 3)
+            for client in clients:
+                self.assertEqual(self.tallies(await client.next())[self.choices[0].id], 3)
+
+            for client in clients:
+                await client.close()
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.app.broadcasters, {})
+
+        async_to_sync(scenario)()
+
+    def test_unpublished_question(self):
+        """
+        Streams of unknown or unpublished questions answer 404.
+        """
+        future = create_question(question_text='Later?', days=5)
+
+        async def scenario():
+            client = StreamClient(self.app, f'/polls/{future.id}/live/')
+            self.assertEqual((await client.next())['status'], 404)
+            await client.close()
+
+        async_to_sync(scenario)()
+
+    def test_other_requests_passed_on(self):
+        async def scenario():
+            await self.app({'type': 'http', 'method': 'GET', 'path': '/polls/'}, None, None)
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.passed_on, ['/polls/'])
+
+    def test_mounted_under_root_path(self):
+        """
+        The live URL is found by the URL resolver, also below an ASGI root_path.
+        """
+        async def scenario():
+            client = StreamClient(self.app, reverse('polls:live', args=(self.question.id,)), root_path='/ku')
+            self.assertEqual((await client.next())['status'], 200)
+            await client.close()
+            await self.app({'type': 'http', 'method': 'GET', 'path': '/polls/1/live/extra/'}, None, None)
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.passed_on, ['/polls/1/live/extra/'])
+
+    def test_wsgi_fallback(self):
+        """
+        Without ASGI the live URL answers 204 so EventSource stops reconnecting.
+        """
+        response = self.client.get(reverse('polls:live', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 204)
+
+
+class ResultsAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='API?', days=-1)
+        self.choices = create_choices(self.question, 'Yes', 'No')
+        self.url = reverse('polls:api-results', args=(self.question.id,))
+
+    def test_results(self):
+        response = self.client.get(self.url, {'fields': 'id,vote_count'})
+        self.assertEqual(response.json(), {
+            'id': self.question.id,
+            'poll_type': Question.SINGLE,
+            'total_votes': 0,
+            'choices': [{'id': choice.id, 'vote_count': 0} for choice in self.choices],
+        })
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_not_modified(self):
+        """
+        A matching ETag or Last-Modified is answered with 304 and no queries.
+        """
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_vote_changes_etag(self):
+        """
+        A vote gives the results a new ETag, so the old one gets a fresh body.
+        """
+        etag = self.client.get(self.url)['ETag']
+        user = User.objects.create_user(username='voter', password='pass1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(user, self.question, self.choices[1])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['total_votes'], 1)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {'fields': 'secret'}).status_code, 400)
+        future = create_question(question_text='Later?', days=5)
+        self.assertEqual(self.client.get(reverse('polls:api-results', args=(future.id,))).status_code, 404)
+
+    def test_missing_question_leaves_no_cache_keys(self):
+        """
+        Probing ids that do not exist does not fill the cache with version keys.
+        """
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            for question_id in range(1000, 1010):
+                response = self.client.get(reverse('polls:api-results', args=(question_id,)))
+                self.assertEqual(response.status_code, 404)
+        add.assert_not_called()
+
+
+class QuestionsAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.questions = [create_question(question_text=f'Question {i}?', days=-i - 1) for i in range(3)]
+        self.url = reverse('polls:api-questions')
+
+    def test_pagination(self):
+        """
+        The list is paged with cursors and only carries the requested fields.
+        """
+        first = self.client.get(self.url, {'limit': 2, 'fields': 'id,state'}).json()
+        self.assertEqual(first['results'], [{'id': question.id, 'state': Question.OPEN}
+                                            for question in self.questions[:2]])
+        second = self.client.get(self.url, {'limit': 2, 'fields': 'id', 'cursor': first['next_cursor']}).json()
+        self.assertEqual(second, {'results': [{'id': self.questions[2].id}], 'next_cursor': None})
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, 400)
+
+    def test_not_modified_until_question_changes(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_question(question_text='Newer?', days=0)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class VoteTrendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Trend?', days=-1)
+        self.red, self.blue = create_choices(self.question, 'Red', 'Blue')
+        self.alice, self.bob = (User.objects.create_user(username=name, password='pass1234')
+                                for name in ('alice', 'bob'))
+        self.url = reverse('polls:api-trend', args=(self.question.id,))
+        # On the hour, so the first minutes fall in one hourly interval
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=1)
+
+    def vote(self, user, choice, minute):
+        Vote.objects.cast(user, self.question, choice)
+        VoteEvent.objects.filter(pk=VoteEvent.objects.latest('pk').pk).update(
+            created_at=self.start + datetime.timedelta(minutes=minute, seconds=30))
+
+    def test_votes_are_logged(self):
+        """
+        Casting, switching and withdrawing a vote each append one event.
+        """
+        Vote.objects.cast(self.alice, self.question, self.red)
+        Vote.objects.cast(self.alice, self.question, self.red)
+        Vote.objects.cast(self.alice, self.question, self.blue)
+        Vote.objects.withdraw(Vote.objects.filter(user=self.alice))
+        self.assertEqual(list(VoteEvent.objects.order_by('pk').values_list('kind', 'choice', 'previous_choice')), [
+            (VoteEvent.CAST, self.red.id, None),
+            (VoteEvent.SWITCH, self.blue.id, self.red.id),
+            (VoteEvent.WITHDRAW, self.blue.id, None),
+        ])
+
+    def test_reset_logs_withdrawals_in_one_statement(self):
+        """
+        Resetting a poll logs a withdrawal per vote without a query per vote.
+        """
+        def reset(voters):
+            for voter in voters:
+                Vote.objects.cast(voter, self.question, self.red)
+            with CaptureQueriesContext(connection) as queries:
+                Vote.objects.reset([self.question.id])
+            return len(queries)
+
+        few = reset([self.alice, self.bob])
+        many = reset([User.objects.create_user(username=f'voter{i}', password='pass1234') for i in range(20)])
+        self.assertEqual(many, few)
+        withdrawn = VoteEvent.objects.filter(kind=VoteEvent.WITHDRAW)
+        self.assertEqual(withdrawn.count(), 22)
+        self.assertEqual(set(withdrawn.values_list('question', 'choice', 'previous_choice')),
+                         {(self.question.id, self.red.id, None)})
+        self.assertEqual(withdrawn.filter(user=self.alice).count(), 1)
+
+    def test_roll_up_is_incremental(self):
+        """
+        Each run folds only the events after the high-water mark, and skips events inside the lag.
+        """
+        self.vote(self.alice, self.red, 0)
+        self.vote(self.bob, self.red, 0)
+        self.assertEqual(roll_up(lag=0), 2)
+        self.assertEqual(roll_up(lag=0), 0)
+        self.vote(self.alice, self.blue, 0)
+        Vote.objects.cast(self.bob, self.question, self.blue)
+        self.assertEqual(roll_up(lag=60), 1)
+        self.assertEqual(rollup_position(), VoteEvent.objects.order_by('-pk')[1].pk)
+        self.assertEqual(set(VoteRollup.objects.values_list('choice', 'added', 'removed')),
+                         {(self.red.id, 2, 1), (self.blue.id, 1, 0)})
+
+    def test_trend(self):
+        """
+        The trend endpoint reports each interval from the rollups alone.
+        """
+        self.vote(self.alice, self.red, 0)
+        self.vote(self.bob, self.red, 1)
+        self.vote(self.alice, self.blue, 1)
+        call_command('rollup_votes', lag=0, stdout=StringIO())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertFalse(any(VoteEvent._meta.db_table in query['sql'] for query in queries))
+        intervals = response.json()['intervals']
+        self.assertEqual([interval['choices'] for interval in intervals], [
+            [{'id': self.red.id, 'added': 1, 'removed': 0}],
+            [{'id': self.red.id, 'added': 1, 'removed': 1}, {'id': self.blue.id, 'added': 1, 'removed': 0}],
+        ])
+        hourly = self.client.get(self.url, {'interval': 'hour', 'since': self.start.isoformat()}).json()
+        self.assertEqual(hourly['intervals'][0]['choices'][0], {'id': self.red.id, 'added': 2, 'removed': 1})
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {'interval': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+
+
+class BulkLoadTests(TestCase):
+    fixtures_files = [str(settings.BASE_DIR / 'data' / name) for name in ('users.json', 'polls-no-vote.json')]
+
+    def snapshot(self):
+        return {model._meta.label: list(model.objects.order_by('pk').values())
+                for model in (User, Question, Choice, Vote)}
+
+    def test_same_as_loaddata(self):
+        """
+        bulkload leaves the database exactly as loaddata does, also over existing rows.
+        """
+        call_command('loaddata', *self.fixtures_files, verbosity=0)
+        expected = self.snapshot()
+        self.assertEqual(len(expected['polls.Choice']), 30)
+
+        call_command('bulkload', *self.fixtures_files, '--chunk-size', '7', stdout=StringIO())
+        self.assertEqual(self.snapshot(), expected)
+
+        for model in (Choice, Question, User):
+            model.objects.all().delete()
+        out = StringIO()
+        call_command('bulkload', *self.fixtures_files, '--chunk-size', '7', stdout=out)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertIn('polls.Choice: 30', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+    def test_missing_foreign_key(self):
+        """
+        A chunk referring to a missing row is rejected without writing any of it.
+        """
+        fixture = json.dumps([
+            {'model': 'polls.question', 'pk': 1, 'fields': {'question_text': 'Q?', 'pub_date': '2023-09-22T15:41:29Z'}},
+            {'model': 'polls.choice', 'pk': 1, 'fields': {'question': 1, 'choice_text': 'A'}},
+            {'model': 'polls.choice', 'pk': 2, 'fields': {'question': 99, 'choice_text': 'B'}},
+        ])
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write(fixture)
+            f.flush()
+            with self.assertRaisesMessage(CommandError, 'polls.Choice.question refers to missing polls.Question'):
+                call_command('bulkload', f.name, stdout=StringIO())
+        self.assertFalse(Question.objects.exists())
+        self.assertFalse(Choice.objects.exists())
+
+
+class PollImportTests(TestCase):
+    CSV = (
+        "question_text,pub_date,end_date,choice,choice,choice\n"
+        "Best season?,2024-06-01T09:00:00+00:00,2024-06-08T09:00:00+00:00,Spring,Summer,Autumn\n"
+        "Best pet?,2024-06-02T09:00:00,,Cat,Dog,\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser(username='admin', password='pass1234'))
+        self.url = reverse('polls:api-import')
+
+    def batch(self, count):
+        return [{'question_text': f"Poll {i}?", 'pub_date': '2024-06-01T09:00:00+00:00',
+                 'choices': ['Yes', 'No']} for i in range(count)]
+
+    def post(self, data, content_type='application/json', **params):
+        body = json.dumps(data) if content_type == 'application/json' else data
+        url = self.url + ('?' + '&'.join(f'{key}={value}' for key, value in params.items()) if params else '')
+        return self.client.post(url, body, content_type=content_type)
+
+    def test_command_imports_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as batch:
+            batch.write(self.CSV)
+        self.addCleanup(os.remove, batch.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_polls', batch.name, stdout=StringIO())
+
+        season = Question.objects.get(question_text='Best season?')
+        self.assertEqual(season.end_date, datetime.datetime(2024, 6, 8, 9, tzinfo=datetime.timezone.utc))
+        self.assertEqual([choice.choice_text for choice in season.choice_set.order_by('pk')],
+                         ['Spring', 'Summer', 'Autumn'])
+        self.assertEqual(Question.objects.get(question_text='Best pet?').choice_set.count(), 2)
+        self.assertEqual([question.id for question in get_index().search(Question.objects.all(), ['summer'])],
+                         [season.id])
+
+    def test_command_reports_every_invalid_row(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as batch:
+            batch.write(self.CSV + ",2024-06-03T09:00:00,2024-06-01T09:00:00,Only\nLate?,tomorrow,,A,B\n")
+        self.addCleanup(os.remove, batch.name)
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, "2 row(s) have errors; no polls were created."):
+            call_command('import_polls', batch.name, stdout=StringIO(), stderr=err)
+        self.assertIn("Row 4: question_text: This field cannot be blank.", err.getvalue())
+        self.assertIn("Row 4: end_date: The end date must be after the publication date.", err.getvalue())
+        self.assertIn("Row 4: choices: A poll needs at least 2 choices.", err.getvalue())
+        self.assertIn("Row 5: pub_date: Enter an ISO 8601 date and time.", err.getvalue())
+        self.assertFalse(Question.objects.exists())
+
+    def test_endpoint_imports_json(self):
+        response = self.post(self.batch(2))
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['created']
+        self.assertEqual([question['question_text'] for question in created], ['Poll 0?', 'Poll 1?'])
+        self.assertEqual(list(Choice.objects.filter(question_id=created[1]['id']).values_list('choice_text', flat=True)),
+                         ['Yes', 'No'])
+
+    def test_endpoint_bulk_inserts(self):
+        """
+        A larger batch takes no more queries: nothing is saved one row at a time.
+        """
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.batch(2))
+        with CaptureQueriesContext(connection) as large:
+            self.post(self.batch(50))
+        self.assertEqual(Question.objects.count(), 52)
+        self.assertEqual(len(large), len(small))
+
+    def test_other_databases_save_each_question(self):
+        """
+        Outside SQLite the ids are not read back as the newest rows.
+        """
+        Question.objects.create(question_text='Existing?', pub_date=timezone.now())
+        with mock.patch.object(connection, 'vendor', 'mysql'), \
+                mock.patch.object(Question.objects, 'bulk_create', side_effect=AssertionError) as bulk_create:
+            response = self.post(self.batch(2))
+        bulk_create.assert_not_called()
+        for question in response.json()['created']:
+            self.assertEqual(Question.objects.get(pk=question['id']).question_text, question['question_text'])
+            self.assertEqual(Choice.objects.filter(question_id=question['id']).count(), 2)
+
+    def test_endpoint_rejects_whole_batch(self):
+        batch = self.batch(3)
+        batch[1]['poll_type'] = 'plurality'
+        batch[2]['choices'] = ['Yes', 'Yes']
+        response = self.post(batch)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'row': 2, 'errors': {'poll_type': ["Value 'plurality' is not a valid choice."]}},
+            {'row': 3, 'errors': {'choices': ["Each choice must have a different text."]}},
+        ])
+        self.assertFalse(Question.objects.exists())
+
+    def test_endpoint_dry_run(self):
+        response = self.post(self.CSV, content_type='text/csv', dry_run=1)
+        self.assertEqual(response.json(), {'valid': 2})
+        self.assertFalse(Question.objects.exists())
+
+    def test_endpoint_rejects_bad_requests(self):
+        self.assertEqual(self.post('[1]').status_code, 400)
+        self.assertEqual(self.post('<polls/>', content_type='text/xml').status_code, 415)
+        self.client.force_login(User.objects.create_user(username='voter', password='pass1234'))
+        self.assertEqual(self.post(self.batch(1)).status_code, 403)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Export?', days=-1)
+        self.choices = create_choices(self.question, 'Yes', 'No')
+        self.other = create_question(question_text='Other?', days=-1)
+        other_choices = create_choices(self.other, 'Maybe')
+        self.voter = User.objects.create_user(username='voter', password='pass1234')
+        Vote.objects.cast(self.voter, self.question, self.choices[1])
+        Vote.objects.cast(self.voter, self.other, other_choices[0])
+
+    def test_staff_only(self):
+        url = reverse('polls:export', args=('votes', 'csv'))
+        self.client.force_login(self.voter)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_vote_csv(self):
+        """
+        Votes stream as CSV, optionally limited to some questions.
+        """
+        self.client.force_login(User.objects.create_user(username='staff', password='pass1234', is_staff=True))
+        response = self.client.get(reverse('polls:export', args=('votes', 'csv')), {'question': self.question.id})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(), [
+            'question_id,choice_id,user_id,username',
+            f'{self.question.id},{self.choices[1].id},{self.voter.id},voter',
+        ])
+        self.assertEqual(self.client.get(reverse('polls:export', args=('votes', 'xml'))).status_code, 404)
+
+    def test_tallies_ndjson_command(self):
+        out = StringIO()
+        call_command('export_polls', 'tallies', '--format', 'ndjson', '--question', str(self.question.id), stdout=out)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], [
+            {'question_id': self.question.id, 'question_text': 'Export?', 'choice_id': choice.id,
+             'choice_text': choice.choice_text, 'vote_count': count}
+            for choice, count in zip(self.choices, (0, 1))
+        ])
+
+
+class BallotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Best fruit?', days=-1)
+        self.question.poll_type = Question.RANKED
+        self.question.save()
+        self.apple, self.banana, self.cherry = create_choices(self.question, 'Apple', 'Banana', 'Cherry')
+        self.voter = User.objects.create_user(username='voter', password='pass1234')
+
+    def vote_counts(self):
+        return list(Choice.objects.filter(question=self.question).order_by('pk').values_list('vote_count', flat=True))
+
+    def runoff(self, *ballots):
+        choices = [(choice.id, choice.choice_text) for choice in (self.apple, self.banana, self.cherry)]
+        return BallotBox(choices, [pack([choice.id for choice in ballot]) for ballot in ballots]).runoff()
+
+    def test_approval_counts_every_choice(self):
+        """
+        Every approved choice counts, and a new ballot moves only the changed choices.
+        """
+        self.question.poll_type = Question.APPROVAL
+        self.question.save()
+        self.assertIsNone(Ballot.objects.cast(self.voter, self.question, [self.cherry.id, self.apple.id]))
+        self.assertEqual(self.vote_counts(), [1, 0, 1])
+        self.assertEqual(Ballot.objects.cast(self.voter, self.question, [self.banana.id, self.apple.id]),
+                         [self.apple.id, self.cherry.id])
+        self.assertEqual(self.vote_counts(), [1, 1, 0])
+        self.assertEqual(Ballot.objects.get().choice_ids, [self.apple.id, self.banana.id])
+
+    def test_ranked_counts_first_preference(self):
+        Ballot.objects.cast(self.voter, self.question, [self.cherry.id, self.apple.id])
+        self.assertEqual(self.vote_counts(), [0, 0, 1])
+        Ballot.objects.cast(self.voter, self.question, [self.apple.id, self.cherry.id])
+        self.assertEqual(self.vote_counts(), [1, 0, 0])
+        self.assertEqual(Ballot.objects.get().choice_ids, [self.apple.id, self.cherry.id])
+
+    def test_invalid_ballot(self):
+        with self.assertRaises(ValueError):
+            Ballot.objects.cast(self.voter, self.question, [])
+        with self.assertRaises(ValueError):
+            Ballot.objects.cast(self.voter, self.question, [self.apple.id, self.apple.id])
+
+    def test_runoff_transfers_votes(self):
+        """
+        Without a majority the last choice is eliminated and its ballots move on.
+        """
+        runoff = self.runoff(*[[self.apple]] * 4, *[[self.banana, self.cherry]] * 3,
+                             *[[self.cherry, self.banana]] * 2)
+        self.assertEqual(runoff['ballots'], 9)
+        self.assertEqual([[count['votes'] for count in rnd['counts']] for rnd in runoff['rounds']],
+                         [[4, 3, 2], [4, 5]])
+        self.assertEqual(runoff['rounds'][0]['eliminated']['id'], self.cherry.id)
+        self.assertEqual(runoff['winner']['id'], self.banana.id)
+
+    def test_runoff_exhausted_ballots(self):
+        """
+        Ballots with no continuing choice stop counting toward the majority.
+        """
+        runoff = self.runoff(*[[self.apple]] * 3, *[[self.banana]] * 2, [self.cherry])
+        self.assertEqual(runoff['rounds'][1]['exhausted'], 1)
+        self.assertEqual(runoff['winner']['id'], self.apple.id)
+
+    def test_runoff_tie_break(self):
+        """
+        A tie for last is broken by the earlier round, then against the later choice.
+        """
+        runoff = self.runoff([self.apple], [self.banana], [self.cherry], [self.cherry])
+        self.assertEqual(runoff['rounds'][0]['eliminated']['id'], self.banana.id)
+        self.assertIsNone(self.runoff()['winner'])
+
+    def test_vote_view(self):
+        """
+        The ranks posted by the form become the ballot, and the results page shows the winner.
+        """
+        self.client.login(username='voter', password='pass1234')
+        url = reverse('polls:vote', args=(self.question.id,))
+        response = self.client.post(url, {f'rank_{self.apple.id}': '2', f'rank_{self.banana.id}': '1'})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual(Ballot.objects.get().choice_ids, [self.banana.id, self.apple.id])
+
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Winner: Banana')
+
+    def test_vote_view_duplicate_rank(self):
+        self.client.login(username='voter', password='pass1234')
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                    {f'rank_{self.apple.id}': '1', f'rank_{self.banana.id}': '1'})
+        self.assertContains(response, "Give each choice you rank a different rank.")
+        self.assertFalse(Ballot.objects.exists())
+        # The form comes back with the ranks as submitted
+        self.assertEqual([item['rank'] for item in response.context['ballot_choices']], [1, 1, None])
+
+    def test_vote_view_rejects_non_numbers(self):
+        """
+        Values that only look like digits are errors, not server errors.
+        """
+        self.client.login(username='voter', password='pass1234')
+        url = reverse('polls:vote', args=(self.question.id,))
+        response = self.client.post(url, {f'rank_{self.apple.id}': '\u00b2', f'rank_{self.banana.id}': '2'})
+        self.assertContains(response, "Ranks must be numbers.")
+        self.assertEqual([item['rank'] for item in response.context['ballot_choices']], [None, 2, None])
+
+        Question.objects.filter(pk=self.question.pk).update(poll_type=Question.APPROVAL)
+        response = self.client.post(url, {'choice': ['\u00b2', str(self.banana.id)]})
+        self.assertContains(response, "select a choice.")
+        self.assertEqual([item['selected'] for item in response.context['ballot_choices']], [False, True, False])
+
+    def test_no_trend_or_vote_export(self):
+        """
+        Ballots are not vote events, so the trend and the votes export refuse ballot polls.
+        """
+        response = self.client.get(reverse('polls:api-trend', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaisesMessage(CommandError, "Only single-choice polls have votes to export"):
+            call_command('export_polls', 'votes', '--question', str(self.question.id), stdout=StringIO())
+
+    def test_runoff_cached_until_next_ballot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Ballot.objects.cast(self.voter, self.question, [self.apple.id])
+        self.assertEqual(get_runoff(self.question)['winner']['id'], self.apple.id)
+        with self.assertNumQueries(0):
+            get_runoff(self.question)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ballot.objects.cast(self.voter, self.question, [self.cherry.id])
+        self.assertEqual(get_runoff(self.question)['winner']['id'], self.cherry.id)
+
+    def test_recount_from_ballots(self):
+        """
+        Snapshots and rebuild_vote_counts count ballot polls from their ballots.
+        """
+        Ballot.objects.cast(self.voter, self.question, [self.banana.id, self.apple.id])
+        self.assertEqual([choice['vote_count'] for choice in ResultSnapshot.objects.tally(self.question.id)], [0, 1, 0])
+        Choice.objects.filter(pk=self.banana.pk).update(vote_count=5)
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.assertEqual(self.vote_counts(), [0, 1, 0])
+
+    def test_poll_type_locked_after_votes(self):
+        Ballot.objects.cast(self.voter, self.question, [self.apple.id])
+        self.question.poll_type = Question.SINGLE
+        with self.assertRaises(ValidationError):
+            self.question.full_clean()
+
+    def test_tally_benchmark(self):
+        report = run_tally_benchmark(ballots=500, choices=4, rng=random.Random(1))
+        self.assertEqual(report['ballots'], 500)
+        self.assertTrue(report['same_winner'])
+
+
+class ResultSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Closed?', days=-10)
+        self.question.end_date = timezone.now() - datetime.timedelta(days=1)
+        self.question.save()
+        self.choices = create_choices(self.question, 'Yes', 'No')
+        self.voter = User.objects.create_user(username='voter', password='pass1234')
+        Vote.objects.create(user=self.voter, question=self.question, choice=self.choices[0])
+
+    def test_frozen_on_first_read(self):
+        """
+        The first read of a closed poll freezes its tallies; later reads use the snapshot only.
+        """
+        self.assertFalse(ResultSnapshot.objects.exists())
+        self.assertEqual([choice['vote_count'] for choice in get_results(self.question)], [1, 0])
+        self.assertEqual(ResultSnapshot.objects.get().counts[0]['vote_count'], 1)
+
+        Vote.objects.all().delete()
+        with self.assertNumQueries(0):
+            self.assertEqual([choice['vote_count'] for choice in get_results(self.question)], [1, 0])
+
+    def test_open_poll_not_frozen(self):
+        question = create_question(question_text='Open?', days=-1)
+        get_results(question)
+        self.assertFalse(ResultSnapshot.objects.exists())
+
+    def test_reopened_poll_thawed(self):
+        """
+        Editing a frozen question drops its snapshot.
+        """
+        get_results(self.question)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.end_date = None
+            self.question.save()
+        self.assertFalse(ResultSnapshot.objects.exists())
+        self.assertEqual(get_results(self.question)[0]['vote_count'], 0)
+
+    def test_finalize_command(self):
+        create_question(question_text='Open?', days=-1)
+        call_command('finalize_results', stdout=StringIO())
+        self.assertEqual(list(ResultSnapshot.objects.values_list('question_id', flat=True)), [self.question.id])
+
+    def test_verify_command(self):
+        """
+        verify_snapshots reports drift from the votes table and --fix repairs it.
+        """
+        call_command('finalize_results', stdout=StringIO())
+        call_command('verify_snapshots', stdout=StringIO())
+        Vote.objects.create(user=User.objects.create_user(username='late', password='pass1234'),
+                            question=self.question, choice=self.choices[1])
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, '1 snapshot(s) out of sync.'):
+            call_command('verify_snapshots', stdout=out)
+        self.assertIn('snapshot=Yes=1, No=0, actual=Yes=1, No=1', out.getvalue())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('verify_snapshots', '--fix', stdout=StringIO())
+        self.assertEqual([choice['vote_count'] for choice in get_results(self.question)], [1, 1])
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='pass1234')
+        self.client.force_login(self.admin)
+        self.voters = [User.objects.create_user(username=f'voter{i}', password='pass1234') for i in range(3)]
+
+    def make_polls(self, count):
+        polls = []
+        for i in range(count):
+            question = create_question(question_text=f'Poll {i}?', days=-1)
+            choices = create_choices(question, 'Yes', 'No')
+            for voter in self.voters:
+                Vote.objects.cast(voter, question, choices[0])
+            polls.append((question, choices))
+        return polls
+
+    def test_changelist_queries_do_not_grow(self):
+        """
+        Vote totals come from the changelist query, not one query per question.
+        """
+        url = reverse('admin:polls_question_changelist')
+        self.make_polls(2)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertContains(response, '<td class="field-total_votes">3</td>', count=2, html=True)
+        self.make_polls(8)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(many), len(few))
+
+    def test_close_now(self):
+        (open_poll, _), (closed_poll, _) = self.make_polls(2)
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        Question.objects.filter(pk=closed_poll.pk).update(end_date=yesterday)
+        self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'close_now', '_selected_action': [open_poll.pk, closed_poll.pk],
+        })
+        open_poll.refresh_from_db()
+        closed_poll.refresh_from_db()
+        self.assertFalse(open_poll.can_vote())
+        self.assertEqual(closed_poll.end_date, yesterday)
+
+    def test_reset_votes(self):
+        """
+        Resetting votes deletes them and zeroes the counters and cached results.
+        """
+        (question, choices), (other, _) = self.make_polls(2)
+        get_results(question)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:polls_question_changelist'), {
+                'action': 'reset_votes', '_selected_action': [question.pk],
+            })
+        self.assertFalse(Vote.objects.filter(question=question).exists())
+        self.assertEqual(Vote.objects.filter(question=other).count(), 3)
+        self.assertEqual([choice['vote_count'] for choice in get_results(question)], [0, 0])
+
+    def test_delete_votes_updates_counters(self):
+        [(question, choices)] = self.make_polls(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:polls_vote_changelist'), {
+                'action': 'delete_selected', 'post': 'yes',
+                '_selected_action': list(Vote.objects.filter(user__in=self.voters[:2]).values_list('pk', flat=True)),
+            })
+        self.assertEqual(Choice.objects.get(pk=choices[0].pk).vote_count, 1)
+        self.assertEqual(get_results(question)[0]['vote_count'], 1)
+
+    def test_add_vote(self):
+        """
+        Votes added in the admin go through cast(), so the counters follow.
+        """
+        [(question, choices)] = self.make_polls(1)
+        voter = User.objects.create_user(username='late', password='pass1234')
+        response = self.client.post(reverse('admin:polls_vote_add'), {
+            'user': voter.pk, 'question': question.pk, 'choice': choices[1].pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Choice.objects.get(pk=choices[1].pk).vote_count, 1)
+        other = create_question(question_text='Other?', days=-1)
+        response = self.client.post(reverse('admin:polls_vote_add'), {
+            'user': voter.pk, 'question': other.pk, 'choice': choices[1].pk,
+        })
+        self.assertContains(response, 'The choice does not belong to the question.')
+
+    def test_add_vote_to_finalized_poll(self):
+        """
+        A vote added after the results were frozen thaws them.
+        """
+        [(question, choices)] = self.make_polls(1)
+        question.end_date = timezone.now() - datetime.timedelta(days=1)
+        question.save()
+        self.assertEqual([choice['vote_count'] for choice in get_results(question)], [3, 0])
+        self.assertTrue(ResultSnapshot.objects.exists())
+
+        voter = User.objects.create_user(username='late', password='pass1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:polls_vote_add'), {
+                'user': voter.pk, 'question': question.pk, 'choice': choices[1].pk,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([choice['vote_count'] for choice in get_results(question)], [3, 1])
+        call_command('verify_snapshots', stdout=StringIO())
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_report(self):
+        """
+        The benchmark seeds consistent data and reports every view.
+        """
+        question_ids, user_ids = seed(questions=3, choices=2, users=2, vote_ratio=1.0)
+        self.assertEqual(Vote.objects.count(), 6)
+        self.assertEqual(sum(Choice.objects.values_list('vote_count', flat=True)), 6)
+        report = run_benchmark(question_ids, user_ids, requests=3)
+        self.assertEqual(set(report), {'index', 'detail', 'results', 'vote'})
+        self.assertEqual(report['detail']['max_queries'], 2)
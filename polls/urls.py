@@ -1,7 +1,7 @@
 from django.urls import path
 from django.views.generic import RedirectView
 
-from . import views
+from . import api, views
 
 app_name = 'polls'
 urlpatterns = [
@@ -9,4 +9,10 @@ urlpatterns = [
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('<int:question_id>/live/', views.live, name='live'),
+    path('export/<slug:kind>.<slug:fmt>', views.export, name='export'),
+    path('api/questions/', api.questions, name='api-questions'),
+    path('api/questions/import/', api.import_polls, name='api-import'),
+    path('api/questions/<int:question_id>/results/', api.results, name='api-results'),
+    path('api/questions/<int:question_id>/trend/', api.trend, name='api-trend'),
 ]
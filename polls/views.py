@@ -1,30 +1,120 @@
-from django.http import Http404, HttpResponseRedirect
+import re
+
+from django.conf import settings
+from django.db import router
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.urls import reverse
 from django.views import generic
 from django.contrib import messages
 from django.shortcuts import redirect
-from .models import Choice, Question
+from django.utils.functional import SimpleLazyObject
+from .cache import get_results, get_runoff, index_cache_timeout, index_version, voted_question_ids
+from .export import FORMATS, export_lines
+from .models import Ballot, Question, Vote
+from .pagination import KeysetPaginator
+from .search import SEARCH_ORDERING, search, search_words
+from .vote_queue import get_vote_queue
+
+VOTED_PLACEHOLDER = re.compile(rb'<!--voted:(\d+)-->')
+VOTED_MARK = b'<p class="voted">You have voted in this poll.</p>'
 
 
 class IndexView(generic.ListView):
     """
     View to display a list of all published questions, sorted by date.
 
+    The list is paginated with a cursor on (pub_date, id) so every page costs
+    the same, however far back the user pages. The rendered list is cached
+    until a question is saved or deleted or the next poll opens or closes;
+    on a cache hit the questions are never loaded. The cached list is the
+    same for every user; the marks on the polls the user voted in are added
+    to the rendered page.
+
+    With ?q= the list holds the questions whose text or choices match the
+    search instead, best match first, paged with a cursor on (rank, id).
+    Search results are not cached.
+
     Attributes:
         template_name (str): The name of the template to be used for rendering the view.
         context_object_name (str): The name of the context variable to store the queryset.
     """
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
+    ordering = ('-pub_date', '-id')
+
+    @cached_property
+    def search_words(self):
+        return search_words(self.request.GET.get('q', ''))
+
+    def get_ordering(self):
+        return SEARCH_ORDERING if self.search_words else self.ordering
 
     def get_queryset(self):
         """
-        Return all published questions, sorted by date (from newest to oldest).
+        Return all published questions, sorted by date (from newest to oldest),
+        or the ones matching the search, with only the columns the index
+        template needs and their voting state.
+        """
+        # Only read when the cached fragment misses; read from the primary so a
+        # lagging replica cannot leave a stale list cached until the next change.
+        now = timezone.now()
+        questions = (Question.objects.using(router.db_for_write(Question)).published(now).annotate_state(now)
+                     .only('id', 'question_text', 'pub_date', 'end_date'))
+        if self.search_words:
+            questions = search(questions, self.search_words)
+        return questions.order_by(*self.get_ordering())
+
+    def get_paginate_by(self, queryset):
+        return settings.POLLS_INDEX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Return the page that follows the `cursor` query parameter.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')
+        paginator = KeysetPaginator(queryset, self.get_ordering(), page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except ValueError:
+            raise Http404("Invalid page cursor.")
+        # Only evaluated when the cached index fragment misses
+        object_list = SimpleLazyObject(lambda: page.object_list)
+        return paginator, page, object_list, SimpleLazyObject(lambda: page.has_next or page.has_previous)
+
+    def get_context_data(self, **kwargs):
+        """
+        Add the cache version, timeout and key of the rendered question list.
+        """
+        context = super().get_context_data(**kwargs)
+        context['index_cache_version'] = index_version()
+        context['index_cache_timeout'] = index_cache_timeout()
+        context['index_cursor'] = context['page_obj'].cursor
+        context['search_query'] = self.request.GET.get('q', '').strip() if self.search_words else ''
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        response.add_post_render_callback(self.mark_voted)
+        return response
+
+    def mark_voted(self, response):
+        """
+        Replace the voted placeholder of each listed question with the
+        "You have voted" mark if the user voted in it, or with nothing.
+
+        The marks are added after rendering so that one cached question list
+        is shared by every user.
+        """
+        user = self.request.user
+        voted = frozenset()
+        if user.is_authenticated and VOTED_PLACEHOLDER.search(response.content):
+            voted = voted_question_ids(user.id)
+        response.content = VOTED_PLACEHOLDER.sub(
+            lambda match: VOTED_MARK if int(match[1]) in voted else b'', response.content)
 
 
 class DetailView(generic.DetailView):
@@ -45,7 +135,7 @@ class DetailView(generic.DetailView):
         Returns:
             QuerySet: A queryset of questions.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.published()
 
     def get_context_data(self, **kwargs):
         """
@@ -58,15 +148,45 @@ class DetailView(generic.DetailView):
         question = context['question']
         user = self.request.user
 
-        # Check if the user has voted for this question
-        if user.is_authenticated and question.choice_set.filter(votes=user).exists():
-            # Get the user's previous choice for this question
-            previous_choice = question.choice_set.get(votes=user)
-            context['previous_choice'] = previous_choice
+        if question.uses_ballots():
+            ballot = Ballot.objects.filter(user=user, question=question).first() if user.is_authenticated else None
+            context.update(ballot_context(question, question.choice_set.all(), ballot.choice_ids if ballot else []))
+            return context
+
+        # Get the user's previous choice for this question, if any
+        if user.is_authenticated:
+            vote = Vote.objects.select_related('choice').filter(user=user, question=question).first()
+            if vote is not None:
+                context['previous_choice'] = vote.choice
 
         return context
 
 
+def ballot_context(question, choices, choice_ids, ranks=None):
+    """
+    Return the template context for the ballot form of an approval or ranked-choice question.
+
+    Args:
+        choices (iterable): The question's choices.
+        choice_ids (list): The choices to show as selected (or ranked, in order).
+        ranks (dict): Rank of each ranked choice id, to show the ranks as
+            submitted instead of the order of `choice_ids`.
+
+    Returns:
+        dict: 'ballot_choices', one dict per choice with 'choice', 'selected'
+        and 'rank' (1 for the first preference, None if unranked), and
+        'ranks', the ranks that can be given.
+    """
+    if ranks is None:
+        ranks = {choice_id: rank for rank, choice_id in enumerate(choice_ids, start=1)}
+    ballot_choices = [{
+        'choice': choice,
+        'selected': choice.id in choice_ids,
+        'rank': ranks.get(choice.id),
+    } for choice in choices]
+    return {'ballot_choices': ballot_choices, 'ranks': range(1, len(ballot_choices) + 1)}
+
+
 class ResultsView(generic.DetailView):
     """
     View to display the results of a specific question.
@@ -85,16 +205,20 @@ class ResultsView(generic.DetailView):
         Returns:
             QuerySet: A queryset of questions.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.published()
 
     def get_context_data(self, **kwargs):
         """
-        Get additional context data for the view, including success messages.
+        Get additional context data for the view, including the cached tallies
+        and success messages.
 
         Returns:
             dict: A dictionary containing additional context data.
         """
         context = super().get_context_data(**kwargs)
+        context['results'] = get_results(context['question'])
+        if context['question'].poll_type == Question.RANKED:
+            context['runoff'] = get_runoff(context['question'])
 
         # Check for any success message in the messages framework
         success_messages = messages.get_messages(self.request)
@@ -123,27 +247,142 @@ def vote(request, question_id):
         messages.error(request, "Voting for this poll is not allowed at this time.")
         return HttpResponseRedirect(reverse('polls:detail', args=(question.id,)))
 
+    choices = {choice.pk: choice for choice in question.choice_set.all()}
+    if question.uses_ballots():
+        return cast_ballot(request, question, choices)
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
+        selected_choice = choices[int(request.POST['choice'])]
+    except (KeyError, ValueError):
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': "You didn't select a choice.",
         })
 
-    # Check if the user has already voted for this question
-    user = request.user
-    if question.choice_set.filter(votes=user).exists():
-        previous_choice = question.choice_set.get(votes=user)
-        # Remove the old vote
-        previous_choice.votes.remove(user)
-        messages.warning(request, f"Your old vote for '{previous_choice.choice_text}' has been removed.")
+    if settings.POLLS_VOTE_MODE == 'queued':
+        # Written by the vote queue within POLLS_VOTE_QUEUE_MAX_DELAY seconds
+        get_vote_queue().put(request.user.id, question.id, selected_choice.id)
+        messages.success(request, f"Your vote for '{selected_choice.choice_text}' has been received.")
+        return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+
+    # Insert the vote, or move it from the old choice, with a single upsert
+    previous_id = Vote.objects.cast(request.user, question, selected_choice)
+    if previous_id is not None and previous_id != selected_choice.pk:
+        messages.warning(request, f"Your old vote for '{choices[previous_id].choice_text}' has been removed.")
 
-    # Add the new vote
-    selected_choice.votes.add(user)
     messages.success(request, f"Your vote for '{selected_choice.choice_text}' has been saved.")
 
     return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
+def ballot_choice_ids(request, question, choices):
+    """
+    Read the choices of a ballot from the vote form.
+
+    An approval ballot posts the selected choice ids as 'choice'; a ranked
+    ballot posts the rank of each ranked choice as 'rank_<choice id>'.
+
+    Returns:
+        list: Choice ids, most preferred first on a ranked poll.
+
+    Raises:
+        ValueError: With the message to show if the ballot is empty or invalid.
+    """
+    if question.poll_type == Question.APPROVAL:
+        choice_ids = posted_choice_ids(request)
+        if not choice_ids or any(choice_id not in choices for choice_id in choice_ids):
+            raise ValueError("You didn't select a choice.")
+        return list(dict.fromkeys(choice_ids))
+
+    ranks = posted_ranks(request, choices)
+    if None in ranks.values():
+        raise ValueError("Ranks must be numbers.")
+    if not ranks:
+        raise ValueError("You didn't rank any choice.")
+    if len(set(ranks.values())) != len(ranks):
+        raise ValueError("Give each choice you rank a different rank.")
+    return sorted(ranks, key=ranks.get)
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
 
+
+def posted_choice_ids(request):
+    """
+    Returns:
+        list: The posted 'choice' values, with None for any that is not a number.
+    """
+    return [_parse_int(value) for value in request.POST.getlist('choice')]
+
+
+def posted_ranks(request, choices):
+    """
+    Returns:
+        dict: The posted rank of each ranked choice id, None if it is not a number.
+    """
+    return {choice_id: _parse_int(request.POST[f'rank_{choice_id}'])
+            for choice_id in choices if request.POST.get(f'rank_{choice_id}')}
+
+
+def cast_ballot(request, question, choices):
+    """
+    Record the ballot of an approval or ranked-choice question and redirect to its results.
+    """
+    try:
+        choice_ids = ballot_choice_ids(request, question, choices)
+    except ValueError as exc:
+        # Show the form as it was submitted, minus values that are not numbers
+        selected = [choice_id for choice_id in posted_choice_ids(request) if choice_id is not None]
+        ranks = {choice_id: rank for choice_id, rank in posted_ranks(request, choices).items() if rank is not None}
+        return render(request, 'polls/detail.html', {
+            'question': question,
+            'error_message': str(exc),
+            **ballot_context(question, choices.values(), selected, ranks),
+        })
+
+    previous_ids = Ballot.objects.cast(request.user, question, choice_ids)
+    if previous_ids is not None and previous_ids != choice_ids:
+        messages.warning(request, "Your old ballot has been replaced.")
+    messages.success(request, "Your ballot has been saved.")
+    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+
+
+def live(request, question_id):
+    """
+    Fallback for the live results stream when the site is not served over ASGI.
+
+    Under ASGI polls.live.LiveResultsApp answers this URL before it reaches
+    Django. Here a 204 tells the browser's EventSource not to reconnect, so the
+    results page stays as rendered.
+
+    Returns:
+        HttpResponse: An empty 204 response.
+    """
+    return HttpResponse(status=204)
+
+
+@staff_member_required
+def export(request, kind, fmt):
+    """
+    Stream every vote or every choice's tally as CSV or NDJSON, for staff only.
+
+    Args:
+        kind (str): 'votes' or 'tallies'.
+        fmt (str): 'csv' or 'ndjson'.
+
+    The export can be limited with one or more ?question=<id> parameters.
+
+    Returns:
+        StreamingHttpResponse: The export, sent as an attachment while it is read.
+    """
+    try:
+        question_ids = [int(question_id) for question_id in request.GET.getlist('question')]
+        lines = export_lines(kind, fmt, question_ids)
+    except ValueError:
+        raise Http404("No such export.")
+    response = StreamingHttpResponse(lines, content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
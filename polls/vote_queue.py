@@ -0,0 +1,156 @@
+"""
+Write-behind queue for votes.
+
+When POLLS_VOTE_MODE is 'queued', the vote view validates the request, puts
+the vote on an in-process queue and returns at once. A background thread
+applies queued votes in batches, one transaction per batch, so a spike of
+votes takes the database write lock a few times instead of once per vote.
+Within a batch only the last vote of each (user, question) is applied.
+
+A vote waits at most POLLS_VOTE_QUEUE_MAX_DELAY seconds before its batch is
+written, which bounds how stale the results can get. The queue is flushed
+when the process exits.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, transaction
+
+from .models import Choice, Question, Vote
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class VoteQueue:
+    """
+    In-process queue of votes applied in batches by a worker thread.
+
+    Attributes:
+        batch_size (int): The largest number of queued votes written in one transaction.
+        max_delay (float): The longest time in seconds a queued vote waits to be written.
+    """
+
+    def __init__(self, batch_size, max_delay):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, user_id, question_id, choice_id):
+        """
+        Queue a vote, starting the worker thread if it is not running.
+        """
+        self.start()
+        self._queue.put((user_id, question_id, choice_id))
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='polls-vote-queue', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def flush(self):
+        """
+        Block until every vote queued so far has been written.
+        """
+        self._queue.join()
+
+    def stop(self):
+        """
+        Write the remaining votes and stop the worker thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+            atexit.unregister(self.stop)
+
+    def _run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.max_delay
+                while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                stopping = batch[-1] is _STOP
+                votes = [item for item in batch if item is not _STOP]
+                try:
+                    if votes:
+                        self.apply(votes)
+                except Exception:
+                    logger.exception("Could not apply a batch of %d queued votes.", len(votes))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def coalesce(votes):
+        """
+        Keep only the last vote of each (user, question), in queue order.
+        """
+        latest = {}
+        for user_id, question_id, choice_id in votes:
+            latest.pop((user_id, question_id), None)
+            latest[(user_id, question_id)] = choice_id
+        return [(user_id, question_id, choice_id) for (user_id, question_id), choice_id in latest.items()]
+
+    def apply(self, votes):
+        """
+        Write a batch of (user_id, question_id, choice_id) votes in one transaction.
+
+        A vote that fails (e.g. its choice was deleted meanwhile) is logged and
+        skipped without losing the rest of the batch. The batch's questions,
+        choices and users are read with one query each, so votes on sharded
+        questions go to their shards and votes whose rows are gone are dropped
+        up front: SQLite checks foreign keys only at COMMIT, where one missing
+        row would fail the whole batch.
+        """
+        votes = self.coalesce(votes)
+        db = Vote.objects.write_db
+        with transaction.atomic(using=db):
+            questions = (Question.objects.using(db).only('id', 'end_date', 'counter_shards')
+                         .in_bulk({question_id for _, question_id, _ in votes}))
+            choices = set(Choice.objects.using(db).filter(
+                pk__in={choice_id for _, _, choice_id in votes}, question_id__in=questions,
+            ).values_list('id', 'question_id'))
+            users = User.objects.using(db).only('id').in_bulk({user_id for user_id, _, _ in votes})
+            for user_id, question_id, choice_id in votes:
+                if user_id not in users or (choice_id, question_id) not in choices:
+                    logger.warning("Dropped queued vote of user %s for choice %s on question %s: "
+                                   "the user, question or choice was deleted.", user_id, choice_id, question_id)
+                    continue
+                try:
+                    Vote.objects.cast(users[user_id], questions[question_id], Choice(pk=choice_id))
+                except DatabaseError:
+                    logger.exception("Could not apply queued vote of user %s on question %s.",
+                                     user_id, question_id)
+
+_vote_queue = None
+_vote_queue_lock = threading.Lock()
+
+
+def get_vote_queue():
+    """
+    Return the process-wide VoteQueue, configured from the settings.
+    """
+    global _vote_queue
+    with _vote_queue_lock:
+        if _vote_queue is None:
+            _vote_queue = VoteQueue(settings.POLLS_VOTE_QUEUE_BATCH_SIZE, settings.POLLS_VOTE_QUEUE_MAX_DELAY)
+        return _vote_queue